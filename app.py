@@ -6,151 +6,190 @@
 # - Multiplayer rooms with CODEs
 # - Real-time game state sync between players
 
-import random
-import string
-from flask import Flask, render_template, send_from_directory, request, jsonify
-from flask_socketio import SocketIO, emit, join_room, leave_room
-
-# Import our game data
-from game_data import (
-    get_random_tier1_weapon,
-    get_random_weapon_for_mystery_box,
-    get_random_ability,
-    get_random_map,
-    STORE_PRICES,
-    WIN_REWARD,
-    GRAVITY,
-    JUMP_STRENGTH,
-    PLAYER_SPEED,
-    PLAYER_WIDTH,
-    PLAYER_HEIGHT,
-    STARTING_HP,
-    ATTACK_COOLDOWN,
-    WEAPONS,
-    MAPS,
-    ABILITIES,
-)
+import os
+from flask import Flask, request, jsonify, abort
+from flask_socketio import SocketIO, join_room
+
+from game_server import GameServer, LOOP_ENTITIES, LOOP_RELAY, LOOP_SIMULATION
+from platform_index import compile_all_maps
+from room_backend import BACKEND_MEMORY, DEFAULT_PORT, get_backend
+from metrics import metrics
+from asset_cache import build_static_assets, game_data_asset, flask_response
 
 # Create the Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'minas-secret-game-key'
 
+# Where rooms live and how messages reach other workers (see room_backend.py).
+# Set ROOM_BACKEND=broker to run several workers on one machine.
+backend = get_backend()
+socketio_options = {}
+if backend.client_manager is not None:
+    socketio_options['client_manager'] = backend.client_manager
+
 # Create the SocketIO instance for real-time multiplayer
 # async_mode='eventlet' makes it work on Render
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', ping_timeout=60, ping_interval=25)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', ping_timeout=60, ping_interval=25,
+                    **socketio_options)
+
+
+def on_event(event):
+    """Like @socketio.on, but also counts and times the handler (see metrics.py)"""
+    def decorator(handler):
+        return socketio.on(event)(metrics.track_handler(event, handler))
+    return decorator
+
+
+# =============================================================================
+# THE GAME - rooms, battles and relaying all live in game_server.py
+# =============================================================================
+# Each handler below passes its event to the GameServer and sends the
+# Outbox it gets back. async_server.py does the same thing on asyncio.
+
+server = GameServer(backend, socketio.server)
+
+# Maps never change, so sort every map's platforms for fast landing checks now
+compile_all_maps()
+game_data_asset()
+
+
+def send(out):
+    """Send everything in an Outbox (see game_server.py)"""
+    for sid, code in out.joins:
+        join_room(code, sid=sid, namespace='/')
+    for event, payload, target, timer in out.messages:
+        if timer is None:
+            socketio.emit(event, payload, **target)
+        else:
+            with metrics.time(timer):
+                socketio.emit(event, payload, **target)
+    for loop in out.loops:
+        start_loop(loop)
 
 
 # =============================================================================
-# GAME ROOMS - Where players connect with CODEs
+# BACKGROUND LOOPS - the simulation, relay and entity ticks
 # =============================================================================
-# This dictionary stores all active game rooms
-# Key = room code, Value = room data
-
-game_rooms = {}
-
-
-def generate_room_code():
-    """Generate a random 6-character room code like 'ABC123'"""
-    characters = string.ascii_uppercase + string.digits
-    code = ''.join(random.choices(characters, k=6))
-    # Make sure it's unique
-    while code in game_rooms:
-        code = ''.join(random.choices(characters, k=6))
-    return code
-
-
-def create_new_room(code):
-    """Create a new game room with default settings"""
-    return {
-        "code": code,
-        "players": {},  # player_id -> player data
-        "state": "waiting",  # waiting, playing, finished
-        "current_map": None,
-        "created_at": None,
-    }
-
-
-def create_new_player(player_num):
-    """Create a new player with starting equipment"""
-    starter_weapon = get_random_tier1_weapon()
-    return {
-        "number": player_num,  # 1 or 2
-        "coins": 0,
-        "inventory": [starter_weapon],
-        "selected_weapons": [starter_weapon],
-        "ability": None,
-        "skin": None,
-        "ready": False,
-    }
+
+def simulation_loop():
+    """Steps every room at 60 ticks per second and broadcasts snapshots"""
+    while True:
+        send(server.simulation_tick())
+        socketio.sleep(server.simulation.time_until_next_tick())
+
+
+def relay_loop():
+    """Sends queued actions once per network tick (see relay_batcher.py)"""
+    while True:
+        socketio.sleep(server.relay_batcher.interval)
+        send(server.relay_tick())
+
+
+def entity_loop():
+    """Sends hazards and cubes to each player (see entity_updates.py)"""
+    while True:
+        socketio.sleep(server.entity_interval)
+        send(server.entity_tick())
+
+
+LOOPS = {
+    LOOP_SIMULATION: simulation_loop,
+    LOOP_RELAY: relay_loop,
+    LOOP_ENTITIES: entity_loop,
+}
+started_loops = set()
+
+
+def start_loop(name):
+    if name not in started_loops:
+        started_loops.add(name)
+        socketio.start_background_task(LOOPS[name])
 
 
 # =============================================================================
 # WEB ROUTES - Pages people can visit
 # =============================================================================
+# Pages and scripts are minified and compressed once at startup
+# (see asset_cache.py), not read from disk on every visit.
+
+static_assets, fingerprinted_assets = build_static_assets()
+
 
 @app.route('/')
 def home():
     """Landing page - choose local or online"""
-    return send_from_directory('.', 'index.html')
+    return flask_response(static_assets['index.html'], request)
 
 
 @app.route('/game')
 @app.route('/game.html')
 def local_game():
     """Local 2-player game"""
-    return send_from_directory('.', 'game.html')
+    return flask_response(static_assets['game.html'], request)
 
 
 @app.route('/multiplayer')
 @app.route('/multiplayer.html')
 def multiplayer():
     """Multiplayer lobby page"""
-    return send_from_directory('.', 'multiplayer.html')
+    return flask_response(static_assets['multiplayer.html'], request)
 
 
 @app.route('/multiplayer_game')
 @app.route('/multiplayer_game.html')
 def multiplayer_game():
     """Multiplayer game page - the actual battle"""
-    return send_from_directory('.', 'multiplayer_game.html')
+    return flask_response(static_assets['multiplayer_game.html'], request)
 
 
 @app.route('/game_engine.js')
 def game_engine():
     """Shared JS engine used by both game.html and multiplayer_game.html"""
-    return send_from_directory('.', 'game_engine.js')
+    return flask_response(static_assets['game_engine.js'], request)
 
 
 @app.route('/disco_logo.js')
 def disco_logo():
     """Shared disco ball + yeti drawing code used by index.html and multiplayer.html"""
-    return send_from_directory('.', 'disco_logo.js')
+    return flask_response(static_assets['disco_logo.js'], request)
+
+
+@app.route('/assets/<name>')
+def fingerprinted_asset(name):
+    """A script with its content hash in the URL - browsers can keep it forever"""
+    asset = fingerprinted_assets.get('/assets/' + name)
+    if asset is None:
+        abort(404)
+    return flask_response(asset, request)
+
+
+@app.route('/stats')
+def server_stats():
+    """How the server is doing: simulation timing and relay batching"""
+    return jsonify(server.stats())
+
+
+@app.route('/metrics')
+def server_metrics():
+    """Handler counts, timings and sizes in Prometheus text format"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.route('/route')
+@app.route('/route/<code>')
+def room_route(code=None):
+    """Which worker to connect to: the one that owns `code`, or this one"""
+    worker = backend.owner(code.upper()) if code else backend.worker_id
+    return jsonify({"worker": worker, "workers": backend.num_workers})
 
 
 @app.route('/game-data')
 def game_data_api():
-    """Returns all game constants and data as JSON.
-    Both game.html and multiplayer_game.html fetch this so they
-    always use the same values — change game_data.py and both games update!
+    """Returns all game constants and data as JSON (see game_data.get_game_data).
+    It never changes, so it's built once and browsers that already have it
+    get a 304 (see asset_cache.py).
     """
-    # Flatten weapons into a single list with tier included
-    all_weapons = []
-    for tier, weapons in WEAPONS.items():
-        for w in weapons:
-            all_weapons.append({**w, "tier": tier})
-
-    return jsonify({
-        "GRAVITY": GRAVITY,
-        "JUMP_STRENGTH": JUMP_STRENGTH,
-        "PLAYER_SPEED": PLAYER_SPEED,
-        "PLAYER_WIDTH": PLAYER_WIDTH,
-        "PLAYER_HEIGHT": PLAYER_HEIGHT,
-        "STARTING_HP": STARTING_HP,
-        "ATTACK_COOLDOWN": ATTACK_COOLDOWN,
-        "weapons": all_weapons,
-        "maps": MAPS,
-        "abilities": [a["name"].lower() for a in ABILITIES],
-    })
+    return flask_response(game_data_asset(), request)
 
 
 # =============================================================================
@@ -158,228 +197,84 @@ def game_data_api():
 # =============================================================================
 # These functions handle messages between the server and browsers
 # Think of it like a phone call - both sides can talk anytime!
+# What each one does is in game_server.py.
 
-@socketio.on('connect')
+@on_event('connect')
 def handle_connect():
     """When a player connects to the server"""
-    print(f"Player connected: {request.sid}")
-    emit('connected', {'message': 'Welcome to Mina\'s PVP Game!'})
+    send(server.connect(request.sid))
 
 
-@socketio.on('disconnect')
+@on_event('disconnect')
 def handle_disconnect():
     """When a player disconnects"""
-    print(f"Player disconnected: {request.sid}")
-    # Remove them from any room they were in
-    for code, room in list(game_rooms.items()):
-        if request.sid in room['players']:
-            del room['players'][request.sid]
-            # If the game is actively playing, players are just redirecting to the battle page
-            # — keep the room alive so they can rejoin_game with the same code.
-            # Only delete the room (and notify) if we're still in the lobby (waiting state).
-            if room['state'] == 'waiting':
-                emit('player_left', {'message': 'Other player disconnected'}, room=code)
-                if len(room['players']) == 0:
-                    del game_rooms[code]
-                    print(f"Room {code} deleted (empty)")
-            else:
-                print(f"Player left room {code} during game (state={room['state']}) — keeping room alive for rejoin")
-
-
-@socketio.on('create_room')
-def handle_create_room():
-    """Player wants to create a new game room"""
-    code = generate_room_code()
-    game_rooms[code] = create_new_room(code)
+    send(server.disconnect(request.sid))
 
-    # Add the player to the room
-    game_rooms[code]['players'][request.sid] = create_new_player(1)
-    join_room(code)
 
-    print(f"Room {code} created by {request.sid}")
-    emit('room_created', {
-        'code': code,
-        'player_number': 1,
-        'message': f'Room created! Share code: {code}'
-    })
+@on_event('create_room')
+def handle_create_room():
+    """Player wants to create a new game room"""
+    send(server.create_room(request.sid))
 
 
-@socketio.on('join_game_room')
+@on_event('join_game_room')
 def handle_join_room(data):
     """Player wants to join an existing room with a CODE"""
-    code = data.get('code', '').upper()
-
-    # Check if room exists
-    if code not in game_rooms:
-        emit('join_error', {'message': 'Room not found! Check the code.'})
-        return
-
-    room = game_rooms[code]
-
-    # Check if room is full
-    if len(room['players']) >= 2:
-        emit('join_error', {'message': 'Room is full!'})
-        return
-
-    # Add the player
-    room['players'][request.sid] = create_new_player(2)
-    join_room(code)
-
-    print(f"Player {request.sid} joined room {code}")
-
-    # Tell the new player they joined
-    emit('room_joined', {
-        'code': code,
-        'player_number': 2,
-        'message': 'Joined the game!'
-    })
-
-    # Tell everyone the room is ready
-    emit('room_ready', {
-        'message': 'Both players connected! Ready to battle!'
-    }, room=code)
+    send(server.join_room(request.sid, data))
 
 
-@socketio.on('player_ready')
+@on_event('player_ready')
 def handle_player_ready(data):
     """Player is ready to start the battle"""
-    code = data.get('code')
-    if code not in game_rooms:
-        return
-
-    room = game_rooms[code]
-    if request.sid in room['players']:
-        room['players'][request.sid]['ready'] = True
-
-        # Check if both players are ready
-        all_ready = all(p['ready'] for p in room['players'].values())
-        if all_ready and len(room['players']) == 2:
-            # Pick a random map and start!
-            room['current_map'] = get_random_map()
-            room['state'] = 'playing'
-            emit('game_start', {
-                'map': room['current_map'],
-                'message': 'FIGHT!'
-            }, room=code)
-
-
-@socketio.on('rejoin_game')
+    send(server.player_ready(request.sid, data))
+
+
+@on_event('rejoin_game')
 def handle_rejoin_game(data):
     """Player reconnects to game after page redirect"""
-    code = data.get('code')
-    player_num = data.get('player')
+    send(server.rejoin_game(request.sid, data))
 
-    if code not in game_rooms:
-        # Room may have been lost (e.g. server restart) — create a fresh one
-        # so the relay still works even if state is lost
-        print(f"Room {code} not found for rejoin — creating placeholder")
-        game_rooms[code] = create_new_room(code)
-        game_rooms[code]['state'] = 'playing'
 
-    room = game_rooms[code]
+@on_event('player_action')
+def handle_player_action(data):
+    """Player did something (moved, attacked, etc.)"""
+    send(server.player_action(request.sid, data))
 
-    # Add the player to the room and join the socket room
-    room['players'][request.sid] = create_new_player(player_num)
-    room['players'][request.sid]['rejoined'] = True
-    join_room(code)
 
-    print(f"Player {player_num} rejoined room {code}")
+@on_event('state_hash')
+def handle_state_hash(data):
+    """Browser's hash of what both screens should agree on (see desync.py)"""
+    send(server.state_hash(request.sid, data))
 
-    # Tell both clients it's safe to start syncing
-    rejoined_count = sum(1 for p in room['players'].values() if p.get('rejoined'))
-    if rejoined_count >= 2:
-        print(f"Both players in room {code} — emitting both_ready")
-        emit('both_ready', {}, room=code)
 
+@on_event('rtt_pong')
+def handle_rtt_pong(data):
+    """Browser answered our 'rtt_ping' - now we know its round trip time"""
+    send(server.rtt_pong(request.sid, data))
 
-@socketio.on('player_action')
-def handle_player_action(data):
-    """Player did something (moved, attacked, etc.)"""
-    code = data.get('code')
-    action = data.get('action')  # 'move', 'attack', 'ability', etc.
 
-    if code not in game_rooms:
-        return
+@on_event('set_protocol')
+def handle_set_protocol(data):
+    """Browser picks 'json' (the default) or 'binary' for move updates"""
+    send(server.set_protocol(request.sid, data))
 
-    # Make sure this socket is in the room (handles reconnect edge cases)
-    join_room(code)
 
-    # Send the action to the other player
-    emit('opponent_action', {
-        'action': action,
-        'data': data.get('action_data', {})
-    }, room=code, include_self=False)
+@on_event('snapshot_ack')
+def handle_snapshot_ack(data):
+    """Browser got a binary 'opponent_state' - later ones can be deltas"""
+    send(server.snapshot_ack(request.sid, data))
 
 
-@socketio.on('buy_item')
+@on_event('buy_item')
 def handle_buy_item(data):
     """Player wants to buy something from the store"""
-    code = data.get('code')
-    item_type = data.get('item_type')  # 'mystery_box', 'ability', 'skin'
-
-    if code not in game_rooms:
-        return
-
-    room = game_rooms[code]
-    player = room['players'].get(request.sid)
-    if not player:
-        return
-
-    price = STORE_PRICES.get(item_type, 0)
-
-    # Check if they can afford it
-    if player['coins'] < price:
-        emit('buy_error', {'message': 'Not enough coins!'})
-        return
-
-    # Process the purchase
-    player['coins'] -= price
-
-    if item_type == 'mystery_box':
-        new_weapon = get_random_weapon_for_mystery_box()
-        player['inventory'].append(new_weapon)
-        emit('item_purchased', {
-            'item_type': 'weapon',
-            'item': new_weapon,
-            'coins_left': player['coins']
-        })
-
-    elif item_type == 'ability':
-        new_ability = get_random_ability()
-        player['ability'] = new_ability  # Replaces old ability
-        emit('item_purchased', {
-            'item_type': 'ability',
-            'item': new_ability,
-            'coins_left': player['coins']
-        })
-
-
-@socketio.on('game_over')
-def handle_game_over(data):
-    """Battle ended - someone won!"""
-    code = data.get('code')
-    winner = data.get('winner')  # 1 or 2
-
-    if code not in game_rooms:
-        return
-
-    room = game_rooms[code]
-    room['state'] = 'finished'
+    send(server.buy_item(request.sid, data))
 
-    # Give the winner their reward
-    for sid, player in room['players'].items():
-        if player['number'] == winner:
-            player['coins'] += WIN_REWARD
 
-    # Reset ready status and rejoin flags for next round
-    for player in room['players'].values():
-        player['ready'] = False
-        player['rejoined'] = False
-
-    emit('battle_result', {
-        'winner': winner,
-        'reward': WIN_REWARD
-    }, room=code)
+@on_event('game_over')
+def handle_game_over(data):
+    """Battle ended - someone won!"""
+    send(server.game_over(request.sid, data))
 
 
 # =============================================================================
@@ -401,5 +296,12 @@ if __name__ == '__main__':
     print("  Press Ctrl+C to stop the server")
     print("=" * 50)
 
-    # Run the server!
-    socketio.run(app, debug=True, port=5050, allow_unsafe_werkzeug=True)
+    # Run the server! (Each worker started by room_backend.py gets its own PORT)
+    port = int(os.environ.get('PORT', DEFAULT_PORT))
+    if os.environ.get('SERVER_MODE') == 'asyncio':
+        # Same game on one asyncio event loop instead of a thread per player
+        from async_server import run
+        run(port)
+        raise SystemExit
+    socketio.run(app, debug=True, port=port, allow_unsafe_werkzeug=True,
+                 use_reloader=backend.name == BACKEND_MEMORY)
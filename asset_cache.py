@@ -0,0 +1,359 @@
+# Asset Cache for Mina's PVP Fighting Game
+#
+# Some responses never change while the server is running - like
+# /game-data, which both game pages fetch every time they load. Instead
+# of building them on every request, we build each one ONCE and keep:
+#
+#   - the bytes, already encoded
+#   - a gzip-compressed copy (and brotli, if the brotli package is installed)
+#   - an ETag: a short hash of the bytes
+#
+# A browser that already has the data sends the ETag back in
+# If-None-Match, and gets an empty "304 Not Modified" instead.
+#
+# The game's pages and scripts go through the same thing at startup, plus:
+#
+#   - "minifying": indentation, blank lines and // comment lines are removed
+#   - the scripts get a second URL with a hash of their contents in it,
+#     like /assets/game_engine.3f9a1c2b.js, and the pages are rewritten to
+#     use it. That URL can be cached by browsers forever ("immutable"),
+#     because if the file changes, so does its URL.
+#   - every version is written to BUILD_DIR, so the web server can send
+#     the file straight from disk (sendfile) instead of copying it. Once
+#     they're all written, older builds of the same files are deleted.
+
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import game_data
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(HERE, ".asset_build")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# The files the server sends, and the pages that use them
+SCRIPTS = ("game_engine.js", "disco_logo.js")
+PAGES = ("index.html", "game.html", "multiplayer.html", "multiplayer_game.html")
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+
+class CachedAsset:
+    """One response body, pre-compressed, with its ETag"""
+
+    __slots__ = ("body", "content_type", "etag", "gzip", "brotli", "cache_control")
+
+    def __init__(self, body, content_type, cache_control="no-cache"):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+        self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+        self.brotli = brotli.compress(body) if brotli is not None else None
+
+    def encoding(self, accept_encoding):
+        """The best encoding the browser accepts: 'br', 'gzip' or ''"""
+        return best_encoding(accept_encoding, self.brotli is not None)
+
+    def variant(self, encoding):
+        return {"br": self.brotli, "gzip": self.gzip}.get(encoding, self.body)
+
+    def headers(self, encoding=""):
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return headers
+
+    def not_modified(self, if_none_match):
+        return bool(if_none_match) and self.etag in (tag.strip() for tag in if_none_match.split(","))
+
+    def respond(self, accept_encoding="", if_none_match=""):
+        """What to send back: (status, body, headers)"""
+        if self.not_modified(if_none_match):
+            return 304, b"", self.headers()
+
+        encoding = self.encoding(accept_encoding)
+        body = self.variant(encoding)
+        headers = self.headers(encoding)
+        headers["Content-Type"] = self.content_type
+        headers["Content-Length"] = str(len(body))
+        return 200, body, headers
+
+
+class StaticAsset(CachedAsset):
+    """A page or script from disk, built once, with its versions saved to BUILD_DIR"""
+
+    __slots__ = ("name", "url", "paths")
+
+    def __init__(self, name, body, cache_control="no-cache"):
+        super().__init__(body, CONTENT_TYPES[os.path.splitext(name)[1]], cache_control)
+        self.name = name
+        self.url = fingerprinted_url(name, self.etag.strip('"')[:8])
+        self.paths = {}   # encoding -> file in BUILD_DIR
+
+    def save(self, build_dir=BUILD_DIR):
+        os.makedirs(build_dir, exist_ok=True)
+        base = os.path.join(build_dir, self.url.rsplit("/", 1)[1])
+        for encoding, suffix in (("", ""), ("gzip", ".gz"), ("br", ".br")):
+            body = self.variant(encoding)
+            if body is None:
+                continue
+            path = base + suffix
+            if not os.path.exists(path):
+                with open(path + ".tmp", "wb") as f:
+                    f.write(body)
+                os.replace(path + ".tmp", path)
+            self.paths[encoding] = path
+
+    def prune(self, build_dir=BUILD_DIR):
+        """Delete earlier builds of this file (the ones with other hashes)"""
+        stem, ext = os.path.splitext(self.name)
+        current = self.url.rsplit("/", 1)[1]
+        earlier = re.compile(re.escape(stem) + r"\.[0-9a-f]{8}" + re.escape(ext) + r"(\.gz|\.br)?(\.tmp)?")
+        for entry in os.listdir(build_dir):
+            if earlier.fullmatch(entry) and entry.split(ext, 1)[0] + ext != current:
+                try:
+                    os.remove(os.path.join(build_dir, entry))
+                except FileNotFoundError:
+                    pass   # Another worker got there first
+
+
+# Browsers send the same few Accept-Encoding headers over and over, so
+# each one is only worked out once
+@functools.lru_cache(maxsize=256)
+def best_encoding(accept_encoding, has_brotli=False):
+    """The encoding to send for an Accept-Encoding header: 'br', 'gzip' or ''.
+
+    "gzip;q=0" means "not gzip", so this reads the q-values: the highest
+    one wins, brotli beats gzip on a tie, and "*" covers anything not named.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    best, best_weight = "", 0.0
+    for coding in ("br", "gzip") if has_brotli else ("gzip",):
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def fingerprinted_url(name, digest):
+    """game_engine.js -> /assets/game_engine.<digest>.js"""
+    stem, ext = os.path.splitext(name)
+    return f"/assets/{stem}.{digest}{ext}"
+
+
+def flask_response(asset, request, cache_control=None):
+    """Turn a CachedAsset into a Flask response for this request.
+
+    Built files are sent straight from disk (sendfile when the server
+    supports it), everything else from memory.
+    """
+    from flask import Response, send_file
+
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    if asset.not_modified(request.headers.get("If-None-Match", "")):
+        response = Response(status=304, headers=asset.headers())
+    else:
+        encoding = asset.encoding(accept_encoding)
+        path = getattr(asset, "paths", {}).get(encoding)
+        if path is not None:
+            response = send_file(path, mimetype=asset.content_type, conditional=False, etag=False)
+            response.headers.update(asset.headers(encoding))
+        else:
+            status, body, headers = asset.respond(accept_encoding)
+            response = Response(body, status=status, headers=headers)
+    if cache_control is not None:
+        response.headers["Cache-Control"] = cache_control
+    return response
+
+
+# =============================================================================
+# MINIFYING
+# =============================================================================
+# Only safe, line-by-line changes: lines inside a multi-line `template
+# string` and <pre> blocks are left exactly as they are.
+
+_UNESCAPED_BACKTICK = re.compile(r"(?<!\\)`")
+
+
+def minify(text, kind):
+    """Remove indentation, blank lines and // comment lines from a .js or .html file"""
+    lines = []
+    in_template = False
+    in_script = kind == ".js"
+    in_pre = False
+    for line in text.split("\n"):
+        if in_template or in_pre:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            lower = stripped.lower()
+            if kind == ".html":
+                if "<script" in lower:
+                    in_script = True
+                if "</script" in lower:
+                    in_script = False
+                if "<pre" in lower:
+                    in_pre = "</pre" not in lower
+            if stripped and not (in_script and stripped.startswith("//") and "`" not in stripped):
+                lines.append(stripped)
+        if "`" in line:
+            in_template ^= len(_UNESCAPED_BACKTICK.findall(line)) % 2 == 1
+        if in_pre and "</pre" in line.lower():
+            in_pre = False
+    return "\n".join(lines)
+
+
+# =============================================================================
+# STATIC FILES
+# =============================================================================
+
+def build_static_assets(source_dir=HERE, build_dir=BUILD_DIR):
+    """Minify, fingerprint and compress every script and page.
+
+    Returns {name: StaticAsset} for the normal URLs (/game_engine.js,
+    index.html...) plus {url: StaticAsset} for the /assets/ hashed ones.
+    """
+    assets = {}
+    fingerprinted = {}
+    for name in SCRIPTS:
+        with open(os.path.join(source_dir, name), encoding="utf-8") as f:
+            body = minify(f.read(), ".js").encode()
+        asset = StaticAsset(name, body)
+        asset.save(build_dir)
+        assets[name] = asset
+        hashed = StaticAsset(name, body, cache_control=IMMUTABLE)
+        hashed.paths = asset.paths
+        fingerprinted[asset.url] = hashed
+
+    for name in PAGES:
+        with open(os.path.join(source_dir, name), encoding="utf-8") as f:
+            text = minify(f.read(), ".html")
+        # Point the page at the hashed script URLs
+        for script in SCRIPTS:
+            text = text.replace(f'src="/{script}"', f'src="{assets[script].url}"')
+        asset = StaticAsset(name, text.encode())
+        asset.save(build_dir)
+        assets[name] = asset
+
+    # Everything built - the old versions can go
+    for asset in assets.values():
+        asset.prune(build_dir)
+    return assets, fingerprinted
+
+
+# =============================================================================
+# /game-data
+# =============================================================================
+
+_game_data = (None, None)   # (the get_game_data it was built from, CachedAsset)
+
+
+def game_data_asset():
+    """The /game-data response, built the first time it's asked for.
+
+    If game_data.py is reloaded (importlib.reload), get_game_data is a new
+    function, so the next request builds a fresh one.
+    """
+    global _game_data
+    source, asset = _game_data
+    if source is not game_data.get_game_data:
+        source = game_data.get_game_data
+        body = json.dumps(source(), separators=(",", ":")).encode()
+        asset = CachedAsset(body, "application/json")
+        _game_data = (source, asset)
+    return asset
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python asset_cache.py) to compare building
+# /game-data on every request with the cached response.
+
+if __name__ == "__main__":
+    import time
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+
+    @app.route("/before")
+    def before():
+        return jsonify(game_data.get_game_data())
+
+    @app.route("/after")
+    def after():
+        return flask_response(game_data_asset(), request)
+
+    client = app.test_client()
+    gzip_headers = {"Accept-Encoding": "gzip"}
+    etag = client.get("/after").headers["ETag"]
+    cases = (
+        ("Before (build + JSON every time)", "/before", {}),
+        ("Cached, plain", "/after", {}),
+        ("Cached, gzip", "/after", gzip_headers),
+        ("Cached, 304 Not Modified", "/after", dict(gzip_headers, **{"If-None-Match": etag})),
+    )
+
+    print("=" * 50)
+    print("  /game-data BENCHMARK")
+    print("=" * 50)
+    requests = 2000
+    for label, path, headers in cases:
+        size = len(client.get(path, headers=headers).data)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path, headers=headers)
+        rate = requests / (time.perf_counter() - start)
+        print(f"  {label:<34} {rate:>7.0f} requests/sec  {size:>6} bytes")
+
+    # Bytes on the wire for each page, counting the scripts it loads
+    assets, _ = build_static_assets()
+    print()
+    print("=" * 50)
+    print("  BYTES PER PAGE LOAD (page + its scripts)")
+    print("=" * 50)
+    print(f"  {'':<24} {'before':>9} {'gzip':>9} {'revisit':>9}")
+    for page in PAGES:
+        with open(os.path.join(HERE, page), "rb") as f:
+            raw = f.read()
+        scripts = [s for s in SCRIPTS if f'src="/{s}"'.encode() in raw]
+        before = len(raw)
+        for script in scripts:
+            before += os.path.getsize(os.path.join(HERE, script))
+        after = len(assets[page].gzip) + sum(len(assets[s].gzip) for s in scripts)
+        # Coming back: the page is a 304, the hashed scripts come from the browser cache
+        print(f"  {page:<24} {before:>9,} {after:>9,} {0:>9}")
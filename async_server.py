@@ -0,0 +1,435 @@
+# Asyncio Game Server for Mina's PVP Fighting Game
+#
+# app.py runs Flask-SocketIO in 'threading' mode, which uses a thread for
+# every connection. This is the same game server (same events, same rooms,
+# same simulation) on ONE asyncio event loop instead, so each connection
+# only costs a coroutine. The room tick loops (simulation.py and
+# relay_batcher.py) run as coroutines on the same loop.
+#
+# Pick it at startup:
+#
+#   SERVER_MODE=asyncio python app.py
+#   uvicorn async_server:asgi_app --port 5050
+#
+# The game itself is game_server.py, shared with app.py. Its handlers
+# change the rooms and hand back an Outbox without awaiting anything, and
+# only then do we send it, so two handlers never change the same room at
+# once. Rooms always stay in this process (ROOM_BACKEND=broker is for
+# app.py's workers).
+
+import json
+import os
+
+import socketio
+
+from game_server import GameServer, LOOP_ENTITIES, LOOP_RELAY, LOOP_SIMULATION
+from platform_index import compile_all_maps
+from room_backend import DEFAULT_PORT, InMemoryBackend
+from metrics import metrics
+from asset_cache import build_static_assets, game_data_asset
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*",
+                           ping_timeout=60, ping_interval=25)
+
+# The same game as app.py (see game_server.py)
+server = GameServer(InMemoryBackend(), sio)
+
+
+def on_event(event):
+    """Like @sio.on, but also counts and times the handler (see metrics.py)"""
+    def decorator(handler):
+        return sio.on(event)(metrics.track_handler(event, handler))
+    return decorator
+
+
+async def send(out):
+    """Send everything in an Outbox (see game_server.py)"""
+    for sid, code in out.joins:
+        await sio.enter_room(sid, code)
+    for event, payload, target, timer in out.messages:
+        if timer is None:
+            await sio.emit(event, payload, **target)
+        else:
+            with metrics.time(timer):
+                await sio.emit(event, payload, **target)
+    for loop in out.loops:
+        start_loop(loop)
+
+
+# =============================================================================
+# BACKGROUND LOOPS - coroutines on the same event loop as the handlers
+# =============================================================================
+
+async def simulation_loop():
+    """Steps every room at 60 ticks per second and broadcasts snapshots"""
+    while True:
+        await send(server.simulation_tick())
+        await sio.sleep(server.simulation.time_until_next_tick())
+
+
+async def relay_loop():
+    """Sends queued actions once per network tick (see relay_batcher.py)"""
+    while True:
+        await sio.sleep(server.relay_batcher.interval)
+        await send(server.relay_tick())
+
+
+async def entity_loop():
+    """Sends hazards and cubes to each player (see entity_updates.py)"""
+    while True:
+        await sio.sleep(server.entity_interval)
+        await send(server.entity_tick())
+
+
+LOOPS = {
+    LOOP_SIMULATION: simulation_loop,
+    LOOP_RELAY: relay_loop,
+    LOOP_ENTITIES: entity_loop,
+}
+started_loops = set()
+
+
+def start_loop(name):
+    if name not in started_loops:
+        started_loops.add(name)
+        sio.start_background_task(LOOPS[name])
+
+
+# =============================================================================
+# WEB ROUTES - pages and scripts are built once at startup (asset_cache.py)
+# =============================================================================
+
+STATIC_FILES = {
+    '/': 'index.html',
+    '/game': 'game.html',
+    '/game.html': 'game.html',
+    '/multiplayer': 'multiplayer.html',
+    '/multiplayer.html': 'multiplayer.html',
+    '/multiplayer_game': 'multiplayer_game.html',
+    '/multiplayer_game.html': 'multiplayer_game.html',
+    '/game_engine.js': 'game_engine.js',
+    '/disco_logo.js': 'disco_logo.js',
+}
+
+static_assets, fingerprinted_assets = build_static_assets()
+
+
+async def send_asset(scope, send, asset):
+    """Send a CachedAsset (pre-compressed, with ETag) - see asset_cache.py"""
+    status, body, headers = asset.respond(
+        _header(scope, b'accept-encoding'), _header(scope, b'if-none-match'))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def server_stats():
+    stats = server.stats()
+    stats["backend"] = {"backend": "asyncio", "worker": 0, "workers": 1}
+    return stats
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def startup():
+    """Build everything that never changes before the first player arrives"""
+    compile_all_maps()
+    game_data_asset()
+
+
+async def http_app(scope, receive, send):
+    """Pages, scripts, /game-data, /stats, /metrics and /route (everything else is Socket.IO)"""
+    path = scope['path']
+    if path in STATIC_FILES:
+        await send_asset(scope, send, static_assets[STATIC_FILES[path]])
+        return
+    if path in fingerprinted_assets:
+        await send_asset(scope, send, fingerprinted_assets[path])
+        return
+    if path == '/metrics':
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4')]})
+        await send({'type': 'http.response.body', 'body': metrics.render().encode()})
+        return
+    if path == '/game-data':
+        await send_asset(scope, send, game_data_asset())
+        return
+    if path == '/stats':
+        body = server_stats()
+    elif path == '/route' or path.startswith('/route/'):
+        body = {"worker": 0, "workers": 1}
+    else:
+        await send({'type': 'http.response.start', 'status': 404,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Not Found'})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+# =============================================================================
+# WEBSOCKET EVENTS - the same events as app.py (see game_server.py)
+# =============================================================================
+
+@on_event('connect')
+async def handle_connect(sid, environ, auth=None):
+    """When a player connects to the server"""
+    await send(server.connect(sid))
+
+
+@on_event('disconnect')
+async def handle_disconnect(sid, *args):
+    """When a player disconnects"""
+    await send(server.disconnect(sid))
+
+
+@on_event('create_room')
+async def handle_create_room(sid, *args):
+    """Player wants to create a new game room"""
+    await send(server.create_room(sid))
+
+
+@on_event('join_game_room')
+async def handle_join_room(sid, data):
+    """Player wants to join an existing room with a CODE"""
+    await send(server.join_room(sid, data))
+
+
+@on_event('player_ready')
+async def handle_player_ready(sid, data):
+    """Player is ready to start the battle"""
+    await send(server.player_ready(sid, data))
+
+
+@on_event('rejoin_game')
+async def handle_rejoin_game(sid, data):
+    """Player reconnects to game after page redirect"""
+    await send(server.rejoin_game(sid, data))
+
+
+@on_event('player_action')
+async def handle_player_action(sid, data):
+    """Player did something (moved, attacked, etc.)"""
+    await send(server.player_action(sid, data))
+
+
+@on_event('state_hash')
+async def handle_state_hash(sid, data):
+    """Browser's hash of what both screens should agree on (see desync.py)"""
+    await send(server.state_hash(sid, data))
+
+
+@on_event('rtt_pong')
+async def handle_rtt_pong(sid, data):
+    """Browser answered our 'rtt_ping' - now we know its round trip time"""
+    await send(server.rtt_pong(sid, data))
+
+
+@on_event('set_protocol')
+async def handle_set_protocol(sid, data):
+    """Browser picks 'json' (the default) or 'binary' for move updates"""
+    await send(server.set_protocol(sid, data))
+
+
+@on_event('snapshot_ack')
+async def handle_snapshot_ack(sid, data):
+    """Browser got a binary 'opponent_state' - later ones can be deltas"""
+    await send(server.snapshot_ack(sid, data))
+
+
+@on_event('buy_item')
+async def handle_buy_item(sid, data):
+    """Player wants to buy something from the store"""
+    await send(server.buy_item(sid, data))
+
+
+@on_event('game_over')
+async def handle_game_over(sid, data):
+    """Battle ended - someone won!"""
+    await send(server.game_over(sid, data))
+
+
+asgi_app = socketio.ASGIApp(
+    sio,
+    other_asgi_app=http_app,
+    socketio_path='socket.io',
+    on_startup=startup,
+)
+
+
+def run(port=DEFAULT_PORT):
+    """Serve the asyncio version (needs uvicorn)"""
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port)
+
+
+# =============================================================================
+# LOAD TEST
+# =============================================================================
+# python async_server.py bench http://localhost:5050
+#
+# Works against either server mode: start one (python app.py, or
+# SERVER_MODE=asyncio python app.py), then run this. Pairs of fake players
+# connect with Engine.IO long-polling, make a room, and send each other
+# 'move' updates 20 times a second. Each move carries the time it was
+# sent, so the other player can measure how long the relay took.
+
+async def _http(host, port, method, path, body=b''):
+    import asyncio
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                 f"Content-Type: text/plain;charset=UTF-8\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    if b"transfer-encoding: chunked" in head.lower():
+        chunks, rest = [], payload
+        while rest:
+            size, _, rest = rest.partition(b"\r\n")
+            size = int(size, 16)
+            if size == 0:
+                break
+            chunks.append(rest[:size])
+            rest = rest[size + 2:]
+        payload = b"".join(chunks)
+    return payload.decode()
+
+
+class _PollingClient:
+    """Just enough of a Socket.IO client to send and receive events"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.path = None
+        self.events = None
+        self.closed = False
+        self._poller = None
+
+    async def connect(self):
+        import asyncio
+        handshake = await _http(self.host, self.port, "GET",
+                                "/socket.io/?EIO=4&transport=polling")
+        sid = json.loads(handshake[handshake.index("{"):])["sid"]
+        self.path = f"/socket.io/?EIO=4&transport=polling&sid={sid}"
+        self.events = asyncio.Queue()
+        await _http(self.host, self.port, "POST", self.path, b"40")
+        self._poller = asyncio.ensure_future(self._poll())
+
+    async def close(self):
+        self.closed = True
+        if self._poller is not None:
+            self._poller.cancel()
+        try:
+            await _http(self.host, self.port, "POST", self.path, b"1")
+        except OSError:
+            pass
+
+    async def _poll(self):
+        import time
+        while not self.closed:
+            try:
+                payload = await _http(self.host, self.port, "GET", self.path)
+            except OSError:
+                return
+            now = time.perf_counter()
+            for packet in payload.split("\x1e"):
+                if packet == "2":
+                    await _http(self.host, self.port, "POST", self.path, b"3")
+                elif packet.startswith("42"):
+                    self.events.put_nowait((now, json.loads(packet[2:])))
+
+    async def emit(self, event, data=None):
+        packet = [event] if data is None else [event, data]
+        await _http(self.host, self.port, "POST", self.path,
+                    ("42" + json.dumps(packet)).encode())
+
+    async def wait_for(self, event, timeout=10):
+        import asyncio
+        while True:
+            _, (name, *args) = await asyncio.wait_for(self.events.get(), timeout)
+            if name == event:
+                return args[0] if args else None
+
+
+async def _player_pair(host, port, seconds, latencies):
+    import asyncio
+    import time
+
+    one, two = _PollingClient(host, port), _PollingClient(host, port)
+    try:
+        await one.connect()
+        await two.connect()
+        await one.emit('create_room')
+        code = (await one.wait_for('room_created'))['code']
+        await two.emit('join_game_room', {'code': code})
+        await two.wait_for('room_joined')
+    except BaseException:
+        await one.close()
+        await two.close()
+        raise
+
+    async def receive(client):
+        while not client.closed:
+            arrived, (name, *args) = await client.events.get()
+            if name != 'opponent_action':
+                continue
+            actions = args[0]['data'] if args[0]['action'] == 'batch' else [args[0]]
+            for action in actions:
+                latencies.append(arrived - action['data']['sent'])
+
+    receivers = [asyncio.ensure_future(receive(c)) for c in (one, two)]
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for client in (one, two):
+            await client.emit('player_action', {'code': code, 'action': 'move',
+                                                'action_data': {'sent': time.perf_counter()}})
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    for receiver in receivers:
+        receiver.cancel()
+    for client in (one, two):
+        await client.close()
+
+
+async def _load_test(url, pairs, seconds=5):
+    import asyncio
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url)
+    latencies = []
+    results = await asyncio.gather(
+        *(_player_pair(parsed.hostname, parsed.port or 80, seconds, latencies)
+          for _ in range(pairs)),
+        return_exceptions=True)
+    connected = sum(1 for r in results if not isinstance(r, BaseException))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else float('nan')
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float('nan')
+    return connected, len(latencies), p50, p99
+
+
+if __name__ == '__main__':
+    import asyncio
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        url = sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{DEFAULT_PORT}"
+        print("=" * 50)
+        print(f"  LOAD TEST ({url})")
+        print("=" * 50)
+        for pairs in (10, 50, 100, 200):
+            connected, relayed, p50, p99 = asyncio.run(_load_test(url, pairs))
+            print(f"  {pairs * 2:>4} connections: {connected * 2:>4} played, "
+                  f"{relayed:>6} moves relayed, p50 {p50 * 1000:6.1f} ms, p99 {p99 * 1000:6.1f} ms")
+    else:
+        run(int(os.environ.get('PORT', DEFAULT_PORT)))
@@ -0,0 +1,298 @@
+# Balance Simulator for Mina's PVP Fighting Game
+#
+# Is the Bazooka too strong? Is the Fish useless? Instead of guessing,
+# this plays lots of computer-vs-computer fights for EVERY pair of
+# weapons in game_data.WEAPONS on EVERY map in game_data.MAPS, using the
+# combat rules from pvp_fighting_game_1.py (headless, no window), and
+# adds up who won and how long it took.
+#
+#   python balance.py run [matches per pairing] [processes]
+#   python balance.py report
+#   python balance.py scale [most processes]
+#
+# - Every (weapon, weapon, map) is one "task". Tasks are shared out to a
+#   pool of processes, one per CPU core by default.
+# - Each task gets its own seed, worked out from its name, so a task
+#   plays exactly the same fights no matter which process runs it or when.
+# - Every finished task is written to RESULTS_FILE straight away. Run the
+#   same command again after stopping it (Ctrl+C) and it carries on where
+#   it left off.
+#
+# Map hazards (comets, lava...) aren't part of the pygame rules, so only
+# the platforms of each map are used.
+
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from game_data import FPS, MAPS, WEAPON_CATALOG, get_map_platforms
+from pvp_fighting_game_1 import (
+    MeleeWeapon,
+    Platform,
+    RangedWeapon,
+    random_inputs,
+    run_headless,
+)
+
+
+RESULTS_FILE = "balance_results.jsonl"
+DEFAULT_MATCHES = 10
+DEFAULT_SEED = 1
+MAX_SECONDS = 30   # A fight that lasts longer than this is a draw
+
+
+# =============================================================================
+# ONE TASK - some fights between two weapons on one map
+# =============================================================================
+
+def make_weapon(weapon):
+    """A catalog weapon -> the pygame game's MeleeWeapon / RangedWeapon"""
+    kind = RangedWeapon if weapon["type"] == "ranged" else MeleeWeapon
+    return kind(weapon["name"], weapon["damage"], weapon["tier"])
+
+
+def make_platforms(map_data):
+    return [Platform(p["x"], p["y"], p["width"], p["height"]) for p in get_map_platforms(map_data)]
+
+
+def task_key(weapon_a, weapon_b, map_index):
+    return f"{weapon_a}|{weapon_b}|{map_index}"
+
+
+def task_seed(key, seed):
+    """The same task always gets the same seed"""
+    return zlib.crc32(f"{seed}:{key}".encode())
+
+
+def all_tasks(matches=DEFAULT_MATCHES, seed=DEFAULT_SEED):
+    """Every weapon against every weapon (both sides) on every map"""
+    tasks = []
+    for map_index in range(len(MAPS)):
+        for weapon_a in WEAPON_CATALOG:
+            for weapon_b in WEAPON_CATALOG:
+                key = task_key(weapon_a["id"], weapon_b["id"], map_index)
+                tasks.append((key, matches, task_seed(key, seed)))
+    return tasks
+
+
+def play_task(task):
+    """Play one task's fights. Runs in a worker process."""
+    key, matches, seed = task
+    weapon_a, weapon_b, map_index = key.split("|")
+    weapon_a = WEAPON_CATALOG.get(weapon_a)
+    weapon_b = WEAPON_CATALOG.get(weapon_b)
+    platforms = make_platforms(MAPS[int(map_index)])
+    rng = random.Random(seed)
+
+    result = {"key": key, "matches": matches, "seed": seed,
+              "wins_a": 0, "wins_b": 0, "draws": 0, "kill_frames": 0, "frames": 0}
+    for _ in range(matches):
+        match_seed = rng.getrandbits(32)
+        winner, frames, _ = run_headless(
+            random_inputs(random.Random(match_seed)), match_seed,
+            max_frames=MAX_SECONDS * FPS, platforms=platforms,
+            weapons=([make_weapon(weapon_a)], [make_weapon(weapon_b)]))
+        result["frames"] += frames
+        if winner is None:
+            result["draws"] += 1
+            continue
+        result["wins_a" if winner == "Player 1" else "wins_b"] += 1
+        result["kill_frames"] += frames
+    return result
+
+
+# =============================================================================
+# RUNNING LOTS OF TASKS
+# =============================================================================
+
+def load_results(path=RESULTS_FILE):
+    """Finished tasks from earlier runs: {key: result}"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue   # Half-written line from a run that was stopped
+            results[result["key"]] = result
+    return results
+
+
+def run_tasks(tasks, processes=None, path=None, progress=True):
+    """Play the tasks in a process pool, writing each result as it finishes.
+
+    Tasks already in path (same matches and seed) are skipped.
+    Returns every result, old and new.
+    """
+    from multiprocessing import Pool
+
+    done = load_results(path) if path else {}
+    todo = [task for task in tasks
+            if (done.get(task[0]) or {}).get("seed") != task[2]
+            or done[task[0]]["matches"] != task[1]]
+    results = {task[0]: done[task[0]] for task in tasks if task[0] in done}
+    if progress and len(todo) < len(tasks):
+        print(f"  Resuming: {len(tasks) - len(todo):,} of {len(tasks):,} tasks already done")
+
+    out = open(path, "a") if path else None
+    start = time.perf_counter()
+    try:
+        with Pool(processes) as pool:
+            for count, result in enumerate(pool.imap_unordered(play_task, todo), 1):
+                results[result["key"]] = result
+                if out is not None:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                if progress and (count % 50 == 0 or count == len(todo)):
+                    elapsed = time.perf_counter() - start
+                    print(f"  {count:,}/{len(todo):,} tasks  "
+                          f"({count * tasks[0][1] / elapsed:,.1f} matches/sec)")
+    finally:
+        if out is not None:
+            out.close()
+    return results
+
+
+# =============================================================================
+# REPORT
+# =============================================================================
+
+def summarize(results):
+    """Add up the results per weapon pairing (all maps) and per map"""
+    pairs = {}     # (weapon a, weapon b) -> totals
+    maps = {}      # map index -> totals
+    for result in results.values():
+        weapon_a, weapon_b, map_index = result["key"].split("|")
+        for totals in (pairs.setdefault((weapon_a, weapon_b), {}),
+                       maps.setdefault(int(map_index), {})):
+            for field in ("matches", "wins_a", "wins_b", "draws", "kill_frames", "frames"):
+                totals[field] = totals.get(field, 0) + result[field]
+    return pairs, maps
+
+
+def win_rate(totals):
+    """Player 1's share of the matches (a draw counts as half)"""
+    return (totals["wins_a"] + totals["draws"] / 2) / totals["matches"]
+
+
+def time_to_kill(totals):
+    """Average seconds a fight took when someone won (None if nobody did)"""
+    kills = totals["wins_a"] + totals["wins_b"]
+    return totals["kill_frames"] / kills / FPS if kills else None
+
+
+def report(results, matrix_path="balance_matrix.json"):
+    pairs, maps = summarize(results)
+    if not pairs:
+        print("  No results yet - run 'python balance.py run' first")
+        return
+
+    # Each weapon's results, counting the fights where it was player 1
+    # and where it was player 2
+    weapons = {}
+    for (weapon_a, weapon_b), totals in pairs.items():
+        for weapon, wins in ((weapon_a, totals["wins_a"]), (weapon_b, totals["wins_b"])):
+            row = weapons.setdefault(weapon, {"matches": 0, "wins": 0, "draws": 0,
+                                              "kill_frames": 0, "kills": 0})
+            row["matches"] += totals["matches"]
+            row["wins"] += wins
+            row["draws"] += totals["draws"]
+        kills = totals["wins_a"] + totals["wins_b"]
+        for weapon in (weapon_a, weapon_b):
+            weapons[weapon]["kill_frames"] += totals["kill_frames"]
+            weapons[weapon]["kills"] += kills
+
+    print("=" * 74)
+    print(f"  WEAPONS ({sum(t['matches'] for t in maps.values()):,} matches)")
+    print("=" * 74)
+    print(f"  {'weapon':<38} {'tier':>4} {'win rate':>9} {'draws':>7} {'time to kill':>13}")
+    ranked = sorted(weapons.items(),
+                    key=lambda item: -(item[1]["wins"] + item[1]["draws"] / 2) / item[1]["matches"])
+    for weapon_id, row in ranked:
+        weapon = WEAPON_CATALOG.get(weapon_id)
+        rate = (row["wins"] + row["draws"] / 2) / row["matches"]
+        ttk = f"{row['kill_frames'] / row['kills'] / FPS:.1f}s" if row["kills"] else "-"
+        print(f"  {weapon['name'] + ' (' + weapon_id + ')':<38} {weapon['tier']:>4} "
+              f"{rate:>9.0%} {row['draws'] / row['matches']:>7.0%} {ttk:>13}")
+
+    print()
+    print("=" * 74)
+    print("  MAPS")
+    print("=" * 74)
+    for map_index, totals in sorted(maps.items()):
+        ttk = time_to_kill(totals)
+        print(f"  {MAPS[map_index]['name']:<18} player 1 win rate {win_rate(totals):4.0%}  "
+              f"draws {totals['draws'] / totals['matches']:4.0%}  "
+              f"time to kill {f'{ttk:.1f}s' if ttk else '-'}")
+
+    # The full matrix is too big to print: row = player 1's weapon,
+    # column = player 2's weapon
+    ids = [weapon["id"] for weapon in WEAPON_CATALOG]
+    matrix = {
+        "weapons": ids,
+        "win_rate": [[round(win_rate(pairs[a, b]), 4) if (a, b) in pairs else None
+                      for b in ids] for a in ids],
+        "time_to_kill": [[round(time_to_kill(pairs[a, b]), 3)
+                          if (a, b) in pairs and time_to_kill(pairs[a, b]) else None
+                          for b in ids] for a in ids],
+    }
+    with open(matrix_path, "w") as f:
+        json.dump(matrix, f)
+    print()
+    print(f"  Full win rate and time-to-kill matrix saved to {matrix_path}")
+
+
+# =============================================================================
+# SCALING - the same work with 1, 2, 4 ... processes
+# =============================================================================
+
+def scale(most=None, num_tasks=48, matches=2):
+    most = most or os.cpu_count() or 1
+    tasks = all_tasks(matches)[:num_tasks]
+    print("=" * 50)
+    print(f"  SCALING ({num_tasks} tasks x {matches} matches, {os.cpu_count()} CPU cores)")
+    print("=" * 50)
+    base = None
+    counts = sorted({1, most} | {2 ** i for i in range(1, most.bit_length()) if 2 ** i < most})
+    first = None
+    for processes in counts:
+        start = time.perf_counter()
+        results = run_tasks(tasks, processes, progress=False)
+        rate = num_tasks * matches / (time.perf_counter() - start)
+        base = base or rate
+        # Same seeds, so every run must give exactly the same results
+        first = first or results
+        same = "same results" if results == first else "DIFFERENT results!"
+        print(f"  {processes:>3} processes: {rate:8.1f} matches/sec ({rate / base:4.2f}x)  {same}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command == "run":
+        matches = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MATCHES
+        processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        tasks = all_tasks(matches)
+        print("=" * 74)
+        print(f"  BALANCE RUN: {len(tasks):,} tasks x {matches} matches "
+              f"({processes or os.cpu_count()} processes)")
+        print("=" * 74)
+        try:
+            results = run_tasks(tasks, processes, RESULTS_FILE)
+        except KeyboardInterrupt:
+            print(f"\n  Stopped. Finished tasks are saved in {RESULTS_FILE} - "
+                  f"run the same command again to carry on.")
+        else:
+            report(results)
+    elif command == "report":
+        report(load_results())
+    elif command == "scale":
+        scale(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print("python balance.py run [matches] [processes] | report | scale [processes]")
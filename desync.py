@@ -0,0 +1,231 @@
+# Desync Detection for Mina's PVP Fighting Game
+#
+# When the server isn't running the fight, each browser runs its own copy
+# and they only tell each other what changed ('damage', 'cubes',
+# 'hazard'...). If one of those messages goes missing or one browser gets
+# something wrong, the two screens stop agreeing - a "desync" - and
+# nobody notices until someone complains.
+#
+# So every half second each browser hashes the things both screens must
+# agree on (both players' HP, which cubes are broken, which hazards are
+# falling, whether the game is over) and sends it with 'state_hash':
+#
+#   {"code": "ABC123", "tick": 14, "hash": 2166136261, "state": [100, 92, 0, 3, 0]}
+#
+# "tick" is which half second of the match it is. When both players'
+# hashes for the same tick are in, the server compares them.
+#
+# Messages take time to arrive, so for a moment after a hit the two
+# screens can honestly disagree. A room is only flagged once the hashes
+# have been different CONFIRM_CHECKS times in a row. Then the tick where
+# they started to differ and the last few states from both sides are
+# printed (and go in the match log, see match_recorder.py).
+#
+# This is its own event, not a 'player_action', so the relay doesn't do
+# any extra work at all.
+
+import threading
+import time
+from collections import deque
+
+
+CHECK_SECONDS = 0.5      # How often browsers send a hash (must match multiplayer_game.html)
+CONFIRM_CHECKS = 3       # Different hashes in a row before a room counts as desynced
+KEEP_TICKS = 8           # Ticks waiting for the other player's hash (older ones are dropped)
+HISTORY = 6              # Compared states kept per room for the desync report
+
+
+class _RoomChecks:
+    __slots__ = ("waiting", "streak", "first_bad_tick", "desynced", "history", "checks")
+
+    def __init__(self):
+        self.waiting = {}       # tick -> {player: (hash, state)}
+        self.streak = 0
+        self.first_bad_tick = None
+        self.desynced = None    # The report, once the room is flagged
+        self.history = deque(maxlen=HISTORY)
+        self.checks = 0
+
+
+class DesyncDetector:
+    """Compares both players' state hashes, tick by tick, for every room"""
+
+    def __init__(self, confirm=CONFIRM_CHECKS, on_desync=None, verbose=True):
+        self.confirm = confirm
+        self.on_desync = on_desync   # on_desync(code, report) when a room is flagged
+        self.verbose = verbose
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.matches = 0          # Hash pairs that were the same
+        self.mismatches = 0       # ... and different
+        self.rooms_checked = 0    # Finished matches that compared at least one pair
+        self.rooms_desynced = 0   # Matches that were flagged
+
+    def report(self, code, player, tick, digest, state=None):
+        """One player's hash for one tick. Returns the desync report if
+        this is what got the room flagged, otherwise None."""
+        with self._lock:
+            room = self._rooms.get(code)
+            if room is None:
+                room = self._rooms[code] = _RoomChecks()
+            hashes = room.waiting.get(tick)
+            if hashes is None:
+                hashes = room.waiting[tick] = {}
+                if len(room.waiting) > KEEP_TICKS:
+                    # The other player never sent these (lag, or they left)
+                    for old in sorted(room.waiting)[:len(room.waiting) - KEEP_TICKS]:
+                        del room.waiting[old]
+            hashes[player] = (digest, state)
+            if len(hashes) < 2:
+                return None
+            del room.waiting[tick]
+            return self._compare(code, room, tick, hashes)
+
+    def _compare(self, code, room, tick, hashes):
+        (player_a, (hash_a, state_a)), (player_b, (hash_b, state_b)) = sorted(hashes.items())
+        room.checks += 1
+        room.history.append({"tick": tick, player_a: state_a, player_b: state_b,
+                             "same": hash_a == hash_b})
+        if hash_a == hash_b:
+            self.matches += 1
+            room.streak = 0
+            room.first_bad_tick = None
+            return None
+
+        self.mismatches += 1
+        if room.streak == 0:
+            room.first_bad_tick = tick
+        room.streak += 1
+        if room.streak < self.confirm or room.desynced is not None:
+            return None
+
+        room.desynced = {"tick": room.first_bad_tick, "confirmed_tick": tick,
+                         "time": time.time(), "states": list(room.history)}
+        self.rooms_desynced += 1
+        if self.verbose:
+            print(f"DESYNC in room {code} from tick {room.first_bad_tick} "
+                  f"({room.first_bad_tick * CHECK_SECONDS:.1f}s): {room.desynced['states'][-1]}")
+        if self.on_desync is not None:
+            self.on_desync(code, room.desynced)
+        return room.desynced
+
+    def desynced(self, code):
+        """The room's desync report (None if it's in sync)"""
+        room = self._rooms.get(code)
+        return room.desynced if room is not None else None
+
+    def end_match(self, code):
+        """The match is over (or the room is gone) - start fresh next time"""
+        with self._lock:
+            room = self._rooms.pop(code, None)
+            if room is not None and room.checks:
+                self.rooms_checked += 1
+
+    def stats(self):
+        finished = self.rooms_checked
+        return {
+            "rooms_checking": len(self._rooms),
+            "rooms_checked": finished,
+            "rooms_desynced": self.rooms_desynced,
+            "desync_rate": self.rooms_desynced / finished if finished else 0.0,
+            "matches": self.matches,
+            "mismatches": self.mismatches,
+        }
+
+
+def state_hash(values):
+    """The same 32-bit FNV-1a hash the browser works out (for tests and tools)"""
+    digest = 0x811C9DC5
+    for value in values:
+        value &= 0xFFFFFFFF
+        for _ in range(4):
+            digest = ((digest ^ (value & 0xFF)) * 16777619) & 0xFFFFFFFF
+            value >>= 8
+    return digest
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python desync.py) to play lots of made-up
+# matches: both screens see the same hits, but each one a little late
+# (like real lag), and in some rooms one screen misses a 'damage'
+# message for good. Shows how many real desyncs are caught, how many
+# in-sync rooms get flagged by mistake, and what a report() costs.
+
+def _fake_match(rng, broken, seconds=60):
+    """A made-up match: its hits, which one screen 2 misses, and each screen's lag"""
+    hits = sorted(rng.uniform(0, seconds) for _ in range(rng.randint(5, 25)))
+    hits = [(when, rng.randrange(2), rng.randint(3, 12)) for when in hits]
+    missed = rng.randrange(len(hits)) if broken else None
+    lag = [rng.uniform(0.02, 0.2), rng.uniform(0.02, 0.2)]   # Each screen's delay
+    return hits, missed, lag
+
+
+def _play_match(detector, code, match, seconds=60):
+    """Send both screens' hashes for a match. Returns the detector's
+    report (or None) and when the missed hit happened (or None)."""
+    hits, missed, lag = match
+    flagged = None
+    for tick in range(int(seconds / CHECK_SECONDS)):
+        now = tick * CHECK_SECONDS
+        for player in (1, 2):
+            seen = [100, 100]
+            for index, (when, target, damage) in enumerate(hits):
+                if when + lag[player - 1] <= now and not (player == 2 and index == missed):
+                    seen[target] = max(0, seen[target] - damage)
+            state = [seen[0], seen[1], 0, 0, 0]
+            result = detector.report(code, player, tick, state_hash(state), state)
+            if result is not None:
+                flagged = result
+    detector.end_match(code)
+    return flagged, (hits[missed][0] if missed is not None else None)
+
+
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(5)
+    num_rooms = 1000
+    # The same matches for every setting, so the rows can be compared
+    matches = [_fake_match(rng, rng.random() < 0.1) for _ in range(num_rooms)]
+    broken_rooms = sum(match[1] is not None for match in matches)
+    print("=" * 60)
+    print(f"  DESYNC DETECTION ({num_rooms:,} made-up 60s matches, {broken_rooms} broken)")
+    print("=" * 60)
+    for confirm in (1, 2, CONFIRM_CHECKS):
+        detector = DesyncDetector(confirm, verbose=False)
+        caught = false_alarms = 0
+        delays = []
+        for i, match in enumerate(matches):
+            flagged, broke_at = _play_match(detector, f"R{i:05d}", match)
+            if flagged is None:
+                continue
+            delay = flagged["confirmed_tick"] * CHECK_SECONDS - broke_at if broke_at is not None else None
+            if delay is not None and delay >= 0:
+                caught += 1
+                delays.append(delay)
+            else:
+                # Flagged in a room that never broke - or in a broken room,
+                # but before the hit was missed (just the two screens'
+                # lag), so it wasn't the real desync that got caught
+                false_alarms += 1
+        print(f"  confirm={confirm}: caught {caught}/{broken_rooms} broken, "
+              f"false alarms {false_alarms}/{num_rooms}, "
+              f"flagged {sum(delays) / max(1, len(delays)):.1f}s after it broke")
+
+    # What one 'state_hash' costs the server
+    detector = DesyncDetector(verbose=False)
+    state = [100, 92, 0, 3, 0]
+    digest = state_hash(state)
+    calls = 200_000
+    start = time.perf_counter()
+    for i in range(calls // 2):
+        code = f"R{i % 500:03d}"
+        detector.report(code, 1, i, digest, state)
+        detector.report(code, 2, i, digest, state)
+    elapsed = time.perf_counter() - start
+    print(f"  report(): {elapsed / calls * 1e6:.2f} us per hash "
+          f"({CHECK_SECONDS:g}s apart, so {2 / CHECK_SECONDS:g} per room per second)")
@@ -0,0 +1,267 @@
+# Entities for Mina's PVP Fighting Game
+#
+# The server used to keep every room and player as nested dicts, and
+# every player carried their own copies of their weapon dicts:
+#
+#   {"number": 1, "coins": 0, "inventory": [{"name": "Bow", ...}], ...}
+#
+# With thousands of rooms that adds up, because a dict (and every copy of
+# every weapon in it) takes a lot more memory than the values inside.
+# Here rooms and players are small classes with __slots__ (a fixed list
+# of fields, no dict per object), and a player's weapons are just their
+# ids from the weapon catalog ("t1-bow"). The catalog's Weapon for an id
+# is shared by everyone, so nothing is copied.
+#
+# The handlers don't need to change: records still work like dicts
+# (player['coins'] += 100, room.get('state')), and player['inventory']
+# gives back the Weapon list. to_dict() turns a record back into exactly
+# the dicts the browser got before.
+#
+# Each RoomRecord also carries the room's random streams (room_rng.py),
+# about 400 bytes a room that the old dicts didn't have. The benchmark
+# at the bottom counts them, so records come out about a third smaller
+# than the dicts (around 1100 vs 1700 bytes a room) instead of half.
+
+from game_data import WEAPON_CATALOG
+from room_rng import RoomRandom
+
+
+def weapons_for(weapon_ids):
+    """Weapon ids -> the catalog's Weapons (unknown ids are skipped)"""
+    by_id = WEAPON_CATALOG.by_id
+    return [by_id[weapon_id] for weapon_id in weapon_ids if weapon_id in by_id]
+
+
+def weapon_ids_for(weapons):
+    """Weapons (or old-style weapon dicts, or ids) -> a tuple of ids"""
+    ids = []
+    for weapon in weapons:
+        if isinstance(weapon, str):
+            ids.append(weapon)
+        elif "id" in weapon:
+            ids.append(weapon["id"])
+        else:
+            # An old dict without an id: find it by tier and name
+            for match in WEAPON_CATALOG.tier(weapon.get("tier", 1)):
+                if match["name"] == weapon["name"]:
+                    ids.append(match["id"])
+                    break
+    return tuple(ids)
+
+
+class Record:
+    """A slotted object you can also read and write like a dict.
+
+    KEYS lists the names that work with record[key]. Anything else is a
+    KeyError, just like a dict without that key.
+    """
+
+    __slots__ = ()
+    KEYS = ()
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class PlayerRecord(Record):
+    """One player in a room: coins, weapons (by id), ability, skin..."""
+
+    __slots__ = ("number", "coins", "inventory_ids", "selected_ids",
+                 "ability", "skin", "ready", "rejoined")
+    KEYS = frozenset(("number", "coins", "inventory", "selected_weapons",
+                      "ability", "skin", "ready", "rejoined"))
+
+    def __init__(self, number, coins=0, inventory_ids=(), selected_ids=None,
+                 ability=None, skin=None, ready=False, rejoined=False):
+        self.number = number   # 1 or 2
+        self.coins = coins
+        # Tuples can't change, so the inventory and the selected weapons
+        # can be the very same tuple (they are for a brand new player)
+        self.inventory_ids = tuple(inventory_ids)
+        self.selected_ids = self.inventory_ids if selected_ids is None else tuple(selected_ids)
+        self.ability = ability
+        self.skin = skin
+        self.ready = ready
+        self.rejoined = rejoined
+
+    @property
+    def inventory(self):
+        return weapons_for(self.inventory_ids)
+
+    @inventory.setter
+    def inventory(self, weapons):
+        self.inventory_ids = weapon_ids_for(weapons)
+
+    @property
+    def selected_weapons(self):
+        return weapons_for(self.selected_ids)
+
+    @selected_weapons.setter
+    def selected_weapons(self, weapons):
+        self.selected_ids = weapon_ids_for(weapons)
+
+    def add_weapon(self, weapon):
+        """Put a weapon (or weapon id) in the inventory"""
+        self.inventory_ids += weapon_ids_for((weapon,))
+
+    def to_dict(self):
+        """The player as the dict the server (and browser) used before"""
+        return {
+            "number": self.number,
+            "coins": self.coins,
+            "inventory": self.inventory,
+            "selected_weapons": self.selected_weapons,
+            "ability": self.ability,
+            "skin": self.skin,
+            "ready": self.ready,
+            "rejoined": self.rejoined,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Read a player dict (from to_dict, or the old format)"""
+        inventory = weapon_ids_for(data.get("inventory", ()))
+        selected = weapon_ids_for(data.get("selected_weapons", ()))
+        return cls(data["number"], data.get("coins", 0), inventory,
+                   inventory if selected == inventory else selected,
+                   data.get("ability"), data.get("skin"),
+                   data.get("ready", False), data.get("rejoined", False))
+
+
+class RoomRecord(Record):
+    """One game room: its code, players (sid -> PlayerRecord), state and seed"""
+
+    __slots__ = ("code", "players", "state", "current_map", "created_at", "seed", "rng",
+                 "hazard_seed")
+    KEYS = frozenset(("code", "players", "state", "current_map", "created_at", "seed",
+                      "hazard_seed"))
+
+    def __init__(self, code, players=None, state="waiting", current_map=None, created_at=None,
+                 seed=None, hazard_seed=None):
+        self.code = code
+        self.players = {} if players is None else players   # sid -> PlayerRecord
+        self.state = state   # waiting, playing, finished
+        self.current_map = current_map
+        self.created_at = created_at
+        # The room's own random streams (see room_rng.py). Only the seed
+        # is saved: from_dict starts the streams again from the beginning.
+        self.rng = RoomRandom(seed)
+        self.seed = self.rng.seed
+        self.hazard_seed = hazard_seed   # This battle's hazards (see hazards.py)
+
+    def to_dict(self):
+        return {
+            "code": self.code,
+            "players": {sid: player.to_dict() for sid, player in self.players.items()},
+            "state": self.state,
+            "current_map": self.current_map,
+            "created_at": self.created_at,
+            "seed": self.seed,
+            "hazard_seed": self.hazard_seed,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        players = {sid: PlayerRecord.from_dict(player)
+                   for sid, player in data.get("players", {}).items()}
+        return cls(data["code"], players, data.get("state", "waiting"),
+                   data.get("current_map"), data.get("created_at"), data.get("seed"),
+                   data.get("hazard_seed"))
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python entities.py) to measure how much memory
+# 10,000 two-player rooms take as the old dicts and as records.
+
+def _old_room(code, rng):
+    """A room exactly like the server used to make them"""
+    import game_data
+
+    players = {}
+    for number in (1, 2):
+        weapon = rng.choice(game_data.WEAPONS[1]).copy()
+        weapon["tier"] = 1
+        players[f"sid-{code}-{number}"] = {
+            "number": number,
+            "coins": 0,
+            "inventory": [weapon],
+            "selected_weapons": [weapon],
+            "ability": None,
+            "skin": None,
+            "ready": False,
+        }
+    return {"code": code, "players": players, "state": "waiting",
+            "current_map": None, "created_at": None}
+
+
+def _new_room(code, rng):
+    players = {}
+    for number in (1, 2):
+        weapon = WEAPON_CATALOG.random_from_tier(1, rng)
+        players[f"sid-{code}-{number}"] = PlayerRecord(number, inventory_ids=(weapon["id"],))
+    return RoomRecord(code, players)
+
+
+def _measure(make_room, num_rooms):
+    import random
+    import tracemalloc
+
+    rng = random.Random(1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rooms = {}
+    for i in range(num_rooms):
+        code = f"R{i:05d}"
+        rooms[code] = make_room(code, rng)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return rooms, used
+
+
+if __name__ == "__main__":
+    import json
+
+    num_rooms = 10_000
+    old_rooms, old_bytes = _measure(_old_room, num_rooms)
+    new_rooms, new_bytes = _measure(_new_room, num_rooms)
+
+    print("=" * 50)
+    print(f"  MEMORY FOR {num_rooms:,} ROOMS (2 players each)")
+    print("=" * 50)
+    print(f"  Dicts (before): {old_bytes / 1e6:6.2f} MB  {old_bytes / num_rooms:6.0f} bytes/room")
+    print(f"  Records:        {new_bytes / 1e6:6.2f} MB  {new_bytes / num_rooms:6.0f} bytes/room"
+          f"  ({1 - new_bytes / old_bytes:.0%} less)")
+    print("  (both include the room codes and socket id strings)")
+    _, rng_bytes = _measure(lambda code, rng: RoomRandom(), num_rooms)
+    print(f"  ...of which random streams: {rng_bytes / num_rooms:6.0f} bytes/room (see room_rng.py)")
+
+    # What goes to the browser is the same as before (plus each weapon's id)
+    room = next(iter(new_rooms.values()))
+    same = RoomRecord.from_dict(json.loads(json.dumps(room.to_dict()))).to_dict() == room.to_dict()
+    print(f"  to_dict -> JSON -> from_dict round trip: {'OK' if same else 'DIFFERENT'}")
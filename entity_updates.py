@@ -0,0 +1,544 @@
+# Entity Updates for Mina's PVP Fighting Game
+#
+# Player 1's browser works out which breakable cubes are cracking, and
+# the server decides when comets and icicles appear (hazards.py). Player
+# 1's browser used to send every cube change and every hazard to the
+# other player as it happened - and the whole list of cubes, 20 times a
+# second, even when nothing had changed.
+#
+# Now cube messages stop at the server, and hazards start there. It
+# keeps its own copy of each room's entities (cubes and hazards), and
+# once per update tick it sends each player one 'entities' message with
+# just what they haven't seen:
+#
+#   {"tick": 5040,
+#    "cubes": {"mask": "a1", "states": [[1, 0, 12, 0], ...]},
+#    "spawn": [{"type": "comet", "id": 7, "x": 310.5, "speed": 6.2, "damage": 30, "age": 4}],
+#    "remove": [["icicle", 12]]}
+#
+# - cubes: only the cubes that changed. Bit i of mask (a hex number) is
+#   cube i, and states has one [isBroken, breakTimer, reformTimer,
+#   isBeingSteppedOn] for each bit that's set, in order.
+# - spawn: new hazards. age is how many frames ago it appeared, so the
+#   browser can move it forward to where it should be by now.
+# - remove: hazards that hit someone. The browser that was hit says so
+#   ('hazard_remove'), and the server only believes it if that player
+#   was near the hazard - otherwise a changed page could make every
+#   comet vanish for both players the moment it appears.
+#
+# Each player gets at most BUDGET_BYTES per tick. If more than that has
+# changed, the most important things go first:
+#   - removals and spawns before cubes, and cubes that broke or came back
+#     before ones whose timers just ticked on
+#   - things near the player before things on the other side of the map
+#   - and anything that's been waiting gets more important every tick,
+#     so it gets its turn soon
+#
+# Which hazards a room can have comes from its map in game_data.MAPS -
+# a comet on the Ice map is ignored, and so are cubes anywhere but
+# "Breakable Cubes".
+#
+# Running this file plays made-up Breakable Cubes and Comet Field matches
+# through it and compares the bytes with relaying everything.
+
+import json
+import threading
+import time
+
+from game_data import MAPS, PLAYER_HEIGHT, PLAYER_WIDTH, SCREEN_HEIGHT
+
+
+DEFAULT_UPDATE_RATE = 20    # 'entities' messages a second (at most)
+BUDGET_BYTES = 400          # Per player per tick: 8 KB/s at 20 a second
+HAZARD_AUTHORITY = 1        # The player whose browser runs the cubes
+HAZARD_LIFETIME = 180       # Frames until a hazard has surely fallen off the screen
+RELEVANCE_DISTANCE = 200    # Pixels away where something counts half as much
+
+ENTITY_ACTIONS = ("cubes", "hazard", "hazard_remove")
+
+# Every browser starts the battle with all the cubes like this
+INTACT_CUBE = (0, 0, 0, 0)
+
+# How important each kind of change is, before distance and waiting
+REMOVE_WEIGHT = 8.0
+SPAWN_WEIGHT = 6.0
+CUBE_FLIP_WEIGHT = 4.0     # Broke, or came back
+CUBE_TIMER_WEIGHT = 1.0    # Only its timers moved on
+
+# Where a falling hazard is, from how long ago it appeared (game_engine.js)
+COMET_START_Y = -50
+ICICLE_SPEED = 6           # Pixels a frame (each comet has its own speed)
+
+# How far from a player's last 'move' a hazard can be and still have hit
+# them: they kept running since then, and the hazard kept falling while
+# the 'hazard_remove' was on its way
+HIT_REACH_X = 80
+HIT_REACH_Y = 200
+
+
+def map_entities(map_data):
+    """(hazard types the map can have, (x, y) middle of each breakable cube)"""
+    types = {hazard["type"] for hazard in map_data.get("hazards", ())}
+    size = map_data.get("cube_size", 40)
+    floor_y = SCREEN_HEIGHT - 50
+    cubes = []
+    for start_x, height, count in map_data.get("cube_rows", ()):
+        for i in range(count):
+            cubes.append((start_x + i * size + size / 2, floor_y - height + size / 2))
+    return types, cubes
+
+
+def _cube_state(state):
+    """One cube from a 'cubes' message, as [isBroken, breakTimer, reformTimer, isBeingSteppedOn]"""
+    return (1 if state.get("isBroken") else 0, int(state.get("breakTimer", 0)),
+            int(state.get("reformTimer", 0)), 1 if state.get("isBeingSteppedOn") else 0)
+
+
+def _item_size(item):
+    return len(json.dumps(item, separators=(",", ":"))) + 1
+
+
+class _View:
+    """What one player's browser has been sent"""
+    __slots__ = ("number", "x", "y", "cubes", "hazards", "waiting")
+
+    def __init__(self, number):
+        self.number = number
+        self.x = self.y = None
+        self.cubes = {}       # cube index -> state it was sent (if not INTACT_CUBE)
+        self.hazards = set()  # Hazard keys it knows about
+        self.waiting = {}     # Entity key -> ticks it's been left out
+
+
+class _RoomEntities:
+    def __init__(self, map_data=None):
+        if map_data is None:
+            self.types = None   # Don't know the map (a placeholder room) - allow anything
+            self.cube_positions = []
+        else:
+            self.types, self.cube_positions = map_entities(map_data)
+        self.cubes = []         # Each cube's latest state
+        self.hazards = {}       # (type, id) -> {"data": what was spawned, "tick": when}
+        self.views = {}         # sid -> _View
+
+    def allows(self, hazard_type):
+        return self.types is None or hazard_type in self.types
+
+
+class EntityScheduler:
+    """Keeps each room's entities and decides what each player gets sent"""
+
+    def __init__(self, update_rate=DEFAULT_UPDATE_RATE, budget=BUDGET_BYTES):
+        self.update_rate = update_rate
+        self.interval = 1.0 / update_rate if update_rate else 0.0
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._rooms = {}   # room code -> _RoomEntities
+
+        # Metrics
+        self.updates_in = 0
+        self.rejected = 0        # From the wrong player, or not on this map
+        self.removes_refused = 0  # 'hazard_remove's from a player it couldn't have hit
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.cubes_sent = 0
+        self.spawns_sent = 0
+        self.removes_sent = 0
+        self.deferred = 0        # Left for a later tick by the budget
+        self.last_flush_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.update_rate > 0
+
+    def _room(self, code):
+        room = self._rooms.get(code)
+        if room is None:
+            room = self._rooms[code] = _RoomEntities()
+        return room
+
+    def new_battle(self, code, map_data):
+        """Both players are in - start with a clean copy of the map"""
+        with self._lock:
+            old = self._rooms.get(code)
+            room = self._rooms[code] = _RoomEntities(map_data)
+            if old is not None:
+                for sid, view in old.views.items():
+                    room.views[sid] = _View(view.number)
+
+    def track_player(self, code, sid, number, x, y):
+        """A player's latest position (from their 'move'), to judge what's near them"""
+        if not (isinstance(x, (int, float)) and isinstance(y, (int, float))):
+            x = y = None
+        with self._lock:
+            room = self._room(code)
+            view = room.views.get(sid)
+            if view is None:
+                view = room.views[sid] = _View(number)
+            view.x = x
+            view.y = y
+
+    def receive(self, code, sid, number, action, data, tick):
+        """A 'cubes', 'hazard' or 'hazard_remove' from a browser.
+        Returns False if it was ignored (browsers don't spawn hazards any
+        more - a 'hazard' is from an old page, and only counted)."""
+        if not isinstance(data, dict):
+            self.rejected += 1
+            return False
+        with self._lock:
+            self.updates_in += 1
+            room = self._room(code)
+            sender = room.views.get(sid)
+            if sender is None:
+                sender = room.views[sid] = _View(number)
+            if action == "hazard_remove":
+                # Anyone can be hit by a hazard
+                key = (data.get("type"), data.get("id"))
+                try:
+                    hazard = room.hazards.get(key)
+                except TypeError:   # An id that isn't a number or a string
+                    self.rejected += 1
+                    return False
+                if hazard is None:
+                    return False
+                if not self._could_hit(sender, hazard, tick):
+                    # Gone on the sender's screen, but nobody else's
+                    self.removes_refused += 1
+                    return False
+                del room.hazards[key]
+                sender.hazards.discard(key)
+                return True
+            if number != HAZARD_AUTHORITY:
+                self.rejected += 1
+                return False
+            if action == "cubes":
+                return self._receive_cubes(room, sender, data.get("states"))
+        self.rejected += 1
+        return False
+
+    def _receive_cubes(self, room, sender, states):
+        if not isinstance(states, list) or (room.types is not None and not room.cube_positions):
+            self.rejected += 1
+            return False
+        try:
+            room.cubes = [_cube_state(state) for state in states]
+        except (AttributeError, TypeError, ValueError):
+            self.rejected += 1
+            return False
+        # The browser that sent them has them already
+        sender.cubes = dict(enumerate(room.cubes))
+        return True
+
+    def spawn(self, code, hazard, tick):
+        """A hazard the server's schedule (hazards.py) says appears on `tick`"""
+        key = (hazard["type"], hazard["id"])
+        with self._lock:
+            room = self._room(code)
+            if not room.allows(hazard["type"]):
+                self.rejected += 1
+                return False
+            room.hazards[key] = {"data": hazard, "tick": tick}
+        return True
+
+    # -------------------------------------------------------------------------
+    # Picking what to send
+    # -------------------------------------------------------------------------
+
+    def _relevance(self, view, x, y):
+        """1 right next to the player, smaller further away"""
+        if view.x is None or x is None:
+            return 1.0
+        dx = x - view.x
+        dy = 0.0 if y is None else y - view.y
+        return 1.0 / (1.0 + (dx * dx + dy * dy) ** 0.5 / RELEVANCE_DISTANCE)
+
+    def _hazard_position(self, hazard, tick):
+        data = hazard["data"]
+        age = tick - hazard["tick"]
+        x = data.get("x")
+        if data.get("type") == "comet":
+            return x, COMET_START_Y + (data.get("speed") or 0) * age
+        y = data.get("y")
+        return x, None if y is None else y + ICICLE_SPEED * age
+
+    def _could_hit(self, view, hazard, tick):
+        """Was this player (where their last 'move' put them) near the hazard?"""
+        if view.x is None:
+            return False
+        x, y = self._hazard_position(hazard, tick)
+        if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+            return False
+        return (view.x - HIT_REACH_X <= x <= view.x + PLAYER_WIDTH + HIT_REACH_X and
+                view.y - HIT_REACH_Y <= y <= view.y + PLAYER_HEIGHT + HIT_REACH_Y)
+
+    def _candidates(self, room, view, tick):
+        """(priority, kind, key, item) for everything this player hasn't got"""
+        candidates = []
+        for key in view.hazards - room.hazards.keys():
+            item = [key[0], key[1]]
+            candidates.append((REMOVE_WEIGHT, "remove", key, item))
+        for key, hazard in room.hazards.items():
+            if key not in view.hazards:
+                x, y = self._hazard_position(hazard, tick)
+                item = dict(hazard["data"], age=tick - hazard["tick"])
+                candidates.append((SPAWN_WEIGHT * self._relevance(view, x, y), "spawn", key, item))
+        positions = room.cube_positions
+        for index, state in enumerate(room.cubes):
+            sent = view.cubes.get(index, INTACT_CUBE)
+            if sent == state:
+                continue
+            weight = CUBE_FLIP_WEIGHT if sent[0] != state[0] else CUBE_TIMER_WEIGHT
+            x, y = positions[index] if index < len(positions) else (None, None)
+            candidates.append((weight * self._relevance(view, x, y), "cube", index, state))
+
+        waiting = view.waiting
+        return [(weight * (1 + waiting.get(key, 0)), kind, key, item)
+                for weight, kind, key, item in candidates]
+
+    def _message(self, room, view, tick):
+        candidates = self._candidates(room, view, tick)
+        if not candidates:
+            view.waiting.clear()
+            return None
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        spent = 0
+        cubes = []
+        spawn = []
+        remove = []
+        waiting = {}
+        for _, kind, key, item in candidates:
+            size = _item_size(item)
+            # The most important thing always goes, even if it's big
+            if spent and spent + size > self.budget:
+                waiting[key] = view.waiting.get(key, 0) + 1
+                continue
+            spent += size
+            if kind == "cube":
+                cubes.append((key, item))
+                view.cubes[key] = item
+            elif kind == "spawn":
+                spawn.append(item)
+                view.hazards.add(key)
+            else:
+                remove.append(item)
+                view.hazards.discard(key)
+        view.waiting = waiting
+        self.deferred += len(waiting)
+
+        message = {"tick": tick}
+        if cubes:
+            cubes.sort()
+            mask = 0
+            for index, _ in cubes:
+                mask |= 1 << index
+            message["cubes"] = {"mask": format(mask, "x"), "states": [list(state) for _, state in cubes]}
+            self.cubes_sent += len(cubes)
+        if spawn:
+            message["spawn"] = spawn
+            self.spawns_sent += len(spawn)
+        if remove:
+            message["remove"] = remove
+            self.removes_sent += len(remove)
+        return message
+
+    def flush(self, tick):
+        """Everything to send this tick: a list of (sid, 'entities' message)"""
+        start = time.perf_counter()
+        messages = []
+        with self._lock:
+            for room in self._rooms.values():
+                # Hazards that have fallen off the screen are gone on
+                # every screen by now - no need to tell anyone
+                for key in [key for key, hazard in room.hazards.items()
+                            if tick - hazard["tick"] > HAZARD_LIFETIME]:
+                    del room.hazards[key]
+                    for view in room.views.values():
+                        view.hazards.discard(key)
+                for sid, view in room.views.items():
+                    message = self._message(room, view, tick)
+                    if message is not None:
+                        messages.append((sid, message))
+            self.messages_out += len(messages)
+        self.bytes_out += sum(_item_size(message) for _, message in messages)
+        self.last_flush_seconds = time.perf_counter() - start
+        return messages
+
+    def forget(self, sid):
+        with self._lock:
+            for room in self._rooms.values():
+                room.views.pop(sid, None)
+
+    def drop_room(self, code):
+        with self._lock:
+            self._rooms.pop(code, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "update_rate": self.update_rate,
+                "budget_bytes": self.budget,
+                "rooms": len(self._rooms),
+                "updates_in": self.updates_in,
+                "rejected": self.rejected,
+                "removes_refused": self.removes_refused,
+                "messages_out": self.messages_out,
+                "bytes_out": self.bytes_out,
+                "cubes_sent": self.cubes_sent,
+                "spawns_sent": self.spawns_sent,
+                "removes_sent": self.removes_sent,
+                "deferred": self.deferred,
+                "last_flush_ms": self.last_flush_seconds * 1000,
+            }
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Two bots hop between cubes (Breakable Cubes) or run around while comets
+# fall (Comet Field). Player 1's browser sends what it always used to
+# send; we count the bytes player 2 gets when the server relays all of
+# it, and when the scheduler sends it at a few different budgets (with
+# the comets coming from the server instead).
+
+def _step_cube(state, stepped_on):
+    """BreakableCube.update from game_engine.js"""
+    broken, break_timer, reform_timer, _ = state
+    if not broken:
+        if stepped_on:
+            break_timer += 1
+            if break_timer >= 60:
+                return (1, 0, 0, 1)
+            return (0, break_timer, 0, 1)
+        return (0, 0, 0, 0)
+    reform_timer += 1
+    if reform_timer >= 60:
+        return (0, 0, 0, 0)
+    return (1, break_timer, reform_timer, 0)
+
+
+def _fake_match(rng, map_data, seconds):
+    """Yields (frame, [(action, data) sent by player 1], {number: (x, y)})"""
+    _, positions = map_entities(map_data)
+    cubes = [(0, 0, 0, 0)] * len(positions)
+    standing = {1: 0, 2: len(positions) - 1}
+    where = {1: (200.0, 400.0), 2: (900.0, 400.0)}
+    next_hop = {1: 0, 2: 0}
+    next_comet = rng.randint(60, 180)
+    hazard_id = 0
+    falling = []   # (id, x, speed, y)
+    for frame in range(seconds * 60):
+        sent = []
+        for number in (1, 2):
+            if frame >= next_hop[number]:
+                next_hop[number] = frame + rng.randint(30, 120)
+                if positions:
+                    standing[number] = rng.randrange(len(positions))
+                    where[number] = positions[standing[number]]
+                else:
+                    where[number] = (rng.uniform(0, 1160), rng.choice((590.0, 460.0, 260.0)))
+        if positions:
+            on = {standing[1], standing[2]}
+            cubes = [_step_cube(state, index in on) for index, state in enumerate(cubes)]
+            if frame % 3 == 0:
+                sent.append(("cubes", {"states": [
+                    {"isBroken": bool(s[0]), "breakTimer": s[1], "reformTimer": s[2],
+                     "isBeingSteppedOn": bool(s[3])} for s in cubes]}))
+        else:
+            if frame >= next_comet:
+                next_comet = frame + rng.randint(60, 180)
+                hazard_id += 1
+                comet = {"type": "comet", "id": hazard_id, "x": rng.uniform(0, 1200),
+                         "speed": 5 + rng.random() * 3, "damage": 30}
+                falling.append([hazard_id, comet["x"], comet["speed"], COMET_START_Y])
+                sent.append(("hazard", comet))
+            for comet in list(falling):
+                comet[3] += comet[2]
+                x, y = where[1]
+                if abs(comet[1] - x) < 30 and abs(comet[3] - y) < 40:
+                    sent.append(("hazard_remove", {"type": "comet", "id": comet[0]}))
+                    falling.remove(comet)
+                elif comet[3] > SCREEN_HEIGHT:
+                    falling.remove(comet)
+        yield frame, sent, where
+
+
+def _benchmark(map_name, budgets, seconds=120, seed=24):
+    import random
+
+    from send_rate import packet_size
+
+    map_data = next(m for m in MAPS if m["name"] == map_name)
+    rng = random.Random(seed)
+    relayed = 0
+    for _, sent, _ in _fake_match(rng, map_data, seconds):
+        for action, data in sent:
+            relayed += packet_size("opponent_action", {"action": action, "data": data, "tick": 0})
+    print(f"  {map_name} ({seconds}s): relaying everything sends player 2 "
+          f"{relayed / seconds / 1024:.2f} KB/s")
+
+    for budget in budgets:
+        rng = random.Random(seed)
+        scheduler = EntityScheduler(budget=budget)
+        scheduler.new_battle("BENCH", map_data)
+        sent_bytes = 0
+        near_waits = []
+        far_waits = []
+        changed_at = {}   # cube index -> frame player 1 changed it, not yet sent
+        flush_time = 0.0
+        hits = {1: [0, 0], 2: [0, 0]}   # player -> [hazard_removes sent, passed on]
+        for frame, sent, where in _fake_match(rng, map_data, seconds):
+            for number in (1, 2):
+                scheduler.track_player("BENCH", number, number, *where[number])
+            for action, data in sent:
+                if action == "cubes":
+                    room = scheduler._rooms["BENCH"]
+                    for index, state in enumerate(data["states"]):
+                        state = _cube_state(state)
+                        if index < len(room.cubes) and room.cubes[index] != state:
+                            changed_at.setdefault(index, frame)
+                if action == "hazard":
+                    scheduler.spawn("BENCH", data, frame)
+                    # A changed page on player 2's side makes every comet vanish
+                    removes = [(2, {"type": data["type"], "id": data["id"]})]
+                elif action == "hazard_remove":
+                    removes = [(1, data)]
+                else:
+                    scheduler.receive("BENCH", 1, 1, action, data, frame)
+                    removes = []
+                for number, remove in removes:
+                    hits[number][0] += 1
+                    hits[number][1] += scheduler.receive("BENCH", number, number, "hazard_remove",
+                                                         remove, frame)
+            if frame % 3 == 0:
+                start = time.perf_counter()
+                messages = scheduler.flush(frame)
+                flush_time += time.perf_counter() - start
+                for sid, message in messages:
+                    if sid != 2:
+                        continue
+                    sent_bytes += packet_size("entities", message)
+                    mask = int(message.get("cubes", {}).get("mask", "0"), 16)
+                    x, y = where[2]
+                    for index in [i for i in changed_at if mask >> i & 1]:
+                        cube_x, cube_y = map_entities(map_data)[1][index]
+                        near = abs(cube_x - x) + abs(cube_y - y) < 300
+                        (near_waits if near else far_waits).append(frame - changed_at.pop(index))
+        label = "no budget" if budget == float("inf") else f"budget {budget} bytes/tick"
+        line = f"    {label:<22}: {sent_bytes / seconds / 1024:5.2f} KB/s " \
+               f"({1 - sent_bytes / relayed:4.0%} less)"
+        if near_waits or far_waits:
+            line += (f", cube changes reach player 2 after {sum(near_waits) / max(1, len(near_waits)) / 60 * 1000:3.0f} ms"
+                     f" nearby / {sum(far_waits) / max(1, len(far_waits)) / 60 * 1000:3.0f} ms far away")
+        print(line + f", {flush_time / (seconds * 20) * 1e6:.0f} us per flush")
+        if hits[1][0]:
+            print(f"    'hazard_remove's passed on: {hits[1][1]}/{hits[1][0]} from real hits, "
+                  f"{hits[2][1]}/{hits[2][0]} from a page removing every comet as it appears")
+
+
+if __name__ == "__main__":
+    print("=" * 78)
+    print("  ENTITY UPDATES - relaying everything vs the server's scheduler")
+    print("=" * 78)
+    _benchmark("Breakable Cubes", (float("inf"), BUDGET_BYTES, 24))
+    _benchmark("Comet Field", (BUDGET_BYTES,))
@@ -2,6 +2,11 @@
 # This file contains all the weapons, abilities, and game settings
 # Created by Mina & Ava
 
+import random
+
+from weapon_catalog import WeaponCatalog
+
+
 # =============================================================================
 # GAME SETTINGS
 # =============================================================================
@@ -117,6 +122,20 @@ WEAPONS = {
 }
 
 
+# Mystery box tier chances: Tier 1 = common, Tier 5 = rare
+MYSTERY_BOX_TIER_WEIGHTS = {
+    1: 40,  # 40% chance
+    2: 30,  # 30% chance
+    3: 15,  # 15% chance
+    4: 10,  # 10% chance
+    5: 5,   # 5% chance - LEGENDARY!
+}
+
+# Every weapon above, with an id ("t1-sword") and its tier, looked up
+# in one step (see weapon_catalog.py)
+WEAPON_CATALOG = WeaponCatalog(WEAPONS, MYSTERY_BOX_TIER_WEIGHTS)
+
+
 # =============================================================================
 # ABILITIES
 # =============================================================================
@@ -159,7 +178,9 @@ ABILITIES = [
 # =============================================================================
 # Each map has:
 #   - name: what it's called
-#   - hazards: list of dangerous things on the map
+#   - hazards: list of dangerous things on the map. Comets, lava, icicles
+#     and spaceships are run by the server from these numbers (see
+#     hazards.py) - times are in frames (60 a second), sizes in pixels
 #   - description: what makes it special
 #   - platforms: where players can stand (x, y, width, height)
 
@@ -182,7 +203,13 @@ MAPS = [
         "name": "Comet Field",
         "description": "Watch out! Comets fall from the sky!",
         "hazards": [
-            {"type": "comet", "damage": 30, "spawn_rate": "every few seconds"}
+            {
+                "type": "comet",
+                "damage": 30,
+                "spawn_every": [60, 180],  # A new comet every 1-3 seconds
+                "speed": [5, 8],           # Pixels per frame (each comet picks one)
+                "radius": 15,
+            }
         ],
         "platforms": [
             {"x": 0, "y": 650, "width": 1200, "height": 50},
@@ -202,8 +229,9 @@ MAPS = [
                 "type": "lava",
                 "damage": 5,  # Per frame while touching!
                 "start_height": 50,
-                "rise_rate": 100,  # Pixels every 20 seconds
-                "max_height": 400
+                "rise_rate": 80,      # Pixels...
+                "rise_every": 1200,   # ... every 20 seconds
+                "max_height": 420
             }
         ],
         "platforms": [
@@ -225,7 +253,11 @@ MAPS = [
                 "type": "icicle",
                 "damage_min": 1,
                 "damage_max": 20,
-                "spawn_rate": "3-5 every 2-3 seconds"
+                "count_min": 3,            # 3-5 icicles...
+                "count_max": 5,
+                "spawn_every": [120, 180],  # ... every 2-3 seconds
+                "speed": 6,
+                "platform": 6,             # They fall from the high platform
             },
             {
                 "type": "slippery",
@@ -248,7 +280,11 @@ MAPS = [
         "hazards": [
             {
                 "type": "spaceship",
-                "count": 5,
+                "count": 2,
+                "positions": [[300, 60], [900, 80]],   # Where each one hovers
+                "beam_width": 40,
+                "lift": 4,      # Pixels per frame the beam pulls you up
+                "wobble": 8,    # Pixels they bob up and down
                 "description": "Hover at different heights, beam pulls you in"
             },
             {
@@ -278,15 +314,36 @@ MAPS = [
                 "location": "floor"
             }
         ],
-        "platforms": []  # Breakable cube platforms are generated on the client side
+        "platforms": [],  # Breakable cube platforms are generated from cube_rows
+        # Each row is [start x, height above the acid floor, number of cubes]
+        # (same layout as the cubes in multiplayer_game.html)
+        "cube_size": 40,
+        "cube_rows": [
+            [100, 80, 3], [400, 80, 3], [700, 80, 3], [1000, 80, 2],
+            [250, 200, 2], [550, 200, 3], [850, 200, 2],
+            [100, 320, 3], [400, 320, 2], [700, 320, 3],
+            [250, 440, 2], [550, 440, 4], [900, 440, 2],
+            [400, 560, 3],
+        ],
     },
 ]
 
 
-def get_random_map():
+def get_map_platforms(map_data):
+    """All the platforms on a map, including generated breakable cubes"""
+    platforms = list(map_data.get("platforms", []))
+    size = map_data.get("cube_size", 40)
+    floor_y = SCREEN_HEIGHT - 50
+    for start_x, height, count in map_data.get("cube_rows", []):
+        for i in range(count):
+            platforms.append({"x": start_x + i * size, "y": floor_y - height,
+                              "width": size, "height": size})
+    return platforms
+
+
+def get_random_map(rng=random):
     """Pick a random map for battle"""
-    import random
-    return random.choice(MAPS)
+    return rng.choice(MAPS)
 
 
 # =============================================================================
@@ -325,10 +382,9 @@ EASTER_EGG = {
 }
 
 
-def get_random_easter_egg():
+def get_random_easter_egg(rng=random):
     """Pick which easter egg appearance to show"""
-    import random
-    appearance = random.choice(EASTER_EGG["appearances"])
+    appearance = rng.choice(EASTER_EGG["appearances"])
     return {
         "appearance": appearance,
         "design": EASTER_EGG["yeti_design"],
@@ -367,10 +423,9 @@ TIEBREAKER = {
 }
 
 
-def get_random_falling_object():
+def get_random_falling_object(rng=random):
     """Get a random object for the tiebreaker minigame"""
-    import random
-    return random.choice(TIEBREAKER["falling_objects"]).copy()
+    return rng.choice(TIEBREAKER["falling_objects"]).copy()
 
 
 # =============================================================================
@@ -378,61 +433,52 @@ def get_random_falling_object():
 # =============================================================================
 
 def get_all_weapons():
-    """Returns a flat list of ALL weapons with their tier included"""
-    all_weapons = []
-    for tier, weapons in WEAPONS.items():
-        for weapon in weapons:
-            # Add the tier to each weapon
-            weapon_with_tier = weapon.copy()
-            weapon_with_tier["tier"] = tier
-            all_weapons.append(weapon_with_tier)
-    return all_weapons
-
-
-def get_random_tier1_weapon():
+    """Returns a flat list of ALL weapons with their tier (and id) included"""
+    return list(WEAPON_CATALOG)
+
+
+def get_weapon(weapon_id):
+    """Look up a weapon by its id, like "t2-bow" (None if there isn't one)"""
+    return WEAPON_CATALOG.get(weapon_id)
+
+
+def get_random_tier1_weapon(rng=random):
     """Get a random Tier 1 weapon (for starting the game)"""
-    import random
-    weapon = random.choice(WEAPONS[1]).copy()
-    weapon["tier"] = 1
-    return weapon
-
-
-def get_random_weapon_for_mystery_box():
-    """Get a random weapon from any tier (weighted by rarity)"""
-    import random
-
-    # Tier chances: Tier 1 = common, Tier 5 = rare
-    tier_weights = {
-        1: 40,  # 40% chance
-        2: 30,  # 30% chance
-        3: 15,  # 15% chance
-        4: 10,  # 10% chance
-        5: 5,   # 5% chance - LEGENDARY!
-    }
+    return WEAPON_CATALOG.random_from_tier(1, rng)
 
-    # Pick a tier based on weights
-    tiers = list(tier_weights.keys())
-    weights = list(tier_weights.values())
-    chosen_tier = random.choices(tiers, weights=weights)[0]
 
-    # Pick a random weapon from that tier
-    weapon = random.choice(WEAPONS[chosen_tier]).copy()
-    weapon["tier"] = chosen_tier
-    return weapon
+def get_random_weapon_for_mystery_box(rng=random):
+    """Get a random weapon from any tier (weighted by rarity, see MYSTERY_BOX_TIER_WEIGHTS)"""
+    return WEAPON_CATALOG.random_mystery_box(rng)
 
 
 def count_weapons():
     """Count total number of weapons"""
-    total = 0
-    for tier, weapons in WEAPONS.items():
-        total += len(weapons)
-    return total
+    return len(WEAPON_CATALOG)
 
 
-def get_random_ability():
+def get_random_ability(rng=random):
     """Get a random ability (for the store)"""
-    import random
-    return random.choice(ABILITIES).copy()
+    return rng.choice(ABILITIES).copy()
+
+
+def get_game_data():
+    """Everything the browsers need, for the /game-data endpoint.
+    Both game.html and multiplayer_game.html fetch this so they
+    always use the same values — change this file and both games update!
+    """
+    return {
+        "GRAVITY": GRAVITY,
+        "JUMP_STRENGTH": JUMP_STRENGTH,
+        "PLAYER_SPEED": PLAYER_SPEED,
+        "PLAYER_WIDTH": PLAYER_WIDTH,
+        "PLAYER_HEIGHT": PLAYER_HEIGHT,
+        "STARTING_HP": STARTING_HP,
+        "ATTACK_COOLDOWN": ATTACK_COOLDOWN,
+        "weapons": get_all_weapons(),
+        "maps": MAPS,
+        "abilities": [a["name"].lower() for a in ABILITIES],
+    }
 
 
 # =============================================================================
@@ -449,10 +495,10 @@ if __name__ == "__main__":
     print(f"Total weapons: {count_weapons()}")
     print()
 
-    for tier, weapons in WEAPONS.items():
+    for tier, weapons in WEAPON_CATALOG.by_tier.items():
         print(f"TIER {tier}:")
         for w in weapons:
-            print(f"  - {w['name']} ({w['damage']} damage, {w['type']})")
+            print(f"  - {w['name']} ({w['damage']} damage, {w['type']})  [{w['id']}]")
         print()
 
     print("=" * 50)
@@ -0,0 +1,807 @@
+# Game Server for Mina's PVP Fighting Game
+#
+# The game itself: rooms, battles, relaying moves, the simulation, hazards,
+# hit checks, recording... everything that happens when a browser sends
+# an event. There are two ways to run it:
+#
+#   app.py          - Flask-SocketIO, a thread for every connection
+#   async_server.py - python-socketio on one asyncio event loop
+#
+# Both just pass each event to a GameServer method and send what it gives
+# back, so the game is only written once and the two servers can't drift
+# apart.
+#
+# A GameServer method never sends anything itself. It changes the rooms
+# and returns an Outbox - the Socket.IO rooms to join, the messages to
+# send (in order) and the background loops that need to be running. The
+# server it runs in does the sending. That also means a handler has
+# finished changing everything before the first message goes out (which
+# is what lets async_server.py do without locks).
+
+import os
+
+from game_data import (
+    get_random_weapon_for_mystery_box,
+    get_random_ability,
+    get_random_map,
+    STORE_PRICES,
+    WIN_REWARD,
+)
+from simulation import SimulationEngine
+from relay_batcher import RelayBatcher, frame_payload
+from metrics import metrics, count_rooms_by_state
+from room_store import create_new_room, create_new_player, generate_room_code
+from match_recorder import SERVER, recorder_from_env
+from desync import DesyncDetector
+from lag_compensation import validator_from_env
+from input_sync import LATEST_ONLY_ACTIONS, InputAcks, ServerClock, read_seq, stamp
+from send_rate import SendRateController
+from entity_updates import BUDGET_BYTES, DEFAULT_UPDATE_RATE, ENTITY_ACTIONS, EntityScheduler
+from hazards import HazardEngine
+from net_protocol import (
+    PROTOCOLS,
+    PROTOCOL_JSON,
+    ConnectionCodec,
+    ProtocolError,
+    quantize_state,
+    dequantize_state,
+)
+
+
+# =============================================================================
+# SETTINGS
+# =============================================================================
+
+# When this is on, the server runs the fight itself (see simulation.py)
+# and sends everyone the real positions and HP instead of trusting
+# the 'damage' messages that browsers send each other.
+SERVER_AUTHORITATIVE = os.environ.get('SERVER_AUTHORITATIVE', '0') == '1'
+
+# Send a snapshot every few ticks (60 ticks/sec / 3 = 20 snapshots/sec,
+# the same rate browsers send their 'move' updates)
+SNAPSHOT_EVERY_TICKS = 3
+
+# How many times a second queued 'player_action's are sent on to the
+# other player (see relay_batcher.py). 0 = send each one right away.
+RELAY_TICK_RATE = int(os.environ.get('RELAY_TICK_RATE', '20'))
+
+# How many times a second hazards and breakable cubes are sent out, and
+# how many bytes each player may get each time (see entity_updates.py).
+# ENTITY_UPDATE_RATE=0 relays them like any other action instead.
+ENTITY_UPDATE_RATE = int(os.environ.get('ENTITY_UPDATE_RATE', str(DEFAULT_UPDATE_RATE)))
+ENTITY_BUDGET_BYTES = int(os.environ.get('ENTITY_BUDGET_BYTES', str(BUDGET_BYTES)))
+
+# The background loops a server has to run (started the first time an
+# Outbox asks for them)
+LOOP_SIMULATION = 'simulation'
+LOOP_RELAY = 'relay'
+LOOP_ENTITIES = 'entities'
+
+
+# =============================================================================
+# OUTBOX - what a handler wants sent
+# =============================================================================
+
+class Outbox:
+    """Everything one handler (or one loop tick) wants done on the network"""
+
+    __slots__ = ("sid", "joins", "messages", "loops")
+
+    def __init__(self, sid=None):
+        self.sid = sid          # Who sent the event (replies go to them)
+        self.joins = []         # (sid, room code) - done before any message is sent
+        self.messages = []      # (event, payload, emit keyword arguments, metrics timer name)
+        self.loops = []         # Background loops that need to be running
+
+    def emit(self, event, payload, timer=None, **target):
+        """Send `event` - target is to= (a sid or room code) and maybe skip_sid="""
+        self.messages.append((event, payload, target, timer))
+
+    def reply(self, event, payload):
+        """Send `event` back to whoever sent this one"""
+        self.emit(event, payload, to=self.sid)
+
+    def join(self, code):
+        """Put the sender in the Socket.IO room `code`"""
+        self.joins.append((self.sid, code))
+
+    def start(self, loop):
+        if loop not in self.loops:
+            self.loops.append(loop)
+
+
+# =============================================================================
+# THE GAME
+# =============================================================================
+
+class GameServer:
+    """Rooms, battles and relaying, for whichever server is sending"""
+
+    def __init__(self, backend, socket_server=None):
+        # Where rooms live, and which worker owns which room (see room_backend.py)
+        self.backend = backend
+        # game_rooms[code] = room data, and it also remembers which room
+        # each player's socket is in so we never have to search for it.
+        # Handlers run at the same time, so hold game_rooms.room_lock(code)
+        # while changing a room's players or coins.
+        self.game_rooms = backend.rooms
+        # python-socketio's server, only used to see how much is waiting
+        # to go out to a connection (see outbound_backlog)
+        self.socket_server = socket_server
+
+        # Every room's events go in a log, so replay.py can play it again
+        # (see match_recorder.py). RECORD_MATCHES=0 turns this off.
+        self.match_recorder = recorder_from_env()
+
+        # Browsers that run the fight themselves send a hash of what both
+        # screens should agree on every half second (see desync.py). Rooms
+        # whose hashes stop matching are logged, and go in the match log too.
+        self.desync_detector = DesyncDetector(
+            on_desync=lambda code, report: self.match_recorder.record(code, 'desync', SERVER, report))
+
+        # Browsers say when they hit someone. The server remembers where
+        # everyone was for the last second and checks each hit against what
+        # the attacker's (laggy) screen showed (see lag_compensation.py).
+        # HIT_VALIDATION=log only counts bad hits, HIT_VALIDATION=off skips this.
+        self.hit_validator = validator_from_env()
+        self.rtt_tracker = self.hit_validator.rtt
+
+        # Browsers number their 'move's and 'input's, and everything we send
+        # back says the server tick and the last number we got from each
+        # player, so browsers can predict their own movement and correct it
+        # (see input_sync.py)
+        self.server_clock = ServerClock()
+        self.input_acks = InputAcks()
+
+        # The server tells each browser how often to send its 'move's -
+        # slower when its connection is struggling, once a second when it's
+        # standing still, and not at all once the battle is over (see send_rate.py)
+        self.send_rates = SendRateController()
+
+        # The server runs the fight at 60 ticks per second (simulation.py)
+        self.simulation = SimulationEngine(batch_physics=True)
+
+        # Actions are sent on once per network tick (relay_batcher.py)
+        self.relay_batcher = RelayBatcher(RELAY_TICK_RATE)
+
+        # What each player hears about hazards and cubes (entity_updates.py).
+        # When the browsers run the fight, the server still decides when
+        # each comet and icicle appears (hazards.py) and sends it to both.
+        self.entity_updates = EntityScheduler(ENTITY_UPDATE_RATE, ENTITY_BUDGET_BYTES)
+        self.hazard_engine = HazardEngine()
+
+        # Each connection speaks JSON or binary (net_protocol.py).
+        # Browsers that don't ask for anything keep getting plain JSON.
+        self.connection_codecs = {}  # sid -> ConnectionCodec
+
+        # Rooms whose battle has begun (both players rejoined after
+        # 'game_start'). A page reloaded in the middle of a fight rejoins
+        # the battle that's already going instead of starting it again.
+        self.battles = set()
+
+        self._add_gauges()
+
+    # -------------------------------------------------------------------------
+    # Helpers
+    # -------------------------------------------------------------------------
+
+    def send_to_owner(self, out, code):
+        """If another worker owns this room, tell the browser to go there.
+
+        Returns True if the browser was sent away.
+        """
+        if self.backend.owns(code):
+            return False
+        out.reply('wrong_worker', {'code': code, 'worker': self.backend.owner(code)})
+        return True
+
+    def outbound_backlog(self, sid):
+        """How many packets are waiting to go out to this connection"""
+        server = self.socket_server
+        try:
+            return server.eio.sockets[server.manager.eio_sid_from_sid(sid, '/')].queue.qsize()
+        except (AttributeError, KeyError):
+            return 0
+
+    def start_room_simulation(self, out, code):
+        """Start simulating a room once both players are in the battle"""
+        room = self.game_rooms[code]
+        weapons = {p['number']: p['selected_weapons'] for p in room['players'].values()}
+        room_sim = self.simulation.add_room(code, room['current_map'], weapons, room['hazard_seed'])
+        self.match_recorder.record_simulation(code, room_sim)
+        out.start(LOOP_SIMULATION)
+
+    def drop_room(self, code):
+        """Forget everything about a room that's been deleted"""
+        self.simulation.remove_room(code)
+        self.relay_batcher.drop_room(code)
+        self.match_recorder.close_room(code)
+        self.desync_detector.end_match(code)
+        self.hit_validator.drop_room(code)
+        self.input_acks.drop_room(code)
+        self.entity_updates.drop_room(code)
+        self.hazard_engine.stop(code)
+        self.battles.discard(code)
+
+    def has_binary_peer(self, code, sender):
+        """Does anyone else in this room want binary 'move' updates?"""
+        for sid in self.game_rooms[code]['players']:
+            if sid != sender:
+                codec = self.connection_codecs.get(sid)
+                if codec is not None and codec.binary:
+                    return True
+        return False
+
+    def relay_move(self, out, code, action_data):
+        """Send a 'move' to the other player in whatever format they speak.
+        Returns the move's numbers (see net_protocol.py), or None if it was bad."""
+        sender = out.sid
+        state = values = None
+        if isinstance(action_data, (bytes, bytearray)):
+            codec = self.connection_codecs.get(sender)
+            if codec is None:
+                return None
+            try:
+                seq, values = codec.decoder.decode_values(action_data)
+            except ProtocolError as e:
+                print(f"Bad binary move from {sender}: {e}")
+                return None
+            # Let the sender know, so its next update can be a small delta
+            out.reply('state_ack', {'seq': seq})
+        else:
+            state = action_data
+            try:
+                # Worked out before sending anything, so a bad one goes nowhere
+                values = quantize_state(state)
+            except (TypeError, ValueError, OverflowError) as e:
+                print(f"Bad move from {sender}: {e!r}")
+                return None
+
+        for sid in self.game_rooms[code]['players']:
+            if sid == sender:
+                continue
+            codec = self.connection_codecs.get(sid)
+            if codec is not None and codec.binary:
+                out.emit('opponent_state', codec.encoder.encode_values(values), 'relay_fanout', to=sid)
+            else:
+                if state is None:
+                    state = dequantize_state(values)
+                out.emit('opponent_action', {'action': 'move', 'data': state}, 'relay_fanout', to=sid)
+        return values
+
+    # -------------------------------------------------------------------------
+    # Background loops - each call is one tick, the server does the waiting
+    # -------------------------------------------------------------------------
+
+    def simulation_tick(self):
+        """Steps every room at a fixed rate and broadcasts snapshots"""
+        out = Outbox()
+        simulation = self.simulation
+        ticks = simulation.advance()
+        if ticks and simulation.tick % SNAPSHOT_EVERY_TICKS < ticks:
+            for code, room_sim in list(simulation.rooms.items()):
+                out.emit('snapshot', room_sim.snapshot(), to=code)
+        return out
+
+    def relay_tick(self):
+        """Sends every room's queued actions as one frame per sender"""
+        out = Outbox()
+        tick = self.server_clock.tick()
+        for code, sender, frame in self.relay_batcher.flush():
+            payload = stamp(frame_payload(frame), tick, self.input_acks.acks(code))
+            out.emit('opponent_action', payload, 'relay_fanout', to=code, skip_sid=sender)
+        return out
+
+    @property
+    def entity_interval(self):
+        return self.entity_updates.interval or 1.0 / DEFAULT_UPDATE_RATE
+
+    def entity_tick(self):
+        """Sends each player the hazards and cubes they haven't seen yet"""
+        out = Outbox()
+        tick = self.server_clock.tick()
+        spawned = self.hazard_engine.advance(tick)
+        if not self.entity_updates.enabled:
+            # No scheduler - everyone in the room gets the new hazards straight away
+            rooms = {}
+            for code, hazard, spawned_at in spawned:
+                rooms.setdefault(code, []).append(dict(hazard, age=tick - spawned_at))
+            for code, hazards in rooms.items():
+                out.emit('entities', {'tick': tick, 'spawn': hazards}, to=code)
+            return out
+        for code, hazard, spawned_at in spawned:
+            self.entity_updates.spawn(code, hazard, spawned_at)
+        for sid, message in self.entity_updates.flush(tick):
+            out.emit('entities', message, to=sid)
+        return out
+
+    # -------------------------------------------------------------------------
+    # Events from browsers
+    # -------------------------------------------------------------------------
+
+    def connect(self, sid):
+        """When a player connects to the server"""
+        out = Outbox(sid)
+        print(f"Player connected: {sid}")
+        out.reply('connected', {'message': 'Welcome to Mina\'s PVP Game!'})
+        return out
+
+    def disconnect(self, sid):
+        """When a player disconnects"""
+        out = Outbox(sid)
+        print(f"Player disconnected: {sid}")
+        self.connection_codecs.pop(sid, None)
+        self.rtt_tracker.forget(sid)
+        self.send_rates.forget(sid)
+        self.entity_updates.forget(sid)
+        # Remove them from the room they were in (if any)
+        game_rooms = self.game_rooms
+        left = game_rooms.remove_player(sid)
+        if left is None:
+            return out
+        code, room, _ = left
+        # If the game is actively playing, players are just redirecting to the battle page
+        # — keep the room alive so they can rejoin_game with the same code.
+        # Only delete the room (and notify) if we're still in the lobby (waiting state).
+        if room['state'] == 'waiting':
+            out.emit('player_left', {'message': 'Other player disconnected'}, to=code)
+            with game_rooms.room_lock(code):
+                empty = len(room['players']) == 0
+                if empty:
+                    game_rooms.delete_room(code)
+            if empty:
+                self.drop_room(code)
+                print(f"Room {code} deleted (empty)")
+        else:
+            print(f"Player left room {code} during game (state={room['state']}) — keeping room alive for rejoin")
+        return out
+
+    def create_room(self, sid):
+        """Player wants to create a new game room"""
+        out = Outbox(sid)
+        game_rooms = self.game_rooms
+        code = generate_room_code(game_rooms, self.backend.owns)
+        room = create_new_room(code)
+        while not game_rooms.add_room(code, room):
+            code = generate_room_code(game_rooms, self.backend.owns)
+            room = create_new_room(code)
+
+        # Add the player to the room
+        game_rooms.add_player(code, sid, create_new_player(1, room.rng.loot))
+        out.join(code)
+        self.match_recorder.open_room(code, room.seed)
+
+        # The seed is enough to play this room's random rolls again (room_rng.py)
+        print(f"Room {code} created by {sid} (seed {room.seed})")
+        out.reply('room_created', {
+            'code': code,
+            'player_number': 1,
+            'worker': self.backend.worker_id,
+            'message': f'Room created! Share code: {code}'
+        })
+        return out
+
+    def join_room(self, sid, data):
+        """Player wants to join an existing room with a CODE"""
+        out = Outbox(sid)
+        code = data.get('code', '').upper()
+        if self.send_to_owner(out, code):
+            return out
+
+        game_rooms = self.game_rooms
+        with game_rooms.room_lock(code):
+            room = game_rooms.get(code)
+            if room is None:
+                out.reply('join_error', {'message': 'Room not found! Check the code.'})
+                return out
+
+            # Check if room is full
+            if len(room['players']) >= 2:
+                out.reply('join_error', {'message': 'Room is full!'})
+                return out
+
+            # Add the player
+            game_rooms.add_player(code, sid, create_new_player(2, room.rng.loot))
+        out.join(code)
+
+        print(f"Player {sid} joined room {code}")
+
+        # Tell the new player they joined
+        out.reply('room_joined', {
+            'code': code,
+            'player_number': 2,
+            'worker': self.backend.worker_id,
+            'message': 'Joined the game!'
+        })
+
+        # Tell everyone the room is ready
+        out.emit('room_ready', {
+            'message': 'Both players connected! Ready to battle!'
+        }, to=code)
+        return out
+
+    def player_ready(self, sid, data):
+        """Player is ready to start the battle"""
+        out = Outbox(sid)
+        code = data.get('code')
+        game_rooms = self.game_rooms
+        room = game_rooms.get(code)
+        if room is None:
+            return out
+
+        with game_rooms.room_lock(code):
+            player = game_rooms.player_in_room(code, sid)
+            if player is None:
+                return out
+            player['ready'] = True
+
+            # Check if both players are ready
+            all_ready = all(p['ready'] for p in room['players'].values())
+            starting = all_ready and len(room['players']) == 2
+            if starting:
+                # Pick a random map and start! (from the room's own streams)
+                room['current_map'] = get_random_map(room.rng.map)
+                hazard_seed = room['hazard_seed'] = room.rng.hazard_seed()
+                room['state'] = 'playing'
+                self.battles.discard(code)
+
+        if starting:
+            self.match_recorder.record_game_start(code, room, hazard_seed)
+            self.hit_validator.new_battle(code)
+            self.input_acks.drop_room(code)
+            out.emit('game_start', {
+                'map': room['current_map'],
+                'message': 'FIGHT!'
+            }, to=code)
+        return out
+
+    def rejoin_game(self, sid, data):
+        """Player reconnects to game after page redirect"""
+        out = Outbox(sid)
+        code = data.get('code')
+        player_num = data.get('player')
+        if self.send_to_owner(out, code):
+            return out
+
+        game_rooms = self.game_rooms
+        if code not in game_rooms:
+            # Room may have been lost (e.g. server restart) — create a fresh one
+            # so the relay still works even if state is lost
+            print(f"Room {code} not found for rejoin — creating placeholder")
+            placeholder = create_new_room(code)
+            placeholder['state'] = 'playing'
+            if game_rooms.add_room(code, placeholder):
+                self.match_recorder.open_room(code, placeholder.seed, placeholder=True)
+
+        room = game_rooms[code]
+
+        # Add the player to the room and join the socket room
+        with game_rooms.room_lock(code):
+            player = create_new_player(player_num, room.rng.loot)
+            player['rejoined'] = True
+            game_rooms.add_player(code, sid, player)
+            rejoined_count = sum(1 for p in room['players'].values() if p.get('rejoined'))
+            starting = rejoined_count >= 2 and code not in self.battles
+            if starting:
+                self.battles.add(code)
+        # A new page numbers its inputs from 0 again
+        self.input_acks.reset(code, player['number'])
+        out.join(code)
+
+        print(f"Player {player_num} rejoined room {code}")
+
+        if starting:
+            # The battle begins. A page reloaded after this rejoins the
+            # battle as it is, so none of this happens again until the next one.
+            if room['hazard_seed'] is None:
+                room['hazard_seed'] = room.rng.hazard_seed()   # A placeholder room
+            if SERVER_AUTHORITATIVE:
+                self.start_room_simulation(out, code)
+            elif self.hazard_engine.start(code, room['current_map'], room['hazard_seed'],
+                                          self.server_clock.tick()):
+                out.start(LOOP_ENTITIES)
+            self.entity_updates.new_battle(code, room['current_map'])
+
+        # Tell both clients it's safe to start syncing
+        if rejoined_count >= 2:
+            print(f"Both players in room {code} — emitting both_ready")
+            out.emit('both_ready', {'authoritative': SERVER_AUTHORITATIVE}, to=code)
+        return out
+
+    def player_action(self, sid, data):
+        """Player did something (moved, attacked, etc.)"""
+        out = Outbox(sid)
+        code = data.get('code')
+        action = data.get('action')  # 'move', 'attack', 'ability', etc.
+
+        room = self.game_rooms.get(code)
+        if room is None:
+            return out
+        send_rates = self.send_rates
+        if not send_rates.allow_action(room['state']):
+            return out   # The battle is over
+
+        room_sim = self.simulation.get_room(code)
+        player = self.game_rooms.player_in_room(code, sid)
+        action_data = data.get('action_data', {})
+        seq = read_seq(data)
+        hit_validator = self.hit_validator
+        entity_updates = self.entity_updates
+        if seq is not None and player is not None:
+            if (not self.input_acks.receive(code, player['number'], seq, self.server_clock.tick()) and
+                    action in LATEST_ONLY_ACTIONS):
+                return out   # Older than one we already passed on
+        if action == 'move' and player is not None:
+            # Measure this connection's lag every few seconds
+            rtt_tracker = self.rtt_tracker
+            ping = rtt_tracker.ping_due(sid)
+            if ping is not None:
+                out.reply('rtt_ping', {'id': ping})
+            # ... and every half second, how often it should be sending
+            if send_rates.due(sid):
+                message = send_rates.update(sid, rtt_tracker.rtt(sid), rtt_tracker.jitter(sid),
+                                            self.outbound_backlog(sid),
+                                            self.relay_batcher.depth(code, sid))
+                if message is not None:
+                    out.reply('send_rate', message)
+            if isinstance(action_data, dict):
+                hit_validator.record_move(code, player['number'], action_data)
+                if entity_updates.enabled:
+                    entity_updates.track_player(code, sid, player['number'],
+                                                action_data.get('x'), action_data.get('y'))
+        elif (action == 'damage' and room_sim is None and player is not None and
+              isinstance(action_data, dict) and
+              not hit_validator.check_damage(code, player['number'], sid, action_data)):
+            # The target wasn't in reach even on the attacker's own screen.
+            # It goes in the match log as a rejected hit, and nowhere else.
+            action = 'hit_rejected'
+        # Only queued here - the recorder's thread does the writing
+        self.match_recorder.record(code, action, player['number'] if player else None, action_data,
+                                   None if room_sim is None else room_sim.tick)
+        if action == 'hit_rejected':
+            return out
+        if (action == 'move' and isinstance(action_data, dict) and
+                not send_rates.relay_move(sid, action_data)):
+            return out   # Standing still - the other player already has this one
+        if action in ENTITY_ACTIONS and entity_updates.enabled:
+            # Not passed on - the entity loop sends each player what they need
+            if player is not None:
+                entity_updates.receive(code, sid, player['number'], action, action_data,
+                                       self.server_clock.tick())
+                out.start(LOOP_ENTITIES)
+            return out
+
+        if room_sim is not None:
+            if action == 'input':
+                # The server is running this fight - just remember the buttons
+                if player:
+                    room_sim.set_input(player['number'], action_data, seq)
+                return out
+            if action == 'damage':
+                # The server decides who got hit, so ignore what the browser says
+                return out
+
+        # Make sure this socket is in the room (handles reconnect edge cases).
+        # Players in the room already joined it in create/join/rejoin.
+        if player is None:
+            out.join(code)
+
+        if action == 'move' and (isinstance(action_data, (bytes, bytearray)) or
+                                 self.has_binary_peer(code, sid)):
+            if not isinstance(action_data, (bytes, bytearray, dict)):
+                return out   # Not a player state, so it can't be turned into numbers
+            values = self.relay_move(out, code, action_data)
+            if values is not None and player is not None and isinstance(action_data, (bytes, bytearray)):
+                hit_validator.record_move(code, player['number'], values)
+                if entity_updates.enabled:
+                    state = dequantize_state(values)
+                    entity_updates.track_player(code, sid, player['number'], state['x'], state['y'])
+            return out
+
+        if self.relay_batcher.enabled:
+            # Sent to the other player on the next network tick
+            self.relay_batcher.queue(code, sid, action, action_data, seq)
+            out.start(LOOP_RELAY)
+            return out
+
+        # Send the action to the other player
+        out.emit('opponent_action', stamp({
+            'action': action,
+            'data': action_data,
+            'seq': seq,
+        }, self.server_clock.tick(), self.input_acks.acks(code)), 'relay_fanout', to=code, skip_sid=sid)
+        return out
+
+    def state_hash(self, sid, data):
+        """Browser's hash of what both screens should agree on (see desync.py)"""
+        out = Outbox(sid)
+        code = data.get('code')
+        player = self.game_rooms.player_in_room(code, sid)
+        tick = data.get('tick')
+        # Ticks are sorted and printed, so anything but a whole number is ignored
+        if player is not None and isinstance(tick, int) and not isinstance(tick, bool):
+            self.desync_detector.report(code, player['number'], tick, data.get('hash'),
+                                        data.get('state'))
+        return out
+
+    def rtt_pong(self, sid, data):
+        """Browser answered our 'rtt_ping' - now we know its round trip time"""
+        out = Outbox(sid)
+        rtt = self.rtt_tracker.pong(sid, data.get('id'))
+        if rtt is not None:
+            # Goes in the match log, so send_rate.py can replay the send rates
+            found = self.game_rooms.find_sid(sid)
+            if found is not None:
+                self.match_recorder.record(found[0], 'rtt', found[1], {
+                    'rtt': round(rtt * 1000, 1),
+                    'jitter': round(self.rtt_tracker.jitter(sid) * 1000, 1),
+                })
+        return out
+
+    def set_protocol(self, sid, data):
+        """Browser picks 'json' (the default) or 'binary' for move updates"""
+        out = Outbox(sid)
+        protocol = data.get('protocol', PROTOCOL_JSON)
+        if protocol not in PROTOCOLS:
+            protocol = PROTOCOL_JSON
+        self.connection_codecs[sid] = ConnectionCodec(protocol)
+        out.reply('protocol_set', {'protocol': protocol})
+        return out
+
+    def snapshot_ack(self, sid, data):
+        """Browser got a binary 'opponent_state' - later ones can be deltas"""
+        codec = self.connection_codecs.get(sid)
+        if codec is not None:
+            codec.encoder.ack(data.get('seq'))
+        return Outbox(sid)
+
+    def buy_item(self, sid, data):
+        """Player wants to buy something from the store"""
+        out = Outbox(sid)
+        code = data.get('code')
+        item_type = data.get('item_type')  # 'mystery_box', 'ability', 'skin'
+
+        game_rooms = self.game_rooms
+        if code not in game_rooms:
+            return out
+
+        # Paying, rolling and handing over the item all happen under the
+        # room lock, so the room's loot stream is only ever moved by one
+        # handler at a time and nobody sees the coins gone but no item
+        with game_rooms.room_lock(code):
+            player = game_rooms.player_in_room(code, sid)
+            if not player:
+                return out
+
+            price = STORE_PRICES.get(item_type, 0)
+
+            # Check if they can afford it
+            if player['coins'] < price:
+                out.reply('buy_error', {'message': 'Not enough coins!'})
+                return out
+
+            # Process the purchase
+            player['coins'] -= price
+            coins_left = player['coins']
+            loot = game_rooms[code].rng.loot
+
+            if item_type == 'mystery_box':
+                item = get_random_weapon_for_mystery_box(loot)
+                player.add_weapon(item)
+                bought = {'item_type': 'weapon', 'item': item, 'coins_left': coins_left}
+                recorded = item['id']
+            elif item_type == 'ability':
+                item = player['ability'] = get_random_ability(loot)  # Replaces old ability
+                bought = {'item_type': 'ability', 'item': item, 'coins_left': coins_left}
+                recorded = item['name']
+            else:
+                return out
+
+        self.match_recorder.record(code, 'buy_item', player['number'],
+                                   {'item_type': item_type, 'item': recorded})
+        out.reply('item_purchased', bought)
+        return out
+
+    def game_over(self, sid, data):
+        """Battle ended - someone won!"""
+        out = Outbox(sid)
+        code = data.get('code')
+        winner = data.get('winner')  # 1 or 2
+
+        game_rooms = self.game_rooms
+        room = game_rooms.get(code)
+        if room is None:
+            return out
+
+        # If the server ran this fight, it already knows who won
+        room_sim = self.simulation.get_room(code)
+        if room_sim is not None and room_sim.winner is not None:
+            winner = room_sim.winner
+        self.match_recorder.record(code, 'game_over', SERVER,
+                                   {'winner': winner, 'claimed': data.get('winner')},
+                                   None if room_sim is None else room_sim.tick)
+
+        self.simulation.remove_room(code)
+        self.hazard_engine.stop(code)
+        self.desync_detector.end_match(code)
+
+        with game_rooms.room_lock(code):
+            room['state'] = 'finished'
+            self.battles.discard(code)
+
+            # Give the winner their reward
+            for player in room['players'].values():
+                if player['number'] == winner:
+                    player['coins'] += WIN_REWARD
+
+            # Reset ready status and rejoin flags for next round
+            for player in room['players'].values():
+                player['ready'] = False
+                player['rejoined'] = False
+
+        out.emit('battle_result', {
+            'winner': winner,
+            'reward': WIN_REWARD
+        }, to=code)
+        # Nothing to send until the next battle
+        out.emit('send_rate', self.send_rates.stopped(), to=code)
+        return out
+
+    # -------------------------------------------------------------------------
+    # /stats and /metrics
+    # -------------------------------------------------------------------------
+
+    def stats(self):
+        """How the server is doing: simulation timing, relay batching and the rest"""
+        return {
+            "rooms": len(self.game_rooms),
+            "backend": self.backend.stats(),
+            "simulation": self.simulation.stats(),
+            "relay": self.relay_batcher.stats(),
+            "recorder": self.match_recorder.stats(),
+            "desync": self.desync_detector.stats(),
+            "hits": self.hit_validator.stats(),
+            "inputs": self.input_acks.stats(),
+            "send_rate": self.send_rates.stats(),
+            "entities": self.entity_updates.stats(),
+            "hazards": self.hazard_engine.stats(),
+        }
+
+    def _add_gauges(self):
+        game_rooms = self.game_rooms
+        simulation = self.simulation
+        desync_detector = self.desync_detector
+        hit_validator = self.hit_validator
+        rtt_tracker = self.rtt_tracker
+        send_rates = self.send_rates
+        match_recorder = self.match_recorder
+        metrics.gauge('rooms', "Game rooms by state", lambda: count_rooms_by_state(game_rooms))
+        metrics.gauge('simulated_rooms', "Rooms the server is simulating",
+                      lambda: {"": len(simulation.rooms)})
+        metrics.gauge('desync_rooms', "Matches checked for desyncs, and how many were flagged",
+                      lambda: {f'status="{key[6:]}"': value
+                               for key, value in desync_detector.stats().items()
+                               if key.startswith('rooms_')})
+        metrics.gauge('desync_rate', "Share of checked matches that desynced",
+                      lambda: {"": desync_detector.stats()['desync_rate']})
+        metrics.gauge('desync_checks', "Pairs of state hashes compared", lambda: {
+            'result="same"': desync_detector.matches,
+            'result="different"': desync_detector.mismatches,
+        })
+        metrics.gauge('hit_checks', "Browser 'damage' claims checked against the position history",
+                      lambda: {
+                          'result="allowed"': hit_validator.checked - hit_validator.rejected,
+                          'result="rejected"': hit_validator.rejected,
+                          'result="unchecked"': hit_validator.unchecked,
+                      })
+        metrics.gauge('rtt_seconds', "Smoothed round trip time, averaged over connections",
+                      lambda: {"": rtt_tracker.stats()['mean_rtt_ms'] / 1000})
+        metrics.gauge('move_relay', "JSON 'move's passed on, and ones dropped by the send rate rules",
+                      lambda: {
+                          'result="relayed"': send_rates.moves_relayed,
+                          'result="suppressed"': send_rates.moves_suppressed,
+                          'result="finished"': send_rates.finished_dropped,
+                      })
+        metrics.gauge('recorder_events', "Match log events (recorded, waiting to be written, dropped)",
+                      lambda: {f'status="{key}"': value for key, value in match_recorder.stats().items()
+                               if key in ('events', 'pending', 'dropped')})
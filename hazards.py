@@ -0,0 +1,520 @@
+# Hazards for Mina's PVP Fighting Game
+#
+# Comets, lava, icicles and spaceships used to live only in the browser:
+# player 1's screen rolled when the next comet fell and told player 2
+# about every one. Now the server runs them, from the numbers in each
+# map's "hazards" list in game_data.MAPS:
+#
+#   {"type": "comet", "damage": 30, "spawn_every": [60, 180], "speed": [5, 8], "radius": 15}
+#
+# 1. SPECS: hazard_specs(map) turns those dicts into typed specs
+#    (CometSpec, LavaSpec, IcicleSpec, SpaceshipSpec), checked once.
+#    Crater, acid and slippery floors never change during a battle, so
+#    each browser still handles those itself.
+#
+# 2. SCHEDULE: when every comet and icicle falls is worked out ahead of
+#    time from the battle's hazard seed (room.rng.hazard_seed()), a
+#    minute of battle at a time. Each kind of hazard has its own random
+#    stream, so the same seed always gives the same battle.
+#
+# 3. STATE: RoomHazards steps one room's hazards by one tick - spawns
+#    what's due, moves everything, and hurts (or beams up) players. When
+#    the server runs the fight (simulation.py) this happens every tick,
+#    and snapshots carry the hazards:
+#
+#      "hazards": {"comets": [[id, x, y, speed], ...], "icicles": [[id, x, y], ...],
+#                  "lava": 130, "ships": [[300, 64.2], [900, 81.5]]}
+#
+#    When browsers run the fight, HazardEngine just hands out each spawn
+#    when it's due, and entity_updates.py sends it to both players.
+#
+# Run this file to time the schedules and the stepping, and to check
+# the same seed gives the same hazards.
+
+import math
+import threading
+
+from game_data import MAPS, SCREEN_HEIGHT, SCREEN_WIDTH
+from room_rng import named_random
+
+
+SCHEDULE_CHUNK = 10 * 60   # Spawns are worked out 10 seconds (of ticks) at a time
+
+# From game_engine.js (how each hazard looks and touches players)
+COMET_START_Y = -50
+COMET_REACH = 20           # A comet hits if it's within radius + this of a player's middle
+SHIP_HEIGHT = 30
+SHIP_WOBBLE_SPEED = 0.03   # Radians per frame
+BEAM_TOP = 50              # The beam can't lift anyone above this
+
+
+# =============================================================================
+# SPECS - a map's hazard dicts, checked and typed
+# =============================================================================
+
+def _range(data, key):
+    """[low, high] from a spec, as a tuple with low <= high"""
+    low, high = data[key]
+    if low > high:
+        raise ValueError(f"{key}: {low} is more than {high}")
+    return low, high
+
+
+def _roll(rng, low, high):
+    """A number from low up to (not including) high, like the browsers' rolls"""
+    return low + rng.random() * (high - low)
+
+
+class CometSpec:
+    """Comets fall from a random spot at the top every so often"""
+
+    __slots__ = ("damage", "spawn_every", "speed", "radius")
+    kind = "comet"
+
+    def __init__(self, damage, spawn_every, speed, radius):
+        self.damage = damage
+        self.spawn_every = spawn_every
+        self.speed = speed
+        self.radius = radius
+
+    @classmethod
+    def from_dict(cls, data, map_data):
+        return cls(int(data["damage"]), _range(data, "spawn_every"), _range(data, "speed"),
+                   float(data["radius"]))
+
+    def gap(self, rng):
+        """Ticks until the next one"""
+        return int(_roll(rng, *self.spawn_every))
+
+    def spawn(self, rng):
+        """[x, speed] for one comet"""
+        return [[_roll(rng, 0, SCREEN_WIDTH), _roll(rng, *self.speed)]]
+
+
+class IcicleSpec:
+    """A few icicles drop from under a high platform every so often"""
+
+    __slots__ = ("damage_min", "damage_max", "count_min", "count_max", "spawn_every",
+                 "speed", "platform")
+    kind = "icicle"
+
+    def __init__(self, damage_min, damage_max, count_min, count_max, spawn_every, speed, platform):
+        self.damage_min = damage_min
+        self.damage_max = damage_max
+        self.count_min = count_min
+        self.count_max = count_max
+        self.spawn_every = spawn_every
+        self.speed = speed
+        self.platform = platform   # The platform dict they fall from
+
+    @classmethod
+    def from_dict(cls, data, map_data):
+        if data["damage_min"] > data["damage_max"] or data["count_min"] > data["count_max"]:
+            raise ValueError("icicle minimum is more than its maximum")
+        return cls(int(data["damage_min"]), int(data["damage_max"]), int(data["count_min"]),
+                   int(data["count_max"]), _range(data, "spawn_every"), float(data["speed"]),
+                   map_data["platforms"][data["platform"]])
+
+    def gap(self, rng):
+        return int(_roll(rng, *self.spawn_every))
+
+    def spawn(self, rng):
+        """[x, y, damage] for each icicle in one drop"""
+        platform = self.platform
+        count = self.count_min + int(rng.random() * (self.count_max - self.count_min + 1))
+        icicles = []
+        for _ in range(count):
+            x = platform["x"] + rng.random() * platform["width"]
+            damage = self.damage_min + int(rng.random() * (self.damage_max - self.damage_min + 1))
+            icicles.append([x, platform["y"], damage])
+        return icicles
+
+
+class LavaSpec:
+    """Lava that creeps up from the bottom"""
+
+    __slots__ = ("damage", "start_height", "rise_rate", "rise_every", "max_height")
+    kind = "lava"
+
+    def __init__(self, damage, start_height, rise_rate, rise_every, max_height):
+        self.damage = damage
+        self.start_height = start_height
+        self.rise_rate = rise_rate
+        self.rise_every = rise_every
+        self.max_height = max_height
+
+    @classmethod
+    def from_dict(cls, data, map_data):
+        if data["rise_every"] <= 0:
+            raise ValueError("lava rise_every has to be more than 0")
+        return cls(int(data["damage"]), int(data["start_height"]), int(data["rise_rate"]),
+                   int(data["rise_every"]), int(data["max_height"]))
+
+    def height(self, tick):
+        """How high the lava is on this tick"""
+        return min(self.max_height, self.start_height + (tick // self.rise_every) * self.rise_rate)
+
+
+class SpaceshipSpec:
+    """Spaceships that bob in place and beam up anyone under them"""
+
+    __slots__ = ("positions", "beam_width", "lift", "wobble")
+    kind = "spaceship"
+
+    def __init__(self, positions, beam_width, lift, wobble):
+        self.positions = positions
+        self.beam_width = beam_width
+        self.lift = lift
+        self.wobble = wobble
+
+    @classmethod
+    def from_dict(cls, data, map_data):
+        count = int(data["count"])
+        positions = [(float(x), float(y)) for x, y in data.get("positions", ())][:count]
+        # More ships than positions: spread the rest out along the top
+        for i in range(len(positions), count):
+            positions.append((SCREEN_WIDTH * (i + 1) / (count + 1), 70.0))
+        return cls(positions, float(data["beam_width"]), float(data["lift"]), float(data["wobble"]))
+
+    def ship_y(self, base_y, tick):
+        return base_y + math.sin(tick * SHIP_WOBBLE_SPEED) * self.wobble
+
+
+SPEC_TYPES = {spec.kind: spec for spec in (CometSpec, IcicleSpec, LavaSpec, SpaceshipSpec)}
+
+_SPECS = {}   # map name -> {kind: spec}
+
+
+def hazard_specs(map_data):
+    """The typed specs for a map's server-run hazards (worked out once per map)"""
+    name = map_data["name"]
+    specs = _SPECS.get(name)
+    if specs is None:
+        specs = {}
+        for data in map_data.get("hazards", ()):
+            spec_type = SPEC_TYPES.get(data["type"])
+            if spec_type is not None:
+                try:
+                    specs[spec_type.kind] = spec_type.from_dict(data, map_data)
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    raise ValueError(f"{name}: bad {data['type']} hazard ({e!r})") from None
+        _SPECS[name] = specs
+    return specs
+
+
+# =============================================================================
+# SCHEDULE - when everything falls, worked out ahead of time
+# =============================================================================
+
+class HazardSchedule:
+    """Every comet and icicle of one battle, from its hazard seed.
+
+    Spawns are (tick, kind, id, values) in tick order, where values is
+    [x, speed] for a comet and [x, y, damage] for an icicle.
+    """
+
+    def __init__(self, specs, seed):
+        self.spawners = []   # [spec, its random stream, tick of its next spawn]
+        for kind in ("comet", "icicle"):
+            spec = specs.get(kind)
+            if spec is not None:
+                rng = named_random(seed, kind)
+                self.spawners.append([spec, rng, spec.gap(rng)])
+        self.spawns = []
+        self.planned_until = 0
+        self.next = 0        # Index of the first spawn not handed out yet
+        self.next_id = 0
+
+    def plan(self, until):
+        """Work out every spawn up to and including tick `until`"""
+        chunk = []
+        for spawner in self.spawners:
+            spec, rng, tick = spawner
+            while tick <= until:
+                for values in spec.spawn(rng):
+                    chunk.append((tick, spec.kind, values))
+                tick += max(1, spec.gap(rng))
+            spawner[2] = tick
+        chunk.sort(key=lambda spawn: (spawn[0], spawn[1]))
+        # Spawns already handed out aren't needed again
+        del self.spawns[:self.next]
+        self.next = 0
+        for tick, kind, values in chunk:
+            self.next_id += 1
+            self.spawns.append((tick, kind, self.next_id, values))
+        self.planned_until = until
+
+    def due(self, tick):
+        """Spawns on or before `tick` that haven't been handed out yet"""
+        if not self.spawners:
+            return ()
+        if tick > self.planned_until:
+            self.plan(max(tick, self.planned_until + SCHEDULE_CHUNK))
+        start = self.next
+        end = start
+        spawns = self.spawns
+        while end < len(spawns) and spawns[end][0] <= tick:
+            end += 1
+        self.next = end
+        return spawns[start:end]
+
+
+def spawn_message(kind, hazard_id, values, specs):
+    """A spawn the way browsers get it (the same shape their old 'hazard' messages had)"""
+    if kind == "comet":
+        x, speed = values
+        return {"type": "comet", "id": hazard_id, "x": round(x, 1), "speed": round(speed, 3),
+                "damage": specs["comet"].damage}
+    x, y, damage = values
+    return {"type": "icicle", "id": hazard_id, "x": round(x, 1), "y": y, "damage": damage}
+
+
+# =============================================================================
+# ONE ROOM'S HAZARDS
+# =============================================================================
+
+class RoomHazards:
+    """The hazards in one battle. step() moves them on one tick."""
+
+    __slots__ = ("specs", "schedule", "tick", "comets", "icicles", "lava", "ships", "hits")
+
+    def __init__(self, map_data, seed):
+        self.specs = hazard_specs(map_data)
+        self.schedule = HazardSchedule(self.specs, seed)
+        self.tick = 0
+        self.comets = []    # [id, x, y, speed]
+        self.icicles = []   # [id, x, y, damage]
+        lava = self.specs.get("lava")
+        self.lava = lava.start_height if lava is not None else None
+        ships = self.specs.get("spaceship")
+        self.ships = [[x, y] for x, y in ships.positions] if ships is not None else []
+        self.hits = 0       # Times a hazard hurt someone
+
+    @property
+    def active(self):
+        """Does this map have anything for the server to run?"""
+        return bool(self.specs)
+
+    def step(self, players):
+        """One tick (game_engine.js order: spawn, move, then touch players).
+        players: objects with x, y, width, height, vel_y and take_damage()."""
+        self.tick += 1
+        tick = self.tick
+        specs = self.specs
+        for _, kind, hazard_id, values in self.schedule.due(tick):
+            if kind == "comet":
+                self.comets.append([hazard_id, values[0], COMET_START_Y, values[1]])
+            else:
+                self.icicles.append([hazard_id, values[0], values[1], values[2]])
+
+        if self.comets:
+            self._step_comets(players, specs["comet"])
+        if self.icicles:
+            self._step_icicles(players, specs["icicle"])
+
+        lava = specs.get("lava")
+        if lava is not None:
+            self.lava = lava.height(tick)
+            surface = SCREEN_HEIGHT - self.lava
+            for player in players:
+                if player.y + player.height >= surface:
+                    player.take_damage(lava.damage)
+
+        ships = specs.get("spaceship")
+        if ships is not None:
+            half_beam = ships.beam_width / 2
+            for ship, (_, base_y) in zip(self.ships, ships.positions):
+                ship[1] = ship_y = ships.ship_y(base_y, tick)
+                for player in players:
+                    middle = player.x + player.width / 2
+                    if (ship[0] - half_beam < middle < ship[0] + half_beam and
+                            player.y + player.height >= ship_y + SHIP_HEIGHT / 2):
+                        player.y = max(player.y - ships.lift, BEAM_TOP)
+                        player.vel_y = 0
+
+    def _step_comets(self, players, spec):
+        reach = spec.radius + COMET_REACH
+        still_falling = []
+        for comet in self.comets:
+            comet[2] += comet[3]
+            if comet[2] > SCREEN_HEIGHT:
+                continue
+            for player in players:
+                dx = comet[1] - (player.x + player.width / 2)
+                dy = comet[2] - (player.y + player.height / 2)
+                if dx * dx + dy * dy < reach * reach:
+                    player.take_damage(spec.damage)
+                    self.hits += 1
+                    break
+            else:
+                still_falling.append(comet)
+        self.comets = still_falling
+
+    def _step_icicles(self, players, spec):
+        still_falling = []
+        for icicle in self.icicles:
+            icicle[2] += spec.speed
+            if icicle[2] > SCREEN_HEIGHT:
+                continue
+            x, y = icicle[1], icicle[2]
+            for player in players:
+                if player.x < x < player.x + player.width and player.y < y < player.y + player.height:
+                    player.take_damage(icicle[3])
+                    self.hits += 1
+                    break
+            else:
+                still_falling.append(icicle)
+        self.icicles = still_falling
+
+    def snapshot(self):
+        """What browsers need to draw the hazards (only the ones this map has)"""
+        specs = self.specs
+        snapshot = {}
+        if "comet" in specs:
+            snapshot["comets"] = [[c[0], round(c[1], 1), round(c[2], 1), round(c[3], 3)]
+                                  for c in self.comets]
+        if "icicle" in specs:
+            snapshot["icicles"] = [[i[0], round(i[1], 1), round(i[2], 1)] for i in self.icicles]
+        if self.lava is not None:
+            snapshot["lava"] = self.lava
+        if self.ships:
+            snapshot["ships"] = [[x, round(y, 1)] for x, y in self.ships]
+        return snapshot
+
+
+# =============================================================================
+# ROOMS THE SERVER DOESN'T SIMULATE
+# =============================================================================
+
+class HazardEngine:
+    """Hazard schedules for battles the browsers run themselves.
+
+    The browsers move the hazards and check their own players against
+    them, so all the server has to do is say when each one appears -
+    advance() hands out everything that's due, with the server tick it
+    was due on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}   # room code -> (HazardSchedule, specs, server tick the battle started)
+
+        # Metrics
+        self.spawned = 0
+
+    def start(self, code, map_data, seed, tick):
+        """A battle started on server tick `tick`. Returns False if the
+        map has nothing for the server to schedule."""
+        self.stop(code)
+        if map_data is None or seed is None:
+            return False
+        specs = hazard_specs(map_data)
+        schedule = HazardSchedule(specs, seed)
+        if not schedule.spawners:
+            return False
+        with self._lock:
+            self._rooms[code] = (schedule, specs, tick)
+        return True
+
+    def advance(self, tick):
+        """Everything due by server tick `tick`: a list of (room code,
+        spawn message, the server tick it spawned on).
+
+        Only the entity loop calls this, so the schedules are worked out
+        after letting go of the lock - a battle starting or ending never
+        waits for every other room's planning.
+        """
+        with self._lock:
+            rooms = list(self._rooms.items())
+        spawned = []
+        for code, (schedule, specs, start) in rooms:
+            for spawn_tick, kind, hazard_id, values in schedule.due(tick - start):
+                spawned.append((code, spawn_message(kind, hazard_id, values, specs),
+                                start + spawn_tick))
+        with self._lock:
+            self.spawned += len(spawned)
+        return spawned
+
+    def stop(self, code):
+        with self._lock:
+            self._rooms.pop(code, None)
+
+    def stats(self):
+        with self._lock:
+            return {"rooms": len(self._rooms), "spawned": self.spawned}
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+class _Dummy:
+    """A player standing still somewhere"""
+
+    __slots__ = ("x", "y", "width", "height", "vel_y", "health")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.width = 40
+        self.height = 60
+        self.vel_y = 0
+        self.health = 100
+
+    def take_damage(self, damage):
+        self.health = max(0, self.health - damage)
+
+
+def _run(map_data, seed, ticks):
+    hazards = RoomHazards(map_data, seed)
+    players = [_Dummy(300, 400), _Dummy(880, 590)]
+    snapshots = []
+    for tick in range(ticks):
+        for player in players:
+            player.health = 100   # Keep them alive for the whole run
+        hazards.step(players)
+        if tick % 3 == 0:
+            snapshots.append(hazards.snapshot())
+    return hazards, snapshots
+
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    from send_rate import packet_size
+
+    print("=" * 72)
+    print("  HAZARDS - run by the server from game_data.MAPS")
+    print("=" * 72)
+    minutes = 3
+    ticks = minutes * 60 * 60
+    for map_data in MAPS:
+        specs = hazard_specs(map_data)
+        if not specs:
+            continue
+        start = time.perf_counter()
+        hazards, snapshots = _run(map_data, 1234, ticks)
+        elapsed = time.perf_counter() - start
+        _, again = _run(map_data, 1234, ticks)
+        _, other = _run(map_data, 4321, ticks)
+        spawns = hazards.schedule.next_id
+        extra = sum(len(json.dumps(s, separators=(",", ":"))) + len(',"hazards":') for s in snapshots)
+        # Before: player 1's browser sent every spawn (a batch of icicles
+        # at a time) and each hit, and the server relayed them all
+        relayed = 0
+        for _, kind, hazard_id, values in HazardSchedule(specs, 1234).due(ticks):
+            relayed += packet_size("player_action", {"code": "ABC123", "action": "hazard",
+                                                     "action_data": spawn_message(kind, hazard_id, values, specs)})
+        print(f"  {map_data['name']:<15} {', '.join(specs)}")
+        print(f"    {elapsed / ticks * 1e6:6.1f} us per room per tick, {spawns} spawns and "
+              f"{hazards.hits} hits in {minutes} minutes")
+        print(f"    same seed, same hazards: {snapshots == again}   "
+              f"another seed, different: {snapshots != other}")
+        print(f"    snapshots grow {extra / (minutes * 60):.0f} B/s per player; "
+              f"hazard messages it replaces: {relayed * 2 / (minutes * 60):.0f} B/s (up and down)")
+
+    start = time.perf_counter()
+    schedule = HazardSchedule(hazard_specs(MAPS[3]), 99)
+    schedule.due(60 * 60 * 10)
+    print(f"  Working out 10 minutes of icicles: {(time.perf_counter() - start) * 1000:.2f} ms")
@@ -0,0 +1,119 @@
+# Input Sequence Numbers for Mina's PVP Fighting Game
+#
+# To feel quick, a browser moves its own player the moment a key is
+# pressed ("prediction") instead of waiting for the server. But then it
+# needs to know which of its inputs the server has already used, so it
+# can line its guess up with what the server says ("reconciliation").
+#
+# So every 'move' and 'input' a browser sends has a sequence number:
+#
+#   {"code": "ABC123", "action": "input", "action_data": {...}, "seq": 812}
+#
+# and everything the server sends back says which tick it is and the
+# last input it has from each player:
+#
+#   {"action": "batch", "data": [...], "tick": 5040, "acks": {"1": [812, 5038], "2": [77, 5031]}}
+#
+#   acks = {player number: [last seq, tick it was used on]}
+#
+# When the server runs the fight (SERVER_AUTHORITATIVE), snapshots carry
+# the same "acks", meaning "the inputs the simulation has applied by
+# this snapshot's tick" (see RoomSimulation.set_input). Otherwise the
+# server only passes actions on, so an ack means "got it and sent it on"
+# and the tick comes from the ServerClock below.
+#
+# Sequence numbers go up to 65535 and then start again at 0.
+# reference_client.py is a Python client that uses all of this, and
+# measures what it does for lag.
+
+import time
+
+from simulation import TICK_RATE
+
+
+SEQ_MODULO = 1 << 16
+
+# Actions that are "everything I'm doing now" - an old one that turns up
+# after a newer one is out of date, so it's dropped
+LATEST_ONLY_ACTIONS = ("move", "input")
+
+
+def read_seq(data):
+    """The message's sequence number, or None if it hasn't got a proper one"""
+    seq = data.get("seq")
+    if isinstance(seq, int) and not isinstance(seq, bool) and 0 <= seq < SEQ_MODULO:
+        return seq
+    return None
+
+
+def seq_newer(a, b):
+    """Is sequence number a after b? (Works across the wrap back to 0.)"""
+    return 0 < (a - b) % SEQ_MODULO < SEQ_MODULO // 2
+
+
+class ServerClock:
+    """Ticks since the server started, at the simulation's 60 a second"""
+
+    def __init__(self, tick_rate=TICK_RATE):
+        self.tick_rate = tick_rate
+        self.start = time.perf_counter()
+
+    def tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        return int((now - self.start) * self.tick_rate)
+
+
+class InputAcks:
+    """The last sequence number each player in each room sent"""
+
+    def __init__(self):
+        self._rooms = {}   # room code -> {player number: [seq, tick]}
+
+        # Metrics
+        self.received = 0
+        self.stale = 0     # Arrived after a newer one
+
+    def receive(self, code, number, seq, tick):
+        """A player's input `seq` (from read_seq) arrived on `tick`.
+        Returns False if it's older than one we already have."""
+        room = self._rooms.get(code)
+        if room is None:
+            room = self._rooms[code] = {}
+        last = room.get(number)
+        self.received += 1
+        if last is None:
+            room[number] = [seq, tick]
+            return True
+        if not seq_newer(seq, last[0]):
+            self.stale += 1
+            return False
+        last[0] = seq
+        last[1] = tick
+        return True
+
+    def acks(self, code):
+        """{player number: [seq, tick]} for a room (None if nobody sent one)"""
+        room = self._rooms.get(code)
+        if not room:
+            return None
+        return {number: list(last) for number, last in room.items()}
+
+    def reset(self, code, number):
+        """Forget a player's last number - a reloaded page starts again from 0"""
+        room = self._rooms.get(code)
+        if room is not None:
+            room.pop(number, None)
+
+    def drop_room(self, code):
+        self._rooms.pop(code, None)
+
+    def stats(self):
+        return {"rooms": len(self._rooms), "received": self.received, "stale": self.stale}
+
+
+def stamp(payload, tick, acks):
+    """Add the server tick and acks to an outgoing 'opponent_action'"""
+    payload["tick"] = tick
+    if acks:
+        payload["acks"] = acks
+    return payload
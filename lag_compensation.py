@@ -0,0 +1,488 @@
+# Lag Compensation for Mina's PVP Fighting Game
+#
+# When the server isn't running the fight, each browser decides for
+# itself whether its sword or arrow hit (checkMeleeHit / MPProjectile in
+# the browser) and just tells the server "I hit player 2 for 10". A
+# cheater could send that from across the map.
+#
+# The server can't simply check against where player 2 is NOW, though:
+# the attacker's screen is always a little behind. Player 2's position
+# took time to reach the server, then more time to reach the attacker,
+# and the attacker's 'damage' took time to come back. With 150 ms of
+# lag the attacker honestly hit someone who has since walked away.
+#
+# So the server remembers where each player was for the last second or
+# so (a HISTORY of every 'move' it got, stamped with when it arrived)
+# and, for each 'damage', goes back in time to what the attacker was
+# looking at:
+#
+#   what the attacker saw = now - attacker's round trip time - VIEW_SECONDS
+#
+# The round trip time (RTT) is measured by the server itself: every
+# couple of seconds it sends the browser an 'rtt_ping' and times how
+# long the 'rtt_pong' takes to come back (a browser can't pretend to be
+# laggier than it is to get a bigger rewind, and rewinds stop at
+# MAX_REWIND anyway).
+#
+# If player 2 was within reach (plus TOLERANCE pixels for rounding and
+# smoothing) at any moment the attacker could have been seeing, the hit
+# counts. Otherwise it's dropped.
+#
+# Every 'damage' is checked, so this must be quick: each player's history
+# is a fixed ring of HISTORY_SIZE slots made when the room is, a 'move'
+# just overwrites the oldest slot, and finding a moment in it is a binary
+# search - a few microseconds per hit.
+
+import bisect
+import os
+import time
+from array import array
+
+from net_protocol import FIELDS
+
+
+HISTORY_SIZE = 32          # Positions kept per player (1.6 s of 20-a-second 'move's)
+MAX_REWIND = 0.4           # Never go back further than this (seconds)
+VIEW_SECONDS = 0.15        # Smoothing + network tick: how stale the opponent on screen can be
+TOLERANCE = 24             # Extra pixels allowed, for rounding and smoothing
+
+PING_SECONDS = 2.0         # How often each connection's RTT is measured
+DEFAULT_RTT = 0.1          # RTT to assume before the first pong
+
+# Sizes and reach (the same numbers as game_engine.js and MPProjectile)
+PLAYER_WIDTH = 40
+PLAYER_HEIGHT = 60
+MELEE_REACH = 60           # checkMeleeHit: abs(x difference) <= 60
+MELEE_HEIGHT = 40          # ... and the middles less than 40 apart up and down
+PROJECTILE_WIDTH = 20
+PROJECTILE_HEIGHT = 8
+
+POSITION_SCALE = FIELDS[0][2]   # Binary 'move' x and y are in 1/8 pixels
+
+MODES = ("enforce", "log", "off")
+
+
+# =============================================================================
+# RTT - how long a message takes to get to a browser and back
+# =============================================================================
+
+class _Connection:
+    __slots__ = ("srtt", "rttvar", "min_rtt", "samples", "ping_id", "ping_sent", "next_ping")
+
+    def __init__(self):
+        self.srtt = None       # Smoothed RTT (like TCP's)
+        self.rttvar = 0.0      # How much it jumps around
+        self.min_rtt = None
+        self.samples = 0
+        self.ping_id = 0
+        self.ping_sent = None  # When the ping waiting for a pong was sent
+        self.next_ping = 0.0
+
+
+class RttTracker:
+    """Measures every connection's round trip time with 'rtt_ping'/'rtt_pong'"""
+
+    def __init__(self, interval=PING_SECONDS):
+        self.interval = interval
+        self._connections = {}   # sid -> _Connection
+
+        # Metrics
+        self.pings = 0
+        self.pongs = 0
+
+    def ping_due(self, sid, now=None):
+        """The id of a ping to send this connection now, or None if it
+        isn't time yet. Cheap enough to ask on every message."""
+        now = time.perf_counter() if now is None else now
+        conn = self._connections.get(sid)
+        if conn is None:
+            conn = self._connections[sid] = _Connection()
+        if now < conn.next_ping:
+            return None
+        # A pong that never came back is just replaced by the next ping
+        conn.ping_id = (conn.ping_id + 1) & 0xFFFF
+        conn.ping_sent = now
+        conn.next_ping = now + self.interval
+        self.pings += 1
+        return conn.ping_id
+
+    def pong(self, sid, ping_id, now=None):
+        """The browser answered. Returns the RTT it took (None for an old
+        or made-up ping id)."""
+        now = time.perf_counter() if now is None else now
+        conn = self._connections.get(sid)
+        if conn is None or conn.ping_sent is None or ping_id != conn.ping_id:
+            return None
+        rtt = now - conn.ping_sent
+        conn.ping_sent = None
+        if conn.srtt is None:
+            conn.srtt = rtt
+            conn.rttvar = rtt / 2
+        else:
+            # The same smoothing TCP uses (RFC 6298)
+            conn.rttvar += (abs(conn.srtt - rtt) - conn.rttvar) / 4
+            conn.srtt += (rtt - conn.srtt) / 8
+        conn.min_rtt = rtt if conn.min_rtt is None else min(conn.min_rtt, rtt)
+        conn.samples += 1
+        self.pongs += 1
+        return rtt
+
+    def rtt(self, sid, default=DEFAULT_RTT):
+        """The connection's smoothed RTT in seconds"""
+        conn = self._connections.get(sid)
+        if conn is None or conn.srtt is None:
+            return default
+        return conn.srtt
+
+    def jitter(self, sid):
+        conn = self._connections.get(sid)
+        return conn.rttvar if conn is not None else 0.0
+
+    def forget(self, sid):
+        self._connections.pop(sid, None)
+
+    def stats(self):
+        measured = [conn.srtt for conn in self._connections.values() if conn.srtt is not None]
+        return {
+            "connections": len(self._connections),
+            "measured": len(measured),
+            "mean_rtt_ms": sum(measured) / len(measured) * 1000 if measured else 0.0,
+            "max_rtt_ms": max(measured) * 1000 if measured else 0.0,
+            "pings": self.pings,
+            "pongs": self.pongs,
+        }
+
+
+# =============================================================================
+# HISTORY - where one player was, for the last HISTORY_SIZE 'move's
+# =============================================================================
+
+class PositionHistory:
+    """A ring of (time, x, y). The arrays are made once; adding a position
+    overwrites the oldest slot, so nothing new is made per 'move'.
+
+    Slots [0, head) are the newest positions and [head, size) the older
+    ones, each part in time order - so a binary search finds any moment.
+    """
+
+    __slots__ = ("times", "xs", "ys", "head", "count")
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.times = array("d", bytes(8 * size))
+        self.xs = array("d", bytes(8 * size))
+        self.ys = array("d", bytes(8 * size))
+        self.head = 0    # Next slot to write
+        self.count = 0
+
+    def add(self, now, x, y):
+        head = self.head
+        self.times[head] = now
+        self.xs[head] = x
+        self.ys[head] = y
+        head += 1
+        self.head = 0 if head == len(self.times) else head
+        if self.count < len(self.times):
+            self.count += 1
+
+    def newest(self):
+        """Index of the newest position (None if there isn't one)"""
+        if not self.count:
+            return None
+        return (self.head or len(self.times)) - 1
+
+    def index_at(self, when):
+        """Index of the last position at or before `when` (None if every
+        position is newer)"""
+        times = self.times
+        head = self.head
+        if self.count < len(times):
+            i = bisect.bisect_right(times, when, 0, self.count) - 1
+            return i if i >= 0 else None
+        if head and times[0] <= when:
+            return bisect.bisect_right(times, when, 0, head) - 1
+        i = bisect.bisect_right(times, when, head, len(times)) - 1
+        return i if i >= head else None
+
+    def older_than(self, i):
+        """How many positions there are from index i back to the oldest"""
+        return self.count if self.count == len(self.times) else i + 1
+
+    def clear(self):
+        self.head = self.count = 0
+
+
+# =============================================================================
+# HIT VALIDATOR - was the target really in reach on the attacker's screen?
+# =============================================================================
+
+class HitValidator:
+    """Keeps every room's position history and checks 'damage' claims.
+
+    mode "enforce" drops hits that don't check out, "log" only counts
+    them, "off" doesn't look at all.
+    """
+
+    def __init__(self, rtt=None, mode="enforce", tolerance=TOLERANCE,
+                 max_rewind=MAX_REWIND, view_seconds=VIEW_SECONDS):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.rtt = rtt if rtt is not None else RttTracker()
+        self.mode = mode
+        self.tolerance = tolerance
+        self.max_rewind = max_rewind
+        self.view_seconds = view_seconds
+        self._rooms = {}   # room code -> {player number: PositionHistory}
+
+        # Metrics
+        self.checked = 0     # Hits compared with the history
+        self.rejected = 0    # ... that were out of reach
+        self.unchecked = 0   # Hits we couldn't judge (no positions yet, old browser)
+
+    def record_move(self, code, number, state, now=None):
+        """A player's 'move': a getState() dict, or the numbers from a
+        binary one (see net_protocol.py)"""
+        if self.mode == "off" or number is None:
+            return
+        if isinstance(state, dict):
+            x = state.get("x")
+            y = state.get("y")
+            if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+                return
+        else:
+            x = state[0] / POSITION_SCALE
+            y = state[1] / POSITION_SCALE
+        room = self._rooms.get(code)
+        if room is None:
+            room = self._rooms[code] = {}
+        history = room.get(number)
+        if history is None:
+            history = room[number] = PositionHistory()
+        history.add(time.perf_counter() if now is None else now, x, y)
+
+    def check_damage(self, code, number, sid, data, now=None):
+        """Should this 'damage' from player `number` count?"""
+        if self.mode == "off":
+            return True
+        room = self._rooms.get(code)
+        attacker = room.get(number) if room is not None else None
+        target = room.get(data.get("targetPlayer")) if room is not None else None
+        kind = data.get("kind")
+        if attacker is None or target is None or attacker is target or kind not in ("melee", "ranged"):
+            self.unchecked += 1
+            return True
+
+        now = time.perf_counter() if now is None else now
+        rewind = self.rtt.rtt(sid)
+        if rewind > self.max_rewind:
+            rewind = self.max_rewind
+        # Every moment the target on the attacker's screen could be from
+        newest_seen = now - rewind
+        oldest_seen = newest_seen - self.view_seconds
+        end = target.index_at(newest_seen)
+        if end is None:
+            self.unchecked += 1
+            return True
+
+        self.checked += 1
+        if kind == "melee":
+            mine = attacker.index_at(now)
+            if mine is None:
+                mine = attacker.newest()
+            hit = self._melee_in_reach(attacker.xs[mine], attacker.ys[mine], target, end, oldest_seen)
+        else:
+            x = data.get("x")
+            y = data.get("y")
+            if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+                hit = False
+            else:
+                hit = self._projectile_touching(x, y, target, end, oldest_seen)
+        if hit:
+            return True
+        self.rejected += 1
+        return self.mode != "enforce"
+
+    def _melee_in_reach(self, ax, ay, target, i, oldest_seen):
+        reach = MELEE_REACH + self.tolerance
+        height = MELEE_HEIGHT + self.tolerance
+        times, xs, ys = target.times, target.xs, target.ys
+        # Walk back from the newest moment the attacker could have seen.
+        # The one before the oldest counts too - the browser smooths
+        # from it to the next one.
+        for _ in range(target.older_than(i)):
+            if abs(ax - xs[i]) <= reach and abs(ay - ys[i]) < height:
+                return True
+            if times[i] < oldest_seen:
+                return False
+            i = (i or len(times)) - 1
+        return False
+
+    def _projectile_touching(self, px, py, target, i, oldest_seen):
+        slack = self.tolerance
+        times, xs, ys = target.times, target.xs, target.ys
+        for _ in range(target.older_than(i)):
+            tx = xs[i]
+            ty = ys[i]
+            if (px < tx + PLAYER_WIDTH + slack and px + PROJECTILE_WIDTH > tx - slack and
+                    py < ty + PLAYER_HEIGHT + slack and py + PROJECTILE_HEIGHT > ty - slack):
+                return True
+            if times[i] < oldest_seen:
+                return False
+            i = (i or len(times)) - 1
+        return False
+
+    def new_battle(self, code):
+        """Everyone respawns - old positions mean nothing now"""
+        room = self._rooms.get(code)
+        if room is not None:
+            for history in room.values():
+                history.clear()
+
+    def drop_room(self, code):
+        self._rooms.pop(code, None)
+
+    def stats(self):
+        judged = self.checked
+        return {
+            "mode": self.mode,
+            "rooms": len(self._rooms),
+            "checked": judged,
+            "rejected": self.rejected,
+            "unchecked": self.unchecked,
+            "reject_rate": self.rejected / judged if judged else 0.0,
+            "rtt": self.rtt.stats(),
+        }
+
+
+def validator_from_env():
+    """The server's validator: HIT_VALIDATION=enforce (the default), log or off"""
+    mode = os.environ.get("HIT_VALIDATION", "enforce")
+    return HitValidator(mode=mode if mode in MODES else "enforce")
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python lag_compensation.py) to play made-up
+# fights with real-looking lag: honest players only claim hits that
+# really happened on their (late) screen, cheaters claim hits from
+# anywhere. Shows how many of each get through with and without going
+# back in time, and what one check_damage() costs.
+
+def _fake_fight(rng, code, rtts, seconds=20, cheater=False):
+    """Everything the server gets in one fight, in the order it arrives:
+    ("move", number, x, y) and ("damage", data). Player 1 swings or
+    shoots whenever its (late) screen says it would hit - or, if it's a
+    cheater, when its screen shows player 2 more than twice its reach away."""
+    dt = 1 / 20
+    speed = rng.uniform(150, 300)     # Pixels per second
+
+    def position(number, t):
+        # Player 2 runs back and forth past player 1, who walks about slowly
+        if number == 1:
+            return 400 + 40 * ((t * 0.7) % 2 - 1), 400.0
+        phase = (t * speed / 300) % 2
+        return 100 + 600 * (phase if phase < 1 else 2 - phase), 400.0
+
+    events = []   # (arrival time, event)
+    for step in range(int(seconds / dt)):
+        t = step * dt
+        for number in (1, 2):
+            # A 'move' gets to the server half a round trip after it was sent
+            x, y = position(number, t)
+            events.append((t + rtts[number] / 2, ("move", number, x, y)))
+        # Player 1's screen shows player 2 as the server got it half
+        # player 1's round trip ago, and then smoothed a little more
+        seen = t - rtts[2] / 2 - rtts[1] / 2 - rng.uniform(0, VIEW_SECONDS * 0.8)
+        ax, ay = position(1, t)
+        tx, ty = position(2, seen)
+        arrives = t + rtts[1] / 2
+        in_reach = abs(ax - tx) <= MELEE_REACH and abs(ay - ty) < MELEE_HEIGHT
+        if cheater:
+            if abs(ax - tx) > 2 * MELEE_REACH and rng.random() < 0.1:
+                events.append((arrives, ("damage", {"targetPlayer": 2, "damage": 10, "kind": "melee"})))
+        elif in_reach and rng.random() < 0.3:
+            events.append((arrives, ("damage", {"targetPlayer": 2, "damage": 10, "kind": "melee"})))
+        elif rng.random() < 0.03:
+            events.append((arrives, ("damage", {"targetPlayer": 2, "damage": 20, "kind": "ranged",
+                                                "x": tx + 10, "y": ty + 30})))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def _play(validator, code, events):
+    """Feed a fight to the validator. Returns (hits claimed, hits allowed)."""
+    claimed = allowed = 0
+    for now, event in events:
+        if event[0] == "move":
+            validator.record_move(code, event[1], {"x": event[2], "y": event[3]}, now)
+        else:
+            claimed += 1
+            allowed += validator.check_damage(code, 1, "attacker", event[1], now)
+    return claimed, allowed
+
+
+if __name__ == "__main__":
+    import random
+    import tracemalloc
+
+    rng = random.Random(21)
+    fights = []
+    for match in range(300):
+        rtts = {1: rng.uniform(0.03, 0.3), 2: rng.uniform(0.03, 0.3)}
+        cheater = match % 4 == 0
+        fights.append((f"R{match:03d}", rtts, cheater, _fake_fight(rng, f"R{match:03d}", rtts, cheater=cheater)))
+
+    print("=" * 66)
+    print(f"  LAG COMPENSATION ({len(fights)} made-up 20s fights, 30-300 ms round trips)")
+    print("=" * 66)
+    for label, max_rewind in (("Check against where they are now", 0.0),
+                              ("Go back to the attacker's view", MAX_REWIND)):
+        honest = [0, 0]
+        cheats = [0, 0]
+        for code, rtts, cheater, events in fights:
+            tracker = RttTracker()
+            # What the pings would have measured
+            ping = tracker.ping_due("attacker", 0.0)
+            tracker.pong("attacker", ping, rtts[1])
+            claimed, allowed = _play(HitValidator(tracker, max_rewind=max_rewind), code, events)
+            totals = cheats if cheater else honest
+            totals[0] += claimed
+            totals[1] += allowed
+        print(f"  {label}:")
+        print(f"    honest hits allowed:       {honest[1] / honest[0]:6.1%} of {honest[0]:,}")
+        print(f"    hits from too far allowed: {cheats[1] / cheats[0]:6.1%} of {cheats[0]:,}")
+
+    # What the server pays per 'move' and per 'damage', with a full history
+    validator = HitValidator()
+    rooms = [f"R{i:04d}" for i in range(1000)]
+    for step in range(HISTORY_SIZE):
+        for code in rooms:
+            for number in (1, 2):
+                validator.record_move(code, number, {"x": 300.0 + step, "y": 400.0}, step / 20)
+    now = HISTORY_SIZE / 20
+    moves = {"x": 310.0, "y": 400.0}
+    calls = 100_000
+    start = time.perf_counter()
+    for i in range(calls):
+        validator.record_move(rooms[i % 1000], 2, moves, now + i * 1e-6)
+    record_time = time.perf_counter() - start
+    # Does the history grow? (tracemalloc slows everything down, so it
+    # isn't on while timing)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(calls):
+        validator.record_move(rooms[i % 1000], 2, moves, now + 0.1 + i * 1e-6)
+    grew = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    hit = {"targetPlayer": 2, "damage": 10, "kind": "melee"}
+    start = time.perf_counter()
+    for i in range(calls):
+        validator.check_damage(rooms[i % 1000], 1, "attacker", hit, now + 0.2)
+    check_time = time.perf_counter() - start
+    history = validator._rooms[rooms[0]][1]
+    size = sum(len(part) * part.itemsize for part in (history.times, history.xs, history.ys))
+    print()
+    print(f"  record_move():  {record_time / calls * 1e6:5.2f} us, memory grew {grew} bytes "
+          f"over {calls:,} moves")
+    print(f"  check_damage(): {check_time / calls * 1e6:5.2f} us per hit")
+    print(f"  History: {size:,} bytes per player, made once ({HISTORY_SIZE} positions)")
@@ -0,0 +1,302 @@
+# Match Recorder for Mina's PVP Fighting Game
+#
+# Every room writes a log of everything that happened in it, so a match
+# can be played again later (see replay.py) - to settle "I hit him
+# first!" arguments, or to find out why two screens disagreed.
+#
+# A log is a text file with one JSON list per line. The first line says
+# which room it is (and its seed, see room_rng.py), then every event:
+#
+#   {"room": "ABC123", "seed": 1234, "tick_rate": 60, ...}
+#   [0, 1, "buy_item", {"item_type": "mystery_box", "item": "t3-bow"}]
+#   [812, 0, "game_start", {"map": "Ice", "hazard_seed": 99, ...}]
+#   [901, 1, "move", {"x": 210.0, "y": 400.0, ...}]
+#   [903, 2, "input", {"left": true}, 41]
+#   ...
+#   [4410, 0, "game_over", {"winner": 2, "claimed": 2}]
+#
+#   [tick, player number (0 = the server), event, data, simulation tick]
+#
+# The tick counts 60ths of a second since the room was made. When the
+# server is running the fight (SERVER_AUTHORITATIVE), inputs also say
+# which simulation tick they arrived on, so replay.py can feed them to
+# the simulation at exactly the same moment.
+#
+# Recording must never slow down the relay, so record() only drops the
+# event in a queue. A writer thread wakes up a few times a second, turns
+# everything queued into JSON and writes it in one go per room. If the
+# disk can't keep up, the queue stops growing at MAX_PENDING and the
+# extra events are counted as dropped instead of filling up memory.
+
+import atexit
+import base64
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from simulation import TICK_RATE
+
+
+RECORDINGS_DIR = "recordings"
+FLUSH_SECONDS = 0.5       # How often the writer thread wakes up
+MAX_PENDING = 200_000     # Events waiting to be written before we drop some
+LOG_VERSION = 1
+
+SERVER = 0                # "Player number" for events the server made
+
+_CLOSE = object()         # Queued after a room's last event
+
+
+def _encode(value):
+    """JSON can't hold bytes (binary 'move' updates), so they become base64"""
+    if isinstance(value, (bytes, bytearray)):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"can't record {type(value).__name__}")
+
+
+def decode_data(data):
+    """The other way around: {"b64": ...} -> bytes"""
+    if isinstance(data, dict) and len(data) == 1 and "b64" in data:
+        return base64.b64decode(data["b64"])
+    return data
+
+
+class _RoomLog:
+    __slots__ = ("code", "path", "start", "events")
+
+    def __init__(self, code, path, start):
+        self.code = code
+        self.path = path
+        self.start = start
+        self.events = 0
+
+
+class MatchRecorder:
+    """Writes one log per room, from a background thread"""
+
+    def __init__(self, directory=RECORDINGS_DIR, flush_seconds=FLUSH_SECONDS,
+                 max_pending=MAX_PENDING, enabled=True):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self._rooms = {}           # room code -> _RoomLog
+        self._pending = deque()    # (room log, line) - line is a list, or _CLOSE
+        self._files = {}           # room log -> open file
+        self._thread = None
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+
+        # Metrics
+        self.events = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+
+    # -------------------------------------------------------------------------
+    # Recording (called from the handlers - must be quick)
+    # -------------------------------------------------------------------------
+
+    def open_room(self, code, seed, **info):
+        """Start a room's log. Returns its path (None if recording is off)."""
+        if not self.enabled:
+            return None
+        self.close_room(code)
+        start = time.perf_counter()
+        path = os.path.join(self.directory, f"{code}-{seed}-{int(time.time())}.jsonl")
+        log = self._rooms[code] = _RoomLog(code, path, start)
+        header = {"room": code, "seed": seed, "tick_rate": TICK_RATE,
+                  "version": LOG_VERSION, "created": time.time()}
+        header.update(info)
+        self._pending.append((log, header))
+        self._start_writer()
+        return path
+
+    def record(self, code, event, player, data=None, sim_tick=None):
+        """Add one event to a room's log (does nothing for rooms without one)"""
+        log = self._rooms.get(code)
+        if log is None:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        tick = int((time.perf_counter() - log.start) * TICK_RATE)
+        line = [tick, player, event, data] if sim_tick is None else [tick, player, event, data, sim_tick]
+        self._pending.append((log, line))
+        self.events += 1
+        log.events += 1
+
+    def record_game_start(self, code, room, hazard_seed):
+        """The battle begins: its map, hazard seed and everyone's weapons"""
+        self.record(code, "game_start", SERVER, {
+            "map": room["current_map"]["name"],
+            "hazard_seed": hazard_seed,
+            "weapons": {p["number"]: list(p.selected_ids) for p in room["players"].values()},
+        })
+
+    def record_simulation(self, code, room_sim):
+        """The server started running the fight - everything replay.py
+        needs to make the same RoomSimulation"""
+        self.record(code, "simulation", SERVER, {
+            "room": code,
+            "map": room_sim.map_data["name"],
+            "weapons": {number: [w["id"] for w in player.weapons]
+                        for number, player in room_sim.players.items()},
+            "hazard_seed": room_sim.hazard_seed,
+        }, room_sim.tick)
+
+    def close_room(self, code):
+        """The room is gone - its file is closed after the last write"""
+        log = self._rooms.pop(code, None)
+        if log is not None:
+            self._pending.append((log, _CLOSE))
+
+    def path_for(self, code):
+        log = self._rooms.get(code)
+        return log.path if log is not None else None
+
+    # -------------------------------------------------------------------------
+    # Writing (the background thread)
+    # -------------------------------------------------------------------------
+
+    def _start_writer(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="match-recorder", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything that's queued. Returns how many lines were written."""
+        with self._flush_lock:
+            start = time.perf_counter()
+            pending = self._pending
+            batches = {}   # room log -> [text lines]
+            closing = []
+            # Only take what's there now - anything added meanwhile waits
+            # for the next flush
+            for _ in range(len(pending)):
+                log, line = pending.popleft()
+                if line is _CLOSE:
+                    closing.append(log)
+                    continue
+                batches.setdefault(log, []).append(
+                    json.dumps(line, separators=(",", ":"), default=_encode))
+
+            written = 0
+            for log, lines in batches.items():
+                f = self._files.get(log)
+                if f is None:
+                    f = self._files[log] = open(log.path, "a", encoding="utf-8")
+                text = "\n".join(lines) + "\n"
+                f.write(text)
+                f.flush()
+                self.bytes_written += len(text)
+                written += len(lines)
+            for log in closing:
+                f = self._files.pop(log, None)
+                if f is not None:
+                    f.close()
+
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - start
+            return written
+
+    def close(self):
+        """Write what's left and close every file (the server is stopping)"""
+        for code in list(self._rooms):
+            self.close_room(code)
+        self.flush()
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "events": self.events,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "bytes_written": self.bytes_written,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_seconds * 1000,
+        }
+
+
+# =============================================================================
+# READING A LOG
+# =============================================================================
+
+def read_log(path):
+    """(header, [event lines]) from a room's log.
+
+    A half-written last line (the server stopped mid-write) is skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        events = []
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return header, events
+
+
+def recorder_from_env():
+    """The server's recorder: RECORD_MATCHES=0 turns it off,
+    RECORDINGS_DIR says where the logs go"""
+    return MatchRecorder(os.environ.get("RECORDINGS_DIR", RECORDINGS_DIR),
+                         enabled=os.environ.get("RECORD_MATCHES", "1") == "1")
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python match_recorder.py) to see what record()
+# costs a handler, compared with writing each event to the file straight
+# away like a plain logger would.
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    events = 200_000
+    move = {"x": 210.5, "y": 400.0, "velX": 5.0, "velY": 0.0, "hp": 100, "currentWeapon": 0,
+            "facingRight": True, "isAttacking": False}
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "direct.jsonl"), "a") as f:
+            start = time.perf_counter()
+            for i in range(events):
+                f.write(json.dumps([i, 1, "move", move]) + "\n")
+                f.flush()
+            direct = time.perf_counter() - start
+
+        recorder = MatchRecorder(directory, max_pending=events + 10)
+        path = recorder.open_room("BENCH1", 42)
+        start = time.perf_counter()
+        for i in range(events):
+            recorder.record("BENCH1", "move", 1, move)
+        queued = time.perf_counter() - start
+        start = time.perf_counter()
+        recorder.close()
+        written = time.perf_counter() - start
+        header, lines = read_log(path)
+    finally:
+        shutil.rmtree(directory)
+
+    print("=" * 50)
+    print(f"  MATCH RECORDING ({events:,} move events)")
+    print("=" * 50)
+    print(f"  Write + flush each event:  {direct / events * 1e6:6.2f} us per event (in the handler)")
+    print(f"  record() (queue only):     {queued / events * 1e6:6.2f} us per event (in the handler)")
+    print(f"  Writer thread, batched:    {written / events * 1e6:6.2f} us per event (in the background)")
+    print(f"  {recorder.bytes_written / events:.0f} bytes per event, "
+          f"{len(lines):,} events read back from room {header['room']}")
@@ -0,0 +1,304 @@
+# Metrics for Mina's PVP Fighting Game
+#
+# Counts and timings for every SocketIO handler, so we can see where the
+# server's time goes. /metrics shows them in the text format Prometheus
+# (and most other monitoring tools) can read:
+#
+#   pvp_events_total{event="player_action"} 1234
+#   pvp_handler_seconds_bucket{event="player_action",le="0.0001"} 1200
+#   ...
+#
+# Recording has to be cheap because player_action runs ~40 times a second
+# per room: a histogram is a fixed list of buckets, and payload sizes are
+# only measured on every PAYLOAD_SAMPLE_EVERY-th call (sizing a dict
+# means turning it into JSON). There are no locks while recording, so
+# two threads recording at the exact same moment can very rarely lose
+# one count - that's fine for monitoring, and much cheaper.
+
+import functools
+import inspect
+import json
+import threading
+import time
+from bisect import bisect_left
+
+
+# Bucket upper bounds (the last bucket, "+Inf", catches everything else)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (16, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+PAYLOAD_SAMPLE_EVERY = 64
+
+PREFIX = "pvp_"
+
+
+class Histogram:
+    """How many values fell into each bucket, plus their total"""
+
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count <= bound) pairs, like Prometheus wants"""
+        counts = list(self.counts)
+        running = 0
+        pairs = []
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+
+class EventStats:
+    """Everything we record about one SocketIO event"""
+
+    __slots__ = ("calls", "errors", "latency", "payload")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.payload = Histogram(SIZE_BUCKETS)
+
+
+class Metrics:
+    """All the server's metrics, and the /metrics text for them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = {}     # event name -> EventStats
+        self.timers = {}     # name -> Histogram of seconds (like relay fan-out)
+        self.gauges = {}     # name -> (help text, function returning {labels: value})
+
+    def event(self, name):
+        stats = self.events.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.events.setdefault(name, EventStats())
+        return stats
+
+    def timer(self, name):
+        histogram = self.timers.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.timers.setdefault(name, Histogram(LATENCY_BUCKETS))
+        return histogram
+
+    def gauge(self, name, help_text, read):
+        """Add a value that's worked out when /metrics is read.
+
+        read() returns {label value: number}, e.g. {"waiting": 3, "playing": 5}
+        """
+        self.gauges[name] = (help_text, read)
+
+    # -------------------------------------------------------------------------
+    # Recording
+    # -------------------------------------------------------------------------
+
+    def track_handler(self, event, handler):
+        """Wrap a SocketIO handler so every call is counted and timed"""
+        stats = self.event(event)
+        payload_arg = _payload_position(handler)
+        # SocketIO passes extra arguments (like 'auth' to connect) if the
+        # handler takes them, so only pass on what the handler accepts
+        max_args = _max_args(handler)
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def tracked(*args):
+                if max_args is not None:
+                    args = args[:max_args]
+                calls = stats.calls = stats.calls + 1
+                if payload_arg is not None and calls % PAYLOAD_SAMPLE_EVERY == 1 and len(args) > payload_arg:
+                    stats.payload.observe(payload_size(args[payload_arg]))
+                start = time.perf_counter()
+                try:
+                    return await handler(*args)
+                except Exception:
+                    stats.errors += 1
+                    raise
+                finally:
+                    stats.latency.observe(time.perf_counter() - start)
+            return tracked
+
+        @functools.wraps(handler)
+        def tracked(*args):
+            if max_args is not None:
+                args = args[:max_args]
+            calls = stats.calls = stats.calls + 1
+            if payload_arg is not None and calls % PAYLOAD_SAMPLE_EVERY == 1 and len(args) > payload_arg:
+                stats.payload.observe(payload_size(args[payload_arg]))
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latency.observe(time.perf_counter() - start)
+        return tracked
+
+    def time(self, name):
+        """Time a block of code: with metrics.time('relay_fanout'): ..."""
+        return _Timer(self.timer(name))
+
+    # -------------------------------------------------------------------------
+    # /metrics text
+    # -------------------------------------------------------------------------
+
+    def render(self):
+        lines = []
+        events = sorted(self.events.items())
+
+        lines.append(f"# HELP {PREFIX}events_total SocketIO events handled")
+        lines.append(f"# TYPE {PREFIX}events_total counter")
+        for name, stats in events:
+            lines.append(f'{PREFIX}events_total{{event="{name}"}} {stats.latency.count}')
+
+        lines.append(f"# HELP {PREFIX}event_errors_total SocketIO handlers that raised an error")
+        lines.append(f"# TYPE {PREFIX}event_errors_total counter")
+        for name, stats in events:
+            lines.append(f'{PREFIX}event_errors_total{{event="{name}"}} {stats.errors}')
+
+        _histogram_lines(lines, f"{PREFIX}handler_seconds", "Time spent in each SocketIO handler",
+                         [(f'event="{name}"', stats.latency) for name, stats in events])
+        _histogram_lines(lines, f"{PREFIX}payload_bytes",
+                         f"Size of incoming event data (1 in {PAYLOAD_SAMPLE_EVERY} calls)",
+                         [(f'event="{name}"', stats.payload) for name, stats in events])
+
+        for name, histogram in sorted(self.timers.items()):
+            _histogram_lines(lines, f"{PREFIX}{name}_seconds", f"Time spent in {name}",
+                             [("", histogram)])
+
+        for name, (help_text, read) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            for label, value in sorted(read().items()):
+                lines.append(f"{PREFIX}{name}{{{label}}} {value}" if label else f"{PREFIX}{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def _max_args(handler):
+    """How many positional arguments a handler takes (None = any number)"""
+    params = inspect.signature(handler).parameters.values()
+    if any(p.kind == p.VAR_POSITIONAL for p in params):
+        return None
+    return sum(1 for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD))
+
+
+def _payload_position(handler):
+    """Which argument is the event's data (handlers take (data) or (sid, data))"""
+    params = [p for p in inspect.signature(handler).parameters.values()
+              if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    if not params:
+        return None
+    return len(params) - 1 if params[-1].name == "data" else None
+
+
+def payload_size(data):
+    """Roughly how many bytes this data took on the wire"""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    try:
+        return len(json.dumps(data))
+    except TypeError:
+        pass
+
+    # Binary attachments inside a dict (like a binary 'move')
+    attachments = []
+
+    def attachment(value):
+        if isinstance(value, (bytes, bytearray)):
+            attachments.append(len(value))
+            return ""
+        raise TypeError
+
+    try:
+        return len(json.dumps(data, default=attachment)) + sum(attachments)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _histogram_lines(lines, name, help_text, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in series:
+        sep = "," if labels else ""
+        for bound, count in histogram.cumulative():
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {histogram.total}")
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def count_rooms_by_state(rooms):
+    """{'state="waiting"': 3, ...} for the rooms gauge"""
+    counts = {}
+    for room in rooms.values():
+        label = f'state="{room["state"]}"'
+        counts[label] = counts.get(label, 0) + 1
+    return counts
+
+
+# The server's metrics (app.py and async_server.py both record into this)
+metrics = Metrics()
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python metrics.py) to see what tracking costs
+# per handler call.
+
+if __name__ == "__main__":
+    calls = 200000
+    move = {"code": "ABC123", "action": "move",
+            "action_data": {"x": 100.5, "y": 590.0, "velX": 5, "velY": 0, "hp": 100}}
+
+    def handler(data):
+        return data["code"]
+
+    tracked = Metrics().track_handler("player_action", handler)
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        handler(move)
+    plain = (time.perf_counter() - start) / calls
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        tracked(move)
+    with_metrics = (time.perf_counter() - start) / calls
+
+    print("=" * 50)
+    print("  METRICS OVERHEAD (per handler call)")
+    print("=" * 50)
+    print(f"  Plain handler:   {plain * 1e9:7.0f} ns")
+    print(f"  Tracked handler: {with_metrics * 1e9:7.0f} ns  (+{(with_metrics - plain) * 1e9:.0f} ns)")
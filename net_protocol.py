@@ -0,0 +1,355 @@
+# Network Protocol for Mina's PVP Fighting Game
+#
+# Browsers send their player state 20 times a second as a JSON dict
+# (Player.getState() in game_engine.js). That's about 200 bytes of text
+# each time, and the server has to decode and re-encode it for the
+# other player.
+#
+# This file is a much smaller binary format for the same state:
+#   - every value has a fixed size (x and y are 2 bytes each, not "123.456")
+#   - positions are rounded to 1/8 of a pixel ("quantized")
+#   - after the other side says "got it" (an ack), we only send the
+#     values that changed since then (a "delta")
+#
+# Each connection picks JSON or binary when it joins, so old browsers
+# keep working with plain JSON.
+
+import math
+import struct
+from collections import OrderedDict
+
+
+PROTOCOL_JSON = "json"
+PROTOCOL_BINARY = "binary"
+PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_BINARY)
+
+PROTOCOL_VERSION = 1
+
+MESSAGE_FULL = 0    # Every field
+MESSAGE_DELTA = 1   # Only fields that changed since an acked snapshot
+
+# How many sent/received snapshots we remember for deltas
+HISTORY_SIZE = 32
+
+SEQ_MODULO = 1 << 16   # Sequence numbers are 2 bytes and wrap around
+
+
+class ProtocolError(ValueError):
+    """A binary message we can't make sense of"""
+
+
+# =============================================================================
+# FIELDS - the fixed layout of one player state
+# =============================================================================
+# (name in getState(), struct code, scale)
+# The value sent is round(value * scale), so scale 8 = 1/8 pixel steps.
+
+TWO_PI = math.pi * 2
+ANGLE_SCALE = 65536 / TWO_PI
+
+FIELDS = (
+    ("x", "h", 8),
+    ("y", "h", 8),
+    ("velX", "h", 64),
+    ("velY", "h", 64),
+    ("hp", "B", 1),
+    ("currentWeapon", "B", 1),
+    ("spinAngle", "H", ANGLE_SCALE),
+    ("flags", "B", 1),
+)
+
+# True/False values packed into the one "flags" byte
+FLAGS = ("facingRight", "isAttacking", "isSpinJumping", "isDucking")
+
+_FIELD_STRUCTS = tuple(struct.Struct("<" + code) for _, code, _ in FIELDS)
+_FULL_STATE = struct.Struct("<" + "".join(code for _, code, _ in FIELDS))
+_LIMITS = {
+    "h": (-32768, 32767),
+    "H": (0, 65535),
+    "B": (0, 255),
+}
+
+_HEADER = struct.Struct("<BH")        # version/type, seq
+_DELTA_HEADER = struct.Struct("<HB")  # base seq, changed-field mask
+
+assert len(FIELDS) <= 8, "the delta mask is one byte"
+
+
+def quantize_state(state):
+    """Turn a getState() dict into a tuple of small integers"""
+    values = []
+    for name, code, scale in FIELDS:
+        if name == "flags":
+            value = 0
+            for bit, flag in enumerate(FLAGS):
+                if state.get(flag):
+                    value |= 1 << bit
+        elif name == "spinAngle":
+            value = int(round((state.get(name) or 0) * scale)) % 65536
+        else:
+            low, high = _LIMITS[code]
+            value = int(round((state.get(name) or 0) * scale))
+            value = low if value < low else high if value > high else value
+        values.append(value)
+    return tuple(values)
+
+
+def dequantize_state(values):
+    """Turn the small integers back into a getState()-style dict"""
+    state = {}
+    for (name, _, scale), value in zip(FIELDS, values):
+        if name == "flags":
+            for bit, flag in enumerate(FLAGS):
+                state[flag] = bool(value & (1 << bit))
+        elif scale == 1:
+            state[name] = value
+        else:
+            state[name] = value / scale
+    return state
+
+
+# =============================================================================
+# ENCODER / DECODER - one of each per direction per connection
+# =============================================================================
+
+class SnapshotEncoder:
+    """Packs player states, using deltas once the other side has acked one"""
+
+    def __init__(self):
+        self.seq = 0
+        self._sent = OrderedDict()   # seq -> quantized values
+        self._acked_seq = None
+        self._acked_values = None
+
+    def encode(self, state):
+        """Pack one getState() dict. Returns bytes."""
+        return self.encode_values(quantize_state(state))
+
+    def encode_values(self, values):
+        """Pack an already-quantized state (skips the float math when relaying)"""
+        self.seq = (self.seq + 1) % SEQ_MODULO
+        self._sent[self.seq] = values
+        if len(self._sent) > HISTORY_SIZE:
+            self._sent.popitem(last=False)
+
+        if self._acked_values is None:
+            return (_HEADER.pack(PROTOCOL_VERSION << 4 | MESSAGE_FULL, self.seq)
+                    + _FULL_STATE.pack(*values))
+
+        mask = 0
+        parts = []
+        for bit, (value, base, packer) in enumerate(zip(values, self._acked_values, _FIELD_STRUCTS)):
+            if value != base:
+                mask |= 1 << bit
+                parts.append(packer.pack(value))
+        return (_HEADER.pack(PROTOCOL_VERSION << 4 | MESSAGE_DELTA, self.seq)
+                + _DELTA_HEADER.pack(self._acked_seq, mask)
+                + b"".join(parts))
+
+    def ack(self, seq):
+        """The other side got snapshot `seq` - future deltas can build on it"""
+        values = self._sent.get(seq)
+        if values is not None:
+            self._acked_seq = seq
+            self._acked_values = values
+
+
+class SnapshotDecoder:
+    """Unpacks what a SnapshotEncoder produced"""
+
+    def __init__(self):
+        self._received = OrderedDict()   # seq -> quantized values
+
+    def decode(self, data):
+        """Unpack one message. Returns (seq, state dict)."""
+        seq, values = self.decode_values(data)
+        return seq, dequantize_state(values)
+
+    def decode_values(self, data):
+        """Unpack one message. Returns (seq, quantized values)."""
+        try:
+            kind, seq = _HEADER.unpack_from(data, 0)
+            if kind >> 4 != PROTOCOL_VERSION:
+                raise ProtocolError(f"unknown protocol version {kind >> 4}")
+            offset = _HEADER.size
+
+            if kind & 0x0F == MESSAGE_FULL:
+                values = _FULL_STATE.unpack_from(data, offset)
+            elif kind & 0x0F == MESSAGE_DELTA:
+                base_seq, mask = _DELTA_HEADER.unpack_from(data, offset)
+                offset += _DELTA_HEADER.size
+                base = self._received.get(base_seq)
+                if base is None:
+                    raise ProtocolError(f"delta against unknown snapshot {base_seq}")
+                values = list(base)
+                for bit, packer in enumerate(_FIELD_STRUCTS):
+                    if mask & (1 << bit):
+                        values[bit] = packer.unpack_from(data, offset)[0]
+                        offset += packer.size
+                values = tuple(values)
+            else:
+                raise ProtocolError(f"unknown message type {kind & 0x0F}")
+        except struct.error as e:
+            raise ProtocolError(str(e)) from e
+
+        self._received[seq] = values
+        if len(self._received) > HISTORY_SIZE:
+            self._received.popitem(last=False)
+        return seq, values
+
+
+class ConnectionCodec:
+    """Which format one connection speaks, plus its encoder and decoder"""
+
+    def __init__(self, protocol=PROTOCOL_JSON):
+        self.protocol = protocol
+        self.encoder = SnapshotEncoder()   # Server -> this browser
+        self.decoder = SnapshotDecoder()   # This browser -> server
+
+    @property
+    def binary(self):
+        return self.protocol == PROTOCOL_BINARY
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python net_protocol.py) to compare message size
+# and encode/decode time for JSON and the binary format.
+
+def _fake_states(count):
+    """A player running and jumping around, like getState() would report"""
+    import random
+    rng = random.Random(9)
+    x, y, vel_y, hp = 100.0, 590.0, 0.0, 100
+    states = []
+    for i in range(count):
+        vel_x = rng.choice((-5, 0, 5))
+        if i % 40 == 0:
+            vel_y = -15.0
+        vel_y = min(vel_y + 0.8 * 3, 15.0)   # 3 frames between sends
+        x = min(max(x + vel_x * 3, 0), 1160)
+        y = min(y + vel_y * 3, 590.0)
+        if rng.random() < 0.02:
+            hp = max(hp - 7, 0)
+        states.append({
+            "x": x, "y": y, "velX": vel_x, "velY": vel_y, "hp": hp,
+            "facingRight": vel_x >= 0, "isAttacking": rng.random() < 0.1,
+            "currentWeapon": 0, "isSpinJumping": False, "spinAngle": 0,
+            "isDucking": False,
+        })
+    return states
+
+
+def _mixed_room_check():
+    """A JSON player and a binary player in one room, through the real
+    handlers (see game_server.py). Returns {what was checked: passed?}."""
+    import contextlib
+    import io
+
+    from game_server import GameServer
+    from match_recorder import MatchRecorder
+    from room_backend import InMemoryBackend
+
+    server = GameServer(InMemoryBackend())
+    server.match_recorder = MatchRecorder(enabled=False)
+
+    def move(sid, action_data):
+        out = server.player_action(sid, {"code": code, "action": "move", "action_data": action_data})
+        return [(event, payload) for event, payload, target, _ in out.messages
+                if event in ("opponent_state", "opponent_action")]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        code = server.create_room("json-player").messages[0][1]["code"]
+        server.join_room("binary-player", {"code": code})
+        server.set_protocol("binary-player", {"protocol": PROTOCOL_BINARY})
+
+        states = _fake_states(3)
+        browser_decoder = SnapshotDecoder()   # The binary player's browser
+        browser_encoder = SnapshotEncoder()
+        results = {}
+
+        # JSON in, binary out
+        relayed = move("json-player", states[0])
+        results["JSON move reaches the binary player"] = (
+            len(relayed) == 1 and relayed[0][0] == "opponent_state" and
+            browser_decoder.decode(relayed[0][1])[1] == dequantize_state(quantize_state(states[0])))
+
+        # Binary in, JSON out
+        relayed = move("binary-player", browser_encoder.encode(states[1]))
+        results["binary move reaches the JSON player"] = (
+            len(relayed) == 1 and relayed[0][0] == "opponent_action" and
+            relayed[0][1]["data"] == dequantize_state(quantize_state(states[1])))
+
+        # Broken moves are dropped, not crashes
+        broken = ([1, 2], "hello", None, {"x": "far"}, {"x": [1]}, {"x": float("nan")},
+                  {"x": 1e308}, b"\x10", b"\x99\x00\x00")
+        dropped = True
+        for action_data in broken:
+            sid = "binary-player" if isinstance(action_data, bytes) else "json-player"
+            try:
+                dropped = dropped and not move(sid, action_data)
+            except Exception:
+                dropped = False
+        results["broken moves are dropped"] = dropped
+
+        # ... and the next good one still goes through
+        relayed = move("json-player", states[2])
+        results["next good move still relayed"] = (
+            len(relayed) == 1 and browser_decoder.decode(relayed[0][1])[1] ==
+            dequantize_state(quantize_state(states[2])))
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    states = _fake_states(20000)
+
+    # JSON: what the server does today (decode the action, re-wrap and encode it)
+    messages = [json.dumps({"code": "ABC123", "action": "move", "action_data": s}) for s in states]
+    start = time.perf_counter()
+    for message in messages:
+        data = json.loads(message)
+        json.dumps({"action": data["action"], "data": data["action_data"]})
+    json_time = (time.perf_counter() - start) / len(states)
+    json_bytes = sum(len(m) for m in messages) / len(messages)
+
+    # Binary: decode the sender's message, encode it for the other player
+    # (binary to binary, so the server never turns it back into floats)
+    def run_binary(ack_every):
+        uplink_encoder, uplink_decoder = SnapshotEncoder(), SnapshotDecoder()
+        downlink_encoder = SnapshotEncoder()
+        packed = []
+        for i, s in enumerate(states):
+            packed.append(uplink_encoder.encode(s))
+            if ack_every and i % ack_every == 0:
+                uplink_encoder.ack(uplink_encoder.seq)
+        start = time.perf_counter()
+        out_bytes = 0
+        for i, message in enumerate(packed):
+            seq, values = uplink_decoder.decode_values(message)
+            out_bytes += len(downlink_encoder.encode_values(values))
+            if ack_every and i % ack_every == 0:
+                downlink_encoder.ack(downlink_encoder.seq)
+        elapsed = (time.perf_counter() - start) / len(packed)
+        return elapsed, sum(len(p) for p in packed) / len(packed), out_bytes / len(packed)
+
+    print("=" * 50)
+    print("  PROTOCOL BENCHMARK (per 'move' message)")
+    print("=" * 50)
+    print(f"  JSON:            {json_bytes:6.1f} bytes   {json_time * 1e6:6.2f} us server CPU")
+    for label, ack_every in (("Binary full:", 0), ("Binary delta:", 3)):
+        elapsed, up_bytes, down_bytes = run_binary(ack_every)
+        print(f"  {label:<16} {up_bytes:6.1f} bytes   {elapsed * 1e6:6.2f} us server CPU"
+              f"   (sent on: {down_bytes:.1f} bytes)")
+
+    print()
+    print("=" * 50)
+    print("  MIXED ROOM CHECK (one JSON player, one binary)")
+    print("=" * 50)
+    results = _mixed_room_check()
+    for what, passed in results.items():
+        print(f"  {what}: {'OK' if passed else 'FAILED'}")
+    assert all(results.values())
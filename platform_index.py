@@ -0,0 +1,202 @@
+# Platform Index for Mina's PVP Fighting Game
+#
+# Player.move checks EVERY platform on the map, every frame, to see if
+# the player landed on it. Maps never change during a battle, so we can
+# sort each map's platforms into columns ("cells") once at startup:
+#
+#   cell 0 = x 0-49, cell 1 = x 50-99, cell 2 = x 100-149 ...
+#
+# A player is only 40 pixels wide, so they can only ever touch two
+# neighbouring cells. Inside each cell the platforms are sorted by height,
+# so a landing check only looks at the few platforms that are near the
+# player AND between where their feet were and where they are now.
+# Every room on the same map shares the same compiled index.
+
+from bisect import bisect_left, bisect_right
+
+from game_data import MAPS, SCREEN_WIDTH, PLAYER_WIDTH, get_map_platforms
+
+
+CELL_SIZE = 50    # Must be wider than a player (see candidates())
+NUM_CELLS = SCREEN_WIDTH // CELL_SIZE + 1
+
+
+class IndexedPlatform:
+    """A platform without drawing code, plus its place in the map's list"""
+
+    __slots__ = ("x", "y", "width", "height", "order")
+
+    def __init__(self, x, y, width, height, order):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.order = order   # Position in the map's platform list
+
+
+def _cell(x):
+    """Which column an x position is in (off-screen counts as the edge columns)"""
+    cell = int(x // CELL_SIZE)
+    if cell < 0:
+        return 0
+    if cell >= NUM_CELLS:
+        return NUM_CELLS - 1
+    return cell
+
+
+class PlatformIndex:
+    """One map's platforms, sorted into columns for fast landing checks"""
+
+    def __init__(self, platforms):
+        self.platforms = [
+            IndexedPlatform(p["x"], p["y"], p["width"], p["height"], i)
+            for i, p in enumerate(platforms)
+        ]
+
+        # Which platforms reach into each column
+        columns = [[] for _ in range(NUM_CELLS)]
+        for platform in self.platforms:
+            for cell in range(_cell(platform.x), _cell(platform.x + platform.width) + 1):
+                columns[cell].append(platform)
+
+        # A player standing in column c can also reach into column c + 1,
+        # so store both columns together, in the map's original order
+        # (Player.move lets the first platform in the list win).
+        self.cells = []
+        for cell in range(NUM_CELLS):
+            nearby = columns[cell]
+            if cell + 1 < NUM_CELLS:
+                nearby = nearby + columns[cell + 1]
+            unique = {p.order: p for p in nearby}
+            self.cells.append(tuple(unique[order] for order in sorted(unique)))
+
+        # The same columns sorted by height, for landing_candidates()
+        self._cells_by_y = []
+        for platforms in self.cells:
+            by_y = sorted(platforms, key=lambda p: (p.y, p.order))
+            self._cells_by_y.append((tuple(p.y for p in by_y), tuple(by_y)))
+
+    def __len__(self):
+        return len(self.platforms)
+
+    def __iter__(self):
+        return iter(self.platforms)
+
+    def candidates(self, x):
+        """Every platform a player at this x could be over, in map order"""
+        return self.cells[_cell(x)]
+
+    def landing_candidates(self, x, feet, vel_y):
+        """The only platforms a falling player could land on this frame.
+
+        Player.check_platform_collision needs vel_y >= 0 and
+        feet <= platform.y <= feet + vel_y, so we only return platforms
+        in that height range (in map order).
+        """
+        if vel_y < 0:
+            return ()
+        heights, platforms = self._cells_by_y[_cell(x)]
+        low = bisect_left(heights, feet)
+        high = bisect_right(heights, feet + vel_y)
+        if high - low < 2:
+            return platforms[low:high]
+        return sorted(platforms[low:high], key=lambda p: p.order)
+
+    def max_candidates(self):
+        """The most platforms candidates() will ever return"""
+        return max((len(cell) for cell in self.cells), default=0)
+
+
+# =============================================================================
+# CACHE - compile each map once and share it between rooms
+# =============================================================================
+
+_INDEXES = {}
+
+
+def get_platform_index(map_data):
+    """The compiled PlatformIndex for a map (built the first time it's asked for)"""
+    name = map_data["name"]
+    index = _INDEXES.get(name)
+    if index is None:
+        index = PlatformIndex(get_map_platforms(map_data))
+        _INDEXES[name] = index
+    return index
+
+
+def compile_all_maps():
+    """Build the index for every map in game_data.MAPS (call at startup)"""
+    for map_data in MAPS:
+        get_platform_index(map_data)
+    return dict(_INDEXES)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python platform_index.py) to compare the index
+# against checking every platform, like Player.move does.
+
+def _dense_cube_layout(rows, cubes_per_row, size=40):
+    """A made-up Breakable Cubes map packed with lots of cubes"""
+    platforms = []
+    for row in range(rows):
+        y = 650 - 60 * (row + 1)
+        offset = (row % 2) * size // 2
+        for i in range(cubes_per_row):
+            platforms.append({"x": offset + i * (SCREEN_WIDTH // cubes_per_row),
+                              "y": y, "width": size, "height": size})
+    return platforms
+
+
+def _benchmark(platforms, checks=100000):
+    import random
+    import time
+    from simulation import SimPlayer
+
+    index = PlatformIndex(platforms)
+    rng = random.Random(5)
+    spots = [(rng.uniform(-5, SCREEN_WIDTH - PLAYER_WIDTH + 5),
+              rng.uniform(0, 700), rng.uniform(-15, 15)) for _ in range(checks)]
+    player = SimPlayer(1, 0, 0)
+
+    def linear(x, y, vel_y):
+        player.x, player.y, player.vel_y = x, y, vel_y
+        for platform in index.platforms:
+            player.check_platform_collision(platform)
+        return player.y
+
+    def indexed(x, y, vel_y):
+        player.x, player.y, player.vel_y = x, y, vel_y
+        for platform in index.landing_candidates(x, y + player.height, vel_y):
+            player.check_platform_collision(platform)
+        return player.y
+
+    # Both must give the same answer
+    for x, y, vel_y in spots[:5000]:
+        assert linear(x, y, vel_y) == indexed(x, y, vel_y)
+
+    start = time.perf_counter()
+    for x, y, vel_y in spots:
+        linear(x, y, vel_y)
+    linear_time = (time.perf_counter() - start) / checks
+
+    start = time.perf_counter()
+    for x, y, vel_y in spots:
+        indexed(x, y, vel_y)
+    indexed_time = (time.perf_counter() - start) / checks
+    return linear_time, indexed_time, index.max_candidates()
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("  PLATFORM INDEX BENCHMARK")
+    print("=" * 50)
+    layouts = [(m["name"], get_map_platforms(m)) for m in MAPS]
+    layouts.append(("Dense cubes 8x30", _dense_cube_layout(8, 30)))
+    layouts.append(("Dense cubes 12x60", _dense_cube_layout(12, 60)))
+    for name, platforms in layouts:
+        linear_time, indexed_time, most = _benchmark(platforms)
+        print(f"  {name:<18} {len(platforms):>4} platforms (max {most:>3} per cell): "
+              f"linear {linear_time * 1e9:7.0f} ns   indexed {indexed_time * 1e9:6.0f} ns"
+              f"   ({linear_time / indexed_time:4.1f}x)")
@@ -0,0 +1,324 @@
+# Projectiles for Mina's PVP Fighting Game
+#
+# The first version kept a list of Projectile objects and every frame did:
+#
+#   for proj in projectiles[:]:          <- copies the whole list
+#       ...
+#       projectiles.remove(proj)         <- searches the whole list
+#
+# and made a brand new Projectile object for every shot. That's fine with
+# 3 arrows on screen, but gets slower and slower with lots of them.
+#
+# ProjectilePool keeps every projectile in a few NumPy arrays instead
+# (like world_store.py does for players), packed at the front:
+#
+#   x[0..count-1], y[0..count-1], direction[0..count-1] ...
+#
+#   - shooting writes one row at the end               (no new object)
+#   - removing one moves the LAST row into its place   ("swap-remove")
+#   - moving and hit-testing is done for all of them at once
+#
+# The server's batch simulation uses one pool for every room (see
+# simulation.py). The pygame game keeps a plain list (swap-removing from
+# it the same way): one fight only ever has a handful of projectiles, and
+# below a few hundred the NumPy calls cost more than the list does
+# (python projectiles.py).
+
+import numpy as np
+
+from game_data import SCREEN_WIDTH
+from simulation import PROJECTILE_SPEED, PROJECTILE_WIDTH, PROJECTILE_HEIGHT
+
+
+class ProjectilePool:
+    """Every projectile in flight, kept in NumPy arrays.
+
+    Each projectile has two targets (indexes into the target arrays given
+    to update), checked in order, just like the game checks player 1 and
+    then player 2. A tag says which group it belongs to (like a room), so
+    a group can be listed or cleared on its own.
+    """
+
+    _ARRAYS = (
+        ("x", np.float64), ("y", np.float64), ("direction", np.int64),
+        ("speed", np.float64), ("damage", np.int64), ("owner", np.int64),
+        ("target_a", np.int64), ("target_b", np.int64), ("tag", np.int64),
+    )
+
+    def __init__(self, capacity=256, width=PROJECTILE_WIDTH, height=PROJECTILE_HEIGHT):
+        self.width = width
+        self.height = height
+        self.count = 0
+        self.capacity = 0
+        for name, dtype in self._ARRAYS:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        # Anything else a projectile carries (like its colour), same order
+        self.extra = []
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, new_capacity):
+        """Make every array bigger (keeps the old values)"""
+        for name, dtype in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros(new_capacity, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.capacity = new_capacity
+
+    # -------------------------------------------------------------------------
+    # Adding and removing
+    # -------------------------------------------------------------------------
+
+    def spawn(self, x, y, direction, damage, owner, target_a=0, target_b=1, tag=0,
+              speed=PROJECTILE_SPEED, extra=None):
+        """Fire one projectile. Returns where it is (until something is removed)."""
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.direction[i] = direction
+        self.speed[i] = speed
+        self.damage[i] = damage
+        self.owner[i] = owner
+        self.target_a[i] = target_a
+        self.target_b[i] = target_b
+        self.tag[i] = tag
+        self.extra.append(extra)
+        self.count = i + 1
+        return i
+
+    def despawn(self, i):
+        """Remove projectile i by moving the last one into its place"""
+        last = self.count - 1
+        if i != last:
+            for name, _ in self._ARRAYS:
+                array = getattr(self, name)
+                array[i] = array[last]
+            self.extra[i] = self.extra[last]
+        self.extra.pop()
+        self.count = last
+
+    def despawn_many(self, indexes):
+        """Remove several projectiles at once.
+
+        Same as swap-removing them one by one: the holes below the new
+        count are filled with the survivors from the end.
+        """
+        indexes = np.unique(np.asarray(indexes, dtype=np.int64))
+        if len(indexes) == 0:
+            return
+        new_count = self.count - len(indexes)
+        holes = indexes[indexes < new_count]
+        end = np.ones(self.count - new_count, dtype=bool)
+        end[indexes[indexes >= new_count] - new_count] = False
+        fillers = np.flatnonzero(end) + new_count
+        for name, _ in self._ARRAYS:
+            array = getattr(self, name)
+            array[holes] = array[fillers]
+        for hole, filler in zip(holes.tolist(), fillers.tolist()):
+            self.extra[hole] = self.extra[filler]
+        del self.extra[new_count:]
+        self.count = new_count
+
+    def clear_tag(self, tag):
+        """Remove a whole group's projectiles.
+
+        Returns (x, y, direction, damage, owner, speed) for each one.
+        """
+        mine = np.flatnonzero(self.tag[:self.count] == tag).tolist()
+        removed = [(self.x[i].item(), self.y[i].item(), self.direction[i].item(),
+                    self.damage[i].item(), self.owner[i].item(), self.speed[i].item())
+                   for i in mine]
+        self.despawn_many(mine)
+        return removed
+
+    def clear(self):
+        self.count = 0
+        self.extra.clear()
+
+    # -------------------------------------------------------------------------
+    # One tick for every projectile
+    # -------------------------------------------------------------------------
+
+    def update(self, target_x, target_y, target_width, target_height):
+        """Move everything, then find what hit something.
+
+        Same rules as Projectile.update + check_hit: off the screen means
+        gone, otherwise target_a is checked before target_b. Everything
+        that hit or left the screen is removed.
+
+        Returns (targets that were hit, damage for each hit) as arrays.
+        """
+        n = self.count
+        if n == 0:
+            return _NO_HITS
+        x = self.x[:n]
+        y = self.y[:n]
+        x += self.direction[:n] * self.speed[:n]
+        gone = (x < 0) | (x > SCREEN_WIDTH)
+
+        target_x = np.asarray(target_x)
+        target_y = np.asarray(target_y)
+        target_a = self.target_a[:n]
+        target_b = self.target_b[:n]
+        hit_a = ~gone & self._overlaps(x, y, target_a, target_x, target_y,
+                                       target_width, target_height)
+        hit_b = ~gone & ~hit_a & self._overlaps(x, y, target_b, target_x, target_y,
+                                                target_width, target_height)
+
+        done = np.flatnonzero(gone | hit_a | hit_b)
+        if len(done) == 0:
+            return _NO_HITS
+        damage = self.damage[:n]
+        targets = np.concatenate((target_a[hit_a], target_b[hit_b]))
+        damages = np.concatenate((damage[hit_a], damage[hit_b]))
+        self.despawn_many(done)
+        return targets, damages
+
+    def _overlaps(self, x, y, targets, target_x, target_y, target_width, target_height):
+        tx = target_x.take(targets)
+        ty = target_y.take(targets)
+        tw = target_width if np.isscalar(target_width) else np.take(target_width, targets)
+        th = target_height if np.isscalar(target_height) else np.take(target_height, targets)
+        return ((x < tx + tw) & (x + self.width > tx) &
+                (y < ty + th) & (y + self.height > ty))
+
+    # -------------------------------------------------------------------------
+    # Reading
+    # -------------------------------------------------------------------------
+
+    def _snapshot(self, i):
+        return {"x": self.x[i].item(), "y": self.y[i].item(),
+                "direction": self.direction[i].item()}
+
+    def snapshot(self, tag=None):
+        """[{"x", "y", "direction"}, ...] for everything (or one group)"""
+        if tag is None:
+            indexes = range(self.count)
+        else:
+            indexes = np.flatnonzero(self.tag[:self.count] == tag).tolist()
+        return [self._snapshot(i) for i in indexes]
+
+
+_NO_HITS = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+
+# =============================================================================
+# STRESS BENCHMARK
+# =============================================================================
+# Run this file directly (python projectiles.py) to compare the old list
+# loop with the pool while thousands of projectiles are flying. Both get
+# the same shots: a steady stream from random places, most of which fly
+# off the screen and some of which hit one of the two players.
+
+def _old_frame(projectiles, targets):
+    """The first version's loop (copy the list, remove() from it)"""
+    player1, player2 = targets
+    for proj in projectiles[:]:
+        proj.update()
+        if not proj.active:
+            projectiles.remove(proj)
+            continue
+        if proj.check_hit(player1):
+            player1.health -= proj.damage
+            projectiles.remove(proj)
+        elif proj.check_hit(player2):
+            player2.health -= proj.damage
+            projectiles.remove(proj)
+
+
+def _swap_frame(projectiles, targets):
+    """The loop pvp_fighting_game_1.Match.update uses now: backwards, swap-remove"""
+    player1, player2 = targets
+    for i in range(len(projectiles) - 1, -1, -1):
+        proj = projectiles[i]
+        proj.update()
+        if not proj.active:
+            pass
+        elif proj.check_hit(player1):
+            player1.health -= proj.damage
+        elif proj.check_hit(player2):
+            player2.health -= proj.damage
+        else:
+            continue
+        projectiles[i] = projectiles[-1]
+        projectiles.pop()
+
+
+def _stress(in_flight, frames=120, seed=3):
+    import random
+    import time
+    from simulation import SimPlayer, SimProjectile
+
+    rng = random.Random(seed)
+    # A shot lives about 60 frames (half the screen at 10 pixels a frame),
+    # so this many new shots per frame keeps about in_flight in the air
+    shots_per_frame = max(1, in_flight // 60)
+    shots = [[(rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, 700), rng.choice((-1, 1)))
+              for _ in range(shots_per_frame)] for _ in range(frames)]
+
+    def players():
+        return [SimPlayer(1, 300, 400), SimPlayer(2, 800, 400)]
+
+    # Fill the screen first, then time the frames
+    old_players = players()
+    old = []
+    swap_players = players()
+    swap = []
+    pool = ProjectilePool()
+    pool_players = players()
+    for _ in range(in_flight):
+        x, y, direction = rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, 700), rng.choice((-1, 1))
+        old.append(SimProjectile(x, y, direction, 5, 1))
+        swap.append(SimProjectile(x, y, direction, 5, 1))
+        pool.spawn(x, y, direction, 5, 1)
+
+    old_times = []
+    for frame in shots:
+        start = time.perf_counter()
+        for x, y, direction in frame:
+            old.append(SimProjectile(x, y, direction, 5, 1))
+        _old_frame(old, old_players)
+        old_times.append(time.perf_counter() - start)
+
+    swap_times = []
+    for frame in shots:
+        start = time.perf_counter()
+        for x, y, direction in frame:
+            swap.append(SimProjectile(x, y, direction, 5, 1))
+        _swap_frame(swap, swap_players)
+        swap_times.append(time.perf_counter() - start)
+
+    new_times = []
+    for frame in shots:
+        start = time.perf_counter()
+        for x, y, direction in frame:
+            pool.spawn(x, y, direction, 5, 1)
+        targets, damages = pool.update(
+            np.array([p.x for p in pool_players]), np.array([p.y for p in pool_players]),
+            pool_players[0].width, pool_players[0].height)
+        for target, damage in zip(targets.tolist(), damages.tolist()):
+            pool_players[target].health -= damage
+        new_times.append(time.perf_counter() - start)
+
+    healths = [p.health for p in old_players]
+    same = (healths == [p.health for p in swap_players] == [p.health for p in pool_players]
+            and len(old) == len(swap) == len(pool))
+    return (sum(old_times) / frames, sum(swap_times) / frames, sum(new_times) / frames,
+            len(pool), same)
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("  PROJECTILE STRESS BENCHMARK (ms per frame)")
+    print("=" * 50)
+    print(f"  {'in flight':>9} {'list':>9} {'swap':>9} {'pool':>9}   same result?")
+    for in_flight in (60, 600, 3000, 12000):
+        old, swap, new, flying, same = _stress(in_flight)
+        print(f"  {flying:>9,} {old * 1000:>9.3f} {swap * 1000:>9.3f} {new * 1000:>9.3f}"
+              f"   {'yes' if same else 'NO'}")
+    print("  (list = copy + remove(), swap = the pygame game's swap-remove list)")
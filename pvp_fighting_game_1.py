@@ -2,15 +2,15 @@ import pygame
 import random
 import string
 import sys
-
-# Initialize Pygame
-pygame.init()
+import time
 
 # Screen dimensions
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 700
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("PVP Fighting Game")
+
+# The game window. open_window() makes it when the game starts, so this
+# file can be imported (or run with --headless) without opening a window.
+screen = None
 
 # Colors
 WHITE = (255, 255, 255)
@@ -31,6 +31,11 @@ JUMP_STRENGTH = -15
 
 # Player class
 class Player:
+    __slots__ = ("x", "y", "width", "height", "color", "vel_x", "vel_y", "speed",
+                 "on_ground", "facing_right", "health", "max_health", "controls", "name",
+                 "weapons", "current_weapon_index", "attack_cooldown", "is_attacking",
+                 "attack_timer")
+
     def __init__(self, x, y, color, controls, name):
         self.x = x
         self.y = y
@@ -169,6 +174,8 @@ class Player:
         
 # Weapon classes
 class Weapon:
+    __slots__ = ("name", "damage", "weapon_type", "tier", "range")
+
     def __init__(self, name, damage, weapon_type, tier, range_val=50):
         self.name = name
         self.damage = damage
@@ -180,6 +187,8 @@ class Weapon:
         pass  # Override in subclasses
         
 class MeleeWeapon(Weapon):
+    __slots__ = ("color",)
+
     def __init__(self, name, damage, tier, color=GRAY):
         super().__init__(name, damage, 'melee', tier)
         self.color = color
@@ -231,6 +240,8 @@ class MeleeWeapon(Weapon):
         return in_range and vertical_align and attacker.attack_timer == 14
         
 class Projectile:
+    __slots__ = ("x", "y", "direction", "damage", "color", "speed", "active", "width", "height")
+
     def __init__(self, x, y, direction, damage, color, speed=10):
         self.x = x
         self.y = y
@@ -258,6 +269,8 @@ class Projectile:
                 self.y + self.height > player.y)
                 
 class RangedWeapon(Weapon):
+    __slots__ = ("color",)
+
     def __init__(self, name, damage, tier, color=YELLOW):
         super().__init__(name, damage, 'ranged', tier)
         self.color = color
@@ -286,6 +299,8 @@ class RangedWeapon(Weapon):
 
 # Platform class
 class Platform:
+    __slots__ = ("x", "y", "width", "height", "color")
+
     def __init__(self, x, y, width, height, color=BROWN):
         self.x = x
         self.y = y
@@ -346,149 +361,161 @@ def draw_props(screen):
     pygame.draw.circle(screen, WHITE, (825, 150), 30)
     pygame.draw.circle(screen, WHITE, (850, 150), 25)
 
-# Main game function
-def main():
-    clock = pygame.time.Clock()
-    
-    # Generate game code
-    game_code = generate_game_code()
-    
-    # Create players
-    player1 = Player(100, 100, BLUE, {
-        'left': pygame.K_a,
-        'right': pygame.K_d,
-        'jump': pygame.K_w,
-        'attack': pygame.K_s,
-        'weapon1': pygame.K_1,
-        'weapon2': pygame.K_2,
-        'weapon3': pygame.K_3
-    }, "Player 1")
-    
-    player2 = Player(1000, 100, RED, {
-        'left': pygame.K_LEFT,
-        'right': pygame.K_RIGHT,
-        'jump': pygame.K_UP,
-        'attack': pygame.K_DOWN,
-        'weapon1': pygame.K_KP1,
-        'weapon2': pygame.K_KP2,
-        'weapon3': pygame.K_KP3
-    }, "Player 2")
-    
-    # Give players some starting weapons
-    weapons_pool = create_starter_weapons()
-    player1.weapons = random.sample(weapons_pool, 3)
-    player2.weapons = random.sample(weapons_pool, 3)
-    
-    # Create map
-    platforms = create_map()
-    
-    # Projectiles list
-    projectiles = []
-    
-    # Game state
-    game_over = False
-    winner = None
-    
-    # Fonts
-    font = pygame.font.Font(None, 36)
-    small_font = pygame.font.Font(None, 24)
-    
-    running = True
-    while running:
-        clock.tick(FPS)
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+# Keys for each player
+PLAYER1_CONTROLS = {
+    'left': pygame.K_a,
+    'right': pygame.K_d,
+    'jump': pygame.K_w,
+    'attack': pygame.K_s,
+    'weapon1': pygame.K_1,
+    'weapon2': pygame.K_2,
+    'weapon3': pygame.K_3
+}
+
+PLAYER2_CONTROLS = {
+    'left': pygame.K_LEFT,
+    'right': pygame.K_RIGHT,
+    'jump': pygame.K_UP,
+    'attack': pygame.K_DOWN,
+    'weapon1': pygame.K_KP1,
+    'weapon2': pygame.K_KP2,
+    'weapon3': pygame.K_KP3
+}
+
+# Open the game window
+def open_window():
+    global screen
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("PVP Fighting Game")
+    return screen
+
+# One fight: the players, the map and the projectiles, without any drawing.
+# main() uses it with the keyboard, run_headless() with pretend keys.
+class Match:
+    def __init__(self, rng=random, platforms=None, weapons=None):
+        # Create players
+        self.player1 = Player(100, 100, BLUE, PLAYER1_CONTROLS, "Player 1")
+        self.player2 = Player(1000, 100, RED, PLAYER2_CONTROLS, "Player 2")
+        self.players = (self.player1, self.player2)
+        
+        # Give players some starting weapons (or the ones we were given)
+        if weapons is None:
+            weapons_pool = create_starter_weapons()
+            weapons = (rng.sample(weapons_pool, 3), rng.sample(weapons_pool, 3))
+        self.player1.weapons = list(weapons[0])
+        self.player2.weapons = list(weapons[1])
+        
+        # Create map
+        self.platforms = create_map() if platforms is None else platforms
+        
+        # Projectiles in flight (in no particular order - update() swap-removes).
+        # A fight only ever has a few, and a plain list beats
+        # projectiles.ProjectilePool until there are hundreds
+        # (python projectiles.py) - the pool is for the server's rooms.
+        self.projectiles = []
+        
+        # Game state
+        self.game_over = False
+        self.winner = None
+        self.frame = 0
+        
+    def key_down(self, key):
+        """A key was pressed: weapon switching and attacking"""
+        player1, player2 = self.players
+        
+        # Player 1 weapon switching
+        if key == player1.controls['weapon1']:
+            player1.switch_weapon(0)
+        elif key == player1.controls['weapon2']:
+            player1.switch_weapon(1)
+        elif key == player1.controls['weapon3']:
+            player1.switch_weapon(2)
+        # Player 1 attack
+        elif key == player1.controls['attack']:
+            weapon = player1.attack()
+            if weapon and weapon.weapon_type == 'ranged':
+                self.projectiles.append(weapon.create_projectile(player1))
+        
+        # Player 2 weapon switching (numpad)
+        if key == player2.controls['weapon1']:
+            player2.switch_weapon(0)
+        elif key == player2.controls['weapon2']:
+            player2.switch_weapon(1)
+        elif key == player2.controls['weapon3']:
+            player2.switch_weapon(2)
+        # Player 2 attack
+        elif key == player2.controls['attack']:
+            weapon = player2.attack()
+            if weapon and weapon.weapon_type == 'ranged':
+                self.projectiles.append(weapon.create_projectile(player2))
                 
-            # Weapon switching and attacking
-            if not game_over:
-                if event.type == pygame.KEYDOWN:
-                    # Player 1 weapon switching
-                    if event.key == player1.controls['weapon1']:
-                        player1.switch_weapon(0)
-                    elif event.key == player1.controls['weapon2']:
-                        player1.switch_weapon(1)
-                    elif event.key == player1.controls['weapon3']:
-                        player1.switch_weapon(2)
-                    # Player 1 attack
-                    elif event.key == player1.controls['attack']:
-                        weapon = player1.attack()
-                        if weapon and weapon.weapon_type == 'ranged':
-                            projectiles.append(weapon.create_projectile(player1))
-                    
-                    # Player 2 weapon switching (numpad)
-                    if event.key == pygame.K_KP1:
-                        player2.switch_weapon(0)
-                    elif event.key == pygame.K_KP2:
-                        player2.switch_weapon(1)
-                    elif event.key == pygame.K_KP3:
-                        player2.switch_weapon(2)
-                    # Player 2 attack
-                    elif event.key == player2.controls['attack']:
-                        weapon = player2.attack()
-                        if weapon and weapon.weapon_type == 'ranged':
-                            projectiles.append(weapon.create_projectile(player2))
-        
-        if not game_over:
-            # Get keys
-            keys = pygame.key.get_pressed()
-            
-            # Move players
-            player1.move(keys, platforms)
-            player2.move(keys, platforms)
-            
-            # Update timers
-            player1.update_timers()
-            player2.update_timers()
-            
-            # Update projectiles
-            for proj in projectiles[:]:
-                proj.update()
-                if not proj.active:
-                    projectiles.remove(proj)
-                    continue
-                    
-                # Check hits
-                if proj.check_hit(player1):
-                    player1.take_damage(proj.damage)
-                    projectiles.remove(proj)
-                elif proj.check_hit(player2):
-                    player2.take_damage(proj.damage)
-                    projectiles.remove(proj)
+    def update(self, keys):
+        """One frame of the fight. keys[key] says if a key is held down."""
+        player1, player2 = self.players
+        self.frame += 1
+        
+        # Move players
+        player1.move(keys, self.platforms)
+        player2.move(keys, self.platforms)
+        
+        # Update timers
+        player1.update_timers()
+        player2.update_timers()
+        
+        # Update projectiles. Going backwards means a gone projectile can be
+        # swapped with the last one and popped ("swap-remove") - no copy of
+        # the list and no searching it. The one swapped in was already done.
+        projectiles = self.projectiles
+        for i in range(len(projectiles) - 1, -1, -1):
+            proj = projectiles[i]
+            proj.update()
             
-            # Check melee hits
-            weapon1 = player1.get_current_weapon()
-            weapon2 = player2.get_current_weapon()
-            
-            if weapon1 and weapon1.weapon_type == 'melee':
-                if weapon1.check_hit(player1, player2):
-                    player2.take_damage(weapon1.damage)
-                    
-            if weapon2 and weapon2.weapon_type == 'melee':
-                if weapon2.check_hit(player2, player1):
-                    player1.take_damage(weapon2.damage)
-            
-            # Check for winner
-            if player1.health <= 0:
-                game_over = True
-                winner = player2.name
-            elif player2.health <= 0:
-                game_over = True
-                winner = player1.name
+            # Check hits
+            if not proj.active:
+                pass
+            elif proj.check_hit(player1):
+                player1.take_damage(proj.damage)
+            elif proj.check_hit(player2):
+                player2.take_damage(proj.damage)
+            else:
+                continue
+            projectiles[i] = projectiles[-1]
+            projectiles.pop()
         
-        # Drawing
+        # Check melee hits
+        weapon1 = player1.get_current_weapon()
+        weapon2 = player2.get_current_weapon()
+        
+        if weapon1 and weapon1.weapon_type == 'melee':
+            if weapon1.check_hit(player1, player2):
+                player2.take_damage(weapon1.damage)
+                
+        if weapon2 and weapon2.weapon_type == 'melee':
+            if weapon2.check_hit(player2, player1):
+                player1.take_damage(weapon2.damage)
+        
+        # Check for winner
+        if player1.health <= 0:
+            self.game_over = True
+            self.winner = player2.name
+        elif player2.health <= 0:
+            self.game_over = True
+            self.winner = player1.name
+            
+    def draw(self, screen, font, small_font, game_code):
+        player1, player2 = self.players
         screen.fill(LIGHT_BLUE)  # Sky background
         
         # Draw props
         draw_props(screen)
         
         # Draw platforms
-        for platform in platforms:
+        for platform in self.platforms:
             platform.draw(screen)
         
         # Draw projectiles
-        for proj in projectiles:
+        for proj in self.projectiles:
             proj.draw(screen)
         
         # Draw players
@@ -516,20 +543,54 @@ def main():
         screen.blit(controls_text, (150, SCREEN_HEIGHT - 25))
         
         # Game over screen
-        if game_over:
+        if self.game_over:
             overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
             overlay.set_alpha(128)
             overlay.fill(BLACK)
             screen.blit(overlay, (0, 0))
             
-            winner_text = font.render(f"{winner} WINS!", True, YELLOW)
+            winner_text = font.render(f"{self.winner} WINS!", True, YELLOW)
             restart_text = small_font.render("Press ESC to quit", True, WHITE)
             
             screen.blit(winner_text, (SCREEN_WIDTH//2 - winner_text.get_width()//2, 
                                      SCREEN_HEIGHT//2 - 50))
             screen.blit(restart_text, (SCREEN_WIDTH//2 - restart_text.get_width()//2, 
                                       SCREEN_HEIGHT//2 + 10))
-            
+
+# Main game function
+def main():
+    screen = open_window()
+    clock = pygame.time.Clock()
+    
+    # Generate game code
+    game_code = generate_game_code()
+    
+    match = Match()
+    
+    # Fonts
+    font = pygame.font.Font(None, 36)
+    small_font = pygame.font.Font(None, 24)
+    
+    running = True
+    while running:
+        clock.tick(FPS)
+        
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+                
+            # Weapon switching and attacking
+            if not match.game_over:
+                if event.type == pygame.KEYDOWN:
+                    match.key_down(event.key)
+        
+        if not match.game_over:
+            match.update(pygame.key.get_pressed())
+        
+        # Drawing
+        match.draw(screen, font, small_font, game_code)
+        
+        if match.game_over:
             keys = pygame.key.get_pressed()
             if keys[pygame.K_ESCAPE]:
                 running = False
@@ -539,5 +600,114 @@ def main():
     pygame.quit()
     sys.exit()
 
+# =============================================================================
+# HEADLESS MODE - no window, no drawing, no waiting for the next frame
+# =============================================================================
+# Fights are driven by "inputs": something that says, every frame, which
+# keys are held down and which were just pressed. That can be a script
+# (like random_inputs below) or a recording of an earlier fight, so the
+# same fight can be played again and checked (play_recording).
+
+# Which keys are held down, for Player.move (keys[key] -> True/False)
+class HeldKeys:
+    __slots__ = ("down",)
+
+    def __init__(self, down=()):
+        self.down = frozenset(down)
+        
+    def __getitem__(self, key):
+        return key in self.down
+
+# A pretend player who mashes buttons: every few frames they pick what
+# to hold (usually walking towards the other player), and sometimes
+# attack or switch weapons
+def random_inputs(rng, change_every=8, chase=0.7):
+    players = (PLAYER1_CONTROLS, PLAYER2_CONTROLS)
+    held = [(), ()]
+    
+    def inputs(match):
+        pressed = []
+        if match.frame % change_every == 0:
+            for number, controls in enumerate(players):
+                me, other = match.players[number], match.players[1 - number]
+                if rng.random() < chase:
+                    keys = [controls['right' if other.x > me.x else 'left']]
+                else:
+                    keys = [controls[name] for name in ('left', 'right') if rng.random() < 0.35]
+                if rng.random() < 0.3:
+                    keys.append(controls['jump'])
+                held[number] = tuple(keys)
+        for controls in players:
+            if rng.random() < 0.1:
+                pressed.append(controls['attack'])
+            if rng.random() < 0.01:
+                pressed.append(controls[rng.choice(('weapon1', 'weapon2', 'weapon3'))])
+        return held[0] + held[1], pressed
+    return inputs
+
+# Inputs from a recording: [(held keys, pressed keys), ...] one per frame
+def play_recording(recording):
+    frames = iter(recording)
+    
+    def inputs(match):
+        return next(frames, ((), ()))
+    return inputs
+
+def run_headless(inputs, seed=None, max_frames=60 * FPS, record=False,
+                 platforms=None, weapons=None):
+    """Play one fight as fast as possible.
+
+    Returns (winner or None for a draw, frames played, recording or None).
+    """
+    match = Match(random.Random(seed), platforms, weapons)
+    recording = [] if record else None
+    while not match.game_over and match.frame < max_frames:
+        held, pressed = inputs(match)
+        if recording is not None:
+            recording.append((tuple(held), tuple(pressed)))
+        for key in pressed:
+            match.key_down(key)
+        match.update(HeldKeys(held))
+    return match.winner, match.frame, recording
+
+# Simulate lots of fights and report how fast it went:
+#   python pvp_fighting_game_1.py --headless [matches] [seed]
+def headless_main(args):
+    matches = int(args[0]) if args else 1000
+    seed = int(args[1]) if len(args) > 1 else 1
+    rng = random.Random(seed)
+    
+    wins = {}
+    frames = 0
+    first = None
+    start = time.perf_counter()
+    for number in range(matches):
+        winner, played, recording = run_headless(random_inputs(rng), seed + number,
+                                                 record=number == 0)
+        wins[winner or "Draw"] = wins.get(winner or "Draw", 0) + 1
+        frames += played
+        if recording is not None:
+            first = (winner, played, recording)
+    elapsed = time.perf_counter() - start
+    
+    print("=" * 50)
+    print("  HEADLESS SIMULATION")
+    print("=" * 50)
+    print(f"  Matches: {matches:,} in {elapsed:.2f}s ({matches / elapsed:,.0f} matches/sec)")
+    print(f"  Frames:  {frames:,} ({frames / elapsed:,.0f} simulated FPS, "
+          f"{frames / elapsed / FPS:,.0f}x real time)")
+    print(f"  Average match: {frames / matches / FPS:.1f}s of game time")
+    for name, count in sorted(wins.items()):
+        print(f"  {name}: {count:,} ({count / matches:.0%})")
+    
+    # Regression check: playing the first fight's recording again must
+    # give exactly the same result
+    winner, played, recording = first
+    replayed = run_headless(play_recording(recording), seed)[:2]
+    print(f"  Replay of match 1: {'same result' if replayed == (winner, played) else 'DIFFERENT!'}")
+
 if __name__ == "__main__":
-    main()
+    if "--headless" in sys.argv:
+        headless_main([arg for arg in sys.argv[1:] if arg != "--headless"])
+    else:
+        main()
@@ -0,0 +1,343 @@
+# Reference Client for Mina's PVP Fighting Game
+#
+# A Python version of what a browser should do with the sequence numbers
+# and acks from input_sync.py, for the server-authoritative mode (where
+# the server runs the fight and sends snapshots):
+#
+# 1. PREDICT: when a button changes, send it as an 'input' with the next
+#    sequence number - and move our own player straight away with the
+#    same physics the server uses (simulation.SimPlayer), instead of
+#    waiting a whole round trip to see it happen.
+#
+# 2. RECONCILE: every snapshot says the last input the server has used
+#    (acks = {player: [seq, tick it was first used on]}). Our player in
+#    the snapshot is where the server had us at that moment, so:
+#      - jump back to the server's position
+#      - play our own frames since then again, with the buttons we held
+#    If the server used our inputs on the same frames we did, we end up
+#    exactly where we already were. If lag jitter made an input count a
+#    frame early or late, we get nudged (a "correction"). We don't jump
+#    there on screen: the drawing slides a quarter of the way each frame,
+#    like applyCorrection() in multiplayer_game.html.
+#
+# Running it (python reference_client.py) plays bot-vs-bot fights over a
+# made-up network with 100-200 ms round trips and jitter, with the real
+# RoomSimulation as the server, and measures how long an input takes to
+# show up on screen with and without prediction, and how big the
+# corrections are.
+#
+#   python reference_client.py [RTT_MIN_MS RTT_MAX_MS JITTER_MS [SECONDS]]
+
+import copy
+import heapq
+import json
+import math
+import random
+import sys
+
+from game_data import MAPS
+from input_sync import SEQ_MODULO, seq_newer
+from simulation import (
+    EMPTY_INPUT,
+    SPAWN_POSITIONS,
+    TICK_RATE,
+    TICK_SECONDS,
+    RoomSimulation,
+    SimPlayer,
+    platforms_for_map,
+)
+
+
+SNAPSHOT_EVERY_TICKS = 3    # Same as app.py
+HISTORY_FRAMES = 240        # Frames of held buttons kept for replaying (4 seconds)
+VISIBLE_CORRECTION = 1.0    # Corrections smaller than a pixel can't be seen
+CORRECTION_SLIDE = 0.25     # Share of a correction drawn each frame (like multiplayer_game.html)
+
+
+# =============================================================================
+# THE CLIENT
+# =============================================================================
+
+class ReferenceClient:
+    """One player's browser: sends numbered inputs, predicts, reconciles"""
+
+    def __init__(self, number, map_data, predict=True):
+        self.number = number
+        self.predict = predict
+        self.platforms = platforms_for_map(map_data)
+        x, y = SPAWN_POSITIONS[number]
+        self.player = SimPlayer(number, x, y)
+        self.shown = (float(x), float(y))   # Where our player is drawn
+        self.offset = (0.0, 0.0)   # How far the drawing still is from the player (sliding)
+
+        self.frame = 0
+        self.held = dict(EMPTY_INPUT)
+        self.seq = 0
+        self.acked = None          # [seq, tick] from the last snapshot
+        self.acked_frame = None    # The frame we pressed that input on
+        self.history = {}          # frame -> buttons held on that frame
+        self.sent = {}             # seq -> (frame it was pressed on, time sent)
+
+        # Measurements
+        self.ack_delays = []       # Seconds from sending an input to its ack
+        self.input_frames = []     # Frames from pressing to our player moving differently
+        self.corrections = []      # Pixels each snapshot moved our prediction
+        self.slide_steps = []      # Pixels the drawing moved in one frame to catch up
+        # Our player as it would be without the newest input (see run_frame)
+        self.without_input = None
+        self.without_held = None
+        self.without_frames = 0
+        self.first_correction = None
+        self.replayed_frames = 0
+
+    def press(self, buttons, now):
+        """New buttons held from this frame on. Returns the 'input'
+        message to send (the same shape a browser sends)."""
+        self.seq = (self.seq + 1) % SEQ_MODULO
+        if self.predict:
+            self.without_input = copy.copy(self.player)
+            self.without_held = self.held
+            self.without_frames = 0
+        self.held = dict(buttons)
+        self.sent[self.seq] = (self.frame, now)
+        return {"action": "input", "action_data": dict(buttons), "seq": self.seq}
+
+    def run_frame(self):
+        """One frame (60 a second, like the server's ticks)"""
+        self.history[self.frame] = self.held
+        self.history.pop(self.frame - HISTORY_FRAMES, None)
+        if self.predict:
+            player = self.player
+            player.move(self.held, self.platforms)
+            self.check_input_shown()
+            # Slide the drawing towards where a correction put us
+            offset_x, offset_y = self.offset
+            if offset_x or offset_y:
+                step_x = offset_x * CORRECTION_SLIDE
+                step_y = offset_y * CORRECTION_SLIDE
+                if abs(offset_x - step_x) < 0.5 and abs(offset_y - step_y) < 0.5:
+                    step_x, step_y = offset_x, offset_y
+                self.offset = (offset_x - step_x, offset_y - step_y)
+                self.slide_steps.append(math.hypot(step_x, step_y))
+            self.shown = (player.x + self.offset[0], player.y + self.offset[1])
+        self.frame += 1
+
+    def check_input_shown(self):
+        """Move the no-new-input copy of our player along too. The first
+        frame the two are in different places is when the input showed."""
+        without = self.without_input
+        if without is None:
+            return
+        without.move(self.without_held, self.platforms)
+        if without.x != self.player.x or without.y != self.player.y:
+            self.input_frames.append(self.without_frames)
+            self.without_input = None
+        else:
+            self.without_frames += 1
+            if self.without_frames >= TICK_RATE:
+                # A jump in mid-air, say - it never changed where we are
+                self.without_input = None
+
+    def on_snapshot(self, snapshot, now):
+        ack = (snapshot.get("acks") or {}).get(str(self.number))
+        me = next(p for p in snapshot["players"] if p["number"] == self.number)
+        if not self.predict:
+            self.shown = (me["x"], me["y"])
+        if ack is None:
+            return
+        seq, used_tick = ack
+        if self.acked is None or seq_newer(seq, self.acked[0]):
+            sent = self.sent.get(seq)
+            if sent is not None:
+                self.ack_delays.append(now - sent[1])
+            # Everything up to this one has arrived
+            for old in [s for s in self.sent if not seq_newer(s, seq)]:
+                del self.sent[old]
+            self.acked_frame = sent[0] if sent is not None else None
+        self.acked = ack
+        if self.predict and self.acked_frame is not None:
+            self.reconcile(me, snapshot["tick"] - used_tick)
+
+    def reconcile(self, me, ticks_since_used):
+        """Go back to where the server had us and replay our own frames"""
+        # The server had used our input for ticks_since_used + 1 ticks.
+        # We pressed it on frame acked_frame, so that's our frame:
+        done = self.acked_frame + ticks_since_used
+        if done >= self.frame:
+            return
+        before = (self.player.x, self.player.y)
+        player = self.player
+        # The no-new-input copy didn't get corrected, so it can't be compared any more
+        self.without_input = None
+        player.x = me["x"]
+        player.y = me["y"]
+        player.vel_x = me["vel_x"]
+        player.vel_y = me["vel_y"]
+        player.on_ground = me["on_ground"]
+        player.facing_right = me["facing_right"]
+        for frame in range(done + 1, self.frame):
+            player.move(self.history.get(frame, EMPTY_INPUT), self.platforms)
+            self.replayed_frames += 1
+        moved = math.hypot(player.x - before[0], player.y - before[1])
+        if self.first_correction is None:
+            # Our first input took half a round trip to get there, and the
+            # server kept the fight going meanwhile (we were still falling
+            # from the spawn point) - this one lines us up with the server
+            self.first_correction = moved
+            self.shown = (player.x, player.y)
+        else:
+            self.corrections.append(moved)
+            # Keep drawing where we were, then slide over (see run_frame)
+            self.offset = (self.shown[0] - player.x, self.shown[1] - player.y)
+
+
+# =============================================================================
+# A MADE-UP NETWORK
+# =============================================================================
+
+class SimulatedLink:
+    """One direction of one connection. Socket.IO runs over TCP, so
+    messages can be late (jitter) but never overtake each other."""
+
+    def __init__(self, rng, one_way, jitter):
+        self.rng = rng
+        self.one_way = one_way
+        self.jitter = jitter
+        self.last = 0.0
+
+    def arrival(self, now):
+        arrives = now + self.one_way + abs(self.rng.gauss(0, self.jitter))
+        if arrives < self.last:
+            arrives = self.last
+        self.last = arrives
+        return arrives
+
+
+def bot_buttons(rng, held):
+    """Now and then a bot lets go of everything and picks new buttons"""
+    if rng.random() > 1 / 20:
+        return None
+    direction = rng.choice(("left", "right", None))
+    buttons = dict(EMPTY_INPUT)
+    if direction:
+        buttons[direction] = True
+    buttons["jump"] = rng.random() < 0.3
+    return buttons if buttons != held else None
+
+
+def play(rng, rtt_range, jitter, seconds, predict=True, map_data=None):
+    """One bot-vs-bot fight against the real RoomSimulation.
+    Returns both clients (with their measurements)."""
+    map_data = map_data or rng.choice(MAPS)
+    room = RoomSimulation("REF", map_data)
+    clients = {number: ReferenceClient(number, map_data, predict) for number in (1, 2)}
+    up = {}
+    down = {}
+    for number in clients:
+        rtt = rng.uniform(*rtt_range)
+        up[number] = SimulatedLink(rng, rtt / 2, jitter)
+        down[number] = SimulatedLink(rng, rtt / 2, jitter)
+
+    # (time, order, kind, ...) - order keeps events at the same time in
+    # the order they were added
+    events = []
+    order = 0
+
+    def add(when, *event):
+        nonlocal order
+        order += 1
+        heapq.heappush(events, (when, order) + event)
+
+    for tick in range(1, int(seconds * TICK_RATE) + 1):
+        add(tick * TICK_SECONDS, "tick")
+    for number in clients:
+        # Browsers' frames don't line up with the server's ticks
+        phase = rng.random() * TICK_SECONDS
+        for frame in range(int(seconds * TICK_RATE)):
+            add(frame * TICK_SECONDS + phase, "frame", number)
+
+    while events:
+        now, _, kind, *rest = heapq.heappop(events)
+        if kind == "tick":
+            room.step()
+            if room.tick % SNAPSHOT_EVERY_TICKS == 0:
+                # Through JSON, like the real thing (so player numbers
+                # in "acks" become strings)
+                text = json.dumps(room.snapshot())
+                for number in clients:
+                    add(down[number].arrival(now), "snapshot", number, text)
+        elif kind == "frame":
+            client = clients[rest[0]]
+            buttons = bot_buttons(rng, client.held)
+            if buttons is not None:
+                message = client.press(buttons, now)
+                add(up[client.number].arrival(now), "input", client.number, message)
+            client.run_frame()
+        elif kind == "input":
+            number, message = rest
+            room.set_input(number, message["action_data"], message["seq"])
+        elif kind == "snapshot":
+            number, text = rest
+            clients[number].on_snapshot(json.loads(text), now)
+    return clients
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def measure(rtt_range, jitter, seconds=30, matches=10, seed=22):
+    """Prediction on and off, same fights. Prints one block of results."""
+    results = {}
+    for predict in (False, True):
+        rng = random.Random(seed)
+        delays = []
+        input_frames = []
+        corrections = []
+        steps = []
+        replayed = 0
+        for _ in range(matches):
+            for client in play(rng, rtt_range, jitter, seconds, predict).values():
+                delays.extend(client.ack_delays)
+                input_frames.extend(client.input_frames)
+                corrections.extend(client.corrections)
+                steps.extend(client.slide_steps)
+                replayed += client.replayed_frames
+        results[predict] = (delays, input_frames, corrections, steps, replayed)
+
+    delays = results[False][0]
+    # Without prediction you only see an input once a snapshot that has
+    # used it arrives - then it's drawn on the next frame
+    shown = [delay + TICK_SECONDS / 2 for delay in delays]
+    # With it, the frame the predicted player first moves differently
+    _, input_frames, corrections, steps, replayed = results[True]
+    predicted = [frames * TICK_SECONDS for frames in input_frames]
+    visible = [c for c in corrections if c > VISIBLE_CORRECTION]
+    print(f"  RTT {rtt_range[0] * 1000:.0f}-{rtt_range[1] * 1000:.0f} ms, "
+          f"jitter {jitter * 1000:.0f} ms ({matches} fights x {seconds}s, {len(delays):,} inputs)")
+    print(f"    Without prediction: input shows after {sum(shown) / len(shown) * 1000:4.0f} ms "
+          f"(95% within {percentile(shown, 0.95) * 1000:.0f} ms)")
+    print(f"    With prediction:    input shows after {sum(predicted) / len(predicted) * 1000:4.0f} ms "
+          f"(95% within {percentile(predicted, 0.95) * 1000:.0f} ms, "
+          f"{len(predicted):,} inputs that moved us)")
+    print(f"      {len(visible) / len(corrections):5.1%} of snapshots nudged us by more than "
+          f"{VISIBLE_CORRECTION:g} px (average {sum(visible) / len(visible) if visible else 0:.1f} px, "
+          f"biggest {max(corrections, default=0):.1f} px)")
+    print(f"      sliding there, the drawing moves at most {max(steps, default=0):.1f} px "
+          f"in one frame to catch up")
+    print(f"      {replayed / len(corrections):.1f} frames replayed per snapshot "
+          f"(after the first one, which lines us up with the server)")
+
+
+if __name__ == "__main__":
+    print("=" * 72)
+    print("  INPUT LATENCY - reference client vs the real simulation")
+    print("=" * 72)
+    if len(sys.argv) >= 4:
+        rtt_range = (float(sys.argv[1]) / 1000, float(sys.argv[2]) / 1000)
+        seconds = int(sys.argv[4]) if len(sys.argv) > 4 else 30
+        measure(rtt_range, float(sys.argv[3]) / 1000, seconds)
+    else:
+        for jitter in (0.0, 0.01, 0.03):
+            measure((0.1, 0.2), jitter)
@@ -0,0 +1,372 @@
+# Match Replay for Mina's PVP Fighting Game
+#
+# Plays a room's log (see match_recorder.py) again, without any graphics
+# and as fast as the computer can go:
+#
+#   python replay.py                          benchmark with a made-up match
+#   python replay.py LOG                      every match in the log, checked
+#   python replay.py LOG MATCH TICK           what match MATCH looked like at TICK
+#
+# - Browser-run fights: the replay follows what each browser said
+#   ('move' positions and HP, 'damage', cubes, hazards) and works out who
+#   really hit 0 HP first.
+# - Server-run fights (SERVER_AUTHORITATIVE): the replay runs the same
+#   RoomSimulation again with the recorded inputs, fed in on the same
+#   simulation ticks, and checks it ends with the same winner.
+#
+# Jumping to a tick near the end of a long match would mean replaying
+# everything before it. So while a match is replayed, a KEYFRAME (a full
+# copy of the replay state) is saved every KEYFRAME_TICKS ticks. Seeking
+# starts from the nearest keyframe before the tick instead of from the
+# start of the match.
+
+import copy
+import sys
+import time
+from bisect import bisect_right
+
+from game_data import MAPS, WEAPON_CATALOG
+from match_recorder import SERVER, decode_data, read_log
+from net_protocol import SnapshotDecoder, ProtocolError
+from simulation import TICK_RATE, RoomSimulation
+
+
+KEYFRAME_TICKS = 2 * TICK_RATE   # A keyframe every 2 seconds of match time
+
+
+def map_named(name):
+    for map_data in MAPS:
+        if map_data["name"] == name:
+            return map_data
+    return MAPS[0]
+
+
+class ReplayState:
+    """Everything we know about a match at one tick"""
+
+    def __init__(self):
+        self.tick = 0
+        self.events = 0
+        self.start = None            # The game_start data
+        self.players = {}            # player number -> last 'move' state it sent
+        self.damage_claimed = {1: 0, 2: 0}   # Damage each player said they did
+        self.knocked_out = None      # First player whose HP reached 0
+        self.cubes = None
+        self.hazards = {}            # hazard id -> what was spawned
+        self.purchases = []
+        self.sim = None              # RoomSimulation, for server-run fights
+        self.sim_offset = 0          # Log tick - simulation tick (from the last event that had both)
+        self.decoders = {}           # player number -> SnapshotDecoder (binary moves)
+        self.claimed_winner = None   # What game_over said
+        self.desync = None           # The server's desync report (see desync.py)
+        self.finished = False
+
+    # -------------------------------------------------------------------------
+    # Events
+    # -------------------------------------------------------------------------
+
+    def apply(self, line):
+        tick, player, event, data = line[:4]
+        sim_tick = line[4] if len(line) > 4 else None
+        if sim_tick is not None and self.sim is not None:
+            # The simulation was exactly here when the server got this event
+            self._step_sim_to(sim_tick)
+            self.sim_offset = tick - sim_tick
+        if tick > self.tick:
+            self.tick = tick
+        self.events += 1
+        handler = getattr(self, "_on_" + event, None)
+        if handler is not None:
+            handler(player, decode_data(data), sim_tick)
+
+    def _on_game_start(self, player, data, sim_tick):
+        self.start = data
+
+    def _on_simulation(self, player, data, sim_tick):
+        weapons = {int(number): [WEAPON_CATALOG.get(weapon_id) for weapon_id in ids]
+                   for number, ids in data["weapons"].items()}
+        # Logs from before the server ran hazards have no hazard_seed (and no hazards)
+        self.sim = RoomSimulation(data.get("room", ""), map_named(data["map"]), weapons,
+                                  data.get("hazard_seed"))
+        self.sim_offset = self.tick - (sim_tick or 0)
+
+    def _on_input(self, player, data, sim_tick):
+        if self.sim is not None:
+            self.sim.set_input(player, data)
+
+    def _on_move(self, player, data, sim_tick):
+        if isinstance(data, (bytes, bytearray)):
+            decoder = self.decoders.setdefault(player, SnapshotDecoder())
+            try:
+                _, data = decoder.decode(data)
+            except ProtocolError:
+                return
+        self.players[player] = data
+        if self.knocked_out is None and data.get("hp", 1) <= 0:
+            self.knocked_out = player
+
+    def _on_damage(self, player, data, sim_tick):
+        if player in self.damage_claimed:
+            self.damage_claimed[player] += data.get("damage", 0)
+
+    def _on_cubes(self, player, data, sim_tick):
+        self.cubes = data.get("states")
+
+    def _on_hazard(self, player, data, sim_tick):
+        if data.get("type") == "icicles":
+            for icicle in data.get("icicles", ()):
+                self.hazards[("icicle", icicle.get("id"))] = icicle
+        else:
+            self.hazards[(data.get("type"), data.get("id"))] = data
+
+    def _on_hazard_remove(self, player, data, sim_tick):
+        self.hazards.pop((data.get("type"), data.get("id")), None)
+
+    def _on_buy_item(self, player, data, sim_tick):
+        self.purchases.append((player, data))
+
+    def _on_desync(self, player, data, sim_tick):
+        self.desync = data
+
+    def _on_game_over(self, player, data, sim_tick):
+        self.claimed_winner = data.get("winner")
+        self.finished = True
+
+    # -------------------------------------------------------------------------
+    # Time
+    # -------------------------------------------------------------------------
+
+    def advance(self, tick, sim_limit=None):
+        """Move the clock forward to a tick between events.
+
+        The simulation goes along with it, but never past sim_limit (the
+        simulation tick of the next event) - the server can drop ticks
+        when it's busy, so the log clock and the simulation can drift.
+        """
+        if tick <= self.tick:
+            return
+        self.tick = tick
+        if self.sim is not None and not self.finished:
+            target = tick - self.sim_offset
+            self._step_sim_to(target if sim_limit is None else min(target, sim_limit))
+
+    def _step_sim_to(self, sim_tick):
+        sim = self.sim
+        while sim.tick < sim_tick and sim.winner is None:
+            sim.step()
+
+    @property
+    def winner(self):
+        """Who the replay says won (None if nobody has yet)"""
+        if self.sim is not None:
+            return self.sim.winner
+        if self.knocked_out is not None:
+            return 2 if self.knocked_out == 1 else 1
+        return None
+
+    def summary(self):
+        result = {
+            "tick": self.tick,
+            "seconds": round(self.tick / TICK_RATE, 2),
+            "events": self.events,
+            "map": (self.start or {}).get("map"),
+            "claimed_winner": self.claimed_winner,
+            "replayed_winner": self.winner,
+            "damage_claimed": dict(self.damage_claimed),
+            "hazards_active": len(self.hazards),
+            "desync_tick": self.desync["tick"] if self.desync else None,
+        }
+        if self.sim is not None:
+            result["players"] = [player.snapshot() for player in self.sim.players.values()]
+        else:
+            result["players"] = [{"number": number, **state}
+                                 for number, state in sorted(self.players.items())]
+        return result
+
+
+class MatchReplay:
+    """One match from a room's log, with keyframes for seeking"""
+
+    def __init__(self, header, events, keyframe_ticks=KEYFRAME_TICKS):
+        self.header = header
+        self.events = events
+        self.keyframe_ticks = keyframe_ticks
+        self.keyframes = []      # (tick, next event index, state)
+        self.keyframe_ticks_list = []
+        self.final = None
+
+        # For each event: the simulation tick of the next event that has
+        # one (how far the simulation may run before that event)
+        self.sim_limits = [None] * (len(events) + 1)
+        for index in range(len(events) - 1, -1, -1):
+            line = events[index]
+            self.sim_limits[index] = line[4] if len(line) > 4 else self.sim_limits[index + 1]
+
+    @property
+    def start_tick(self):
+        return self.events[0][0] if self.events else 0
+
+    @property
+    def end_tick(self):
+        return self.events[-1][0] if self.events else 0
+
+    def run(self):
+        """Replay the whole match, saving keyframes on the way"""
+        state = ReplayState()
+        state.tick = self.start_tick
+        self.keyframes = []
+        next_keyframe = self.start_tick
+        for index, line in enumerate(self.events):
+            while line[0] >= next_keyframe:
+                state.advance(next_keyframe, self.sim_limits[index])
+                self.keyframes.append((next_keyframe, index, copy.deepcopy(state)))
+                next_keyframe += self.keyframe_ticks
+            state.apply(line)
+        self.keyframe_ticks_list = [keyframe[0] for keyframe in self.keyframes]
+        self.final = state
+        return state
+
+    def seek(self, tick, use_keyframes=True):
+        """The state at `tick` (starting from the nearest keyframe)"""
+        if self.final is None:
+            self.run()
+        state = None
+        index = 0
+        if use_keyframes and self.keyframes:
+            position = bisect_right(self.keyframe_ticks_list, tick) - 1
+            if position >= 0:
+                _, index, saved = self.keyframes[position]
+                state = copy.deepcopy(saved)
+        if state is None:
+            state = ReplayState()
+            state.tick = self.start_tick
+        while index < len(self.events) and self.events[index][0] <= tick:
+            state.apply(self.events[index])
+            index += 1
+        state.advance(tick, self.sim_limits[index])
+        return state
+
+
+def load_matches(path):
+    """(header, [MatchReplay for each game_start ... game_over in the log])"""
+    header, events = read_log(path)
+    # Events from different handler threads can land slightly out of order
+    events.sort(key=lambda line: line[0])
+    matches = []
+    current = None
+    for line in events:
+        if line[2] == "game_start":
+            current = []
+            matches.append(current)
+        if current is not None:
+            current.append(line)
+        if line[2] == "game_over":
+            current = None
+    return header, [MatchReplay(header, match) for match in matches]
+
+
+# =============================================================================
+# BENCHMARK - a made-up server-run match
+# =============================================================================
+
+def write_fake_log(path, seed=7, max_seconds=120, code="BENCH1"):
+    """A log like the server writes for a SERVER_AUTHORITATIVE match:
+    buttons that mostly chase the other player, and now and then a few
+    dropped server ticks. Returns the real winner."""
+    import json
+    import random
+
+    rng = random.Random(seed)
+    weapons = {1: [WEAPON_CATALOG.get("t1-sword")], 2: [WEAPON_CATALOG.get("t1-bow")]}
+    map_data = MAPS[0]
+    sim = RoomSimulation(code, map_data, weapons, seed)
+    offset = 30   # Log tick - simulation tick
+    lines = [[0, SERVER, "game_start", {"map": map_data["name"], "hazard_seed": seed}],
+             [offset, SERVER, "simulation",
+              {"room": code, "map": map_data["name"],
+               "weapons": {n: [w["id"] for w in ws] for n, ws in weapons.items()},
+               "hazard_seed": seed}, 0]]
+    while sim.winner is None and sim.tick < max_seconds * TICK_RATE:
+        for number in (1, 2):
+            if rng.random() < 0.15:
+                me, other = sim.players[number], sim.players[3 - number]
+                chase = rng.random() < 0.7
+                buttons = {"left": me.x > other.x if chase else rng.random() < 0.5,
+                           "right": me.x < other.x if chase else rng.random() < 0.5,
+                           "jump": other.y < me.y - 20 or rng.random() < 0.1,
+                           "attack": rng.random() < 0.5}
+                lines.append([offset + sim.tick, number, "input", buttons, sim.tick])
+                sim.set_input(number, buttons)
+        if rng.random() < 0.01:
+            offset += rng.randint(1, 5)   # The server was busy and skipped some ticks
+        sim.step()
+    lines.append([offset + sim.tick, SERVER, "game_over",
+                  {"winner": sim.winner, "claimed": sim.winner}, sim.tick])
+    with open(path, "w") as f:
+        f.write(json.dumps({"room": code, "seed": seed, "tick_rate": TICK_RATE}) + "\n")
+        for line in lines:
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+    return sim.winner
+
+
+def _benchmark():
+    import os
+    import random
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.jsonl")
+    winner = write_fake_log(path)
+    _, matches = load_matches(path)
+    match = matches[0]
+
+    start = time.perf_counter()
+    final = match.run()
+    elapsed = time.perf_counter() - start
+    match_seconds = (match.end_tick - match.start_tick) / TICK_RATE
+
+    print("=" * 50)
+    print(f"  REPLAY BENCHMARK ({match_seconds:.0f} s match, {len(match.events):,} events)")
+    print("=" * 50)
+    print(f"  Full replay: {elapsed * 1000:7.1f} ms = {match_seconds / elapsed:,.0f}x real time")
+    print(f"  Winner: recorded {winner}, replayed {final.winner} "
+          f"({'same' if winner == final.winner else 'DIFFERENT'})")
+
+    rng = random.Random(1)
+    ticks = [rng.randint(match.start_tick, match.end_tick) for _ in range(20)]
+    for use_keyframes in (False, True):
+        start = time.perf_counter()
+        states = [match.seek(tick, use_keyframes).summary() for tick in ticks]
+        elapsed = (time.perf_counter() - start) / len(ticks)
+        label = f"with {len(match.keyframes)} keyframes" if use_keyframes else "from the start"
+        print(f"  Seek {label + ':':<22} {elapsed * 1000:7.2f} ms per seek")
+        if use_keyframes:
+            same = states == without
+            print(f"  Same state both ways: {'yes' if same else 'NO'}")
+        without = states
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        _benchmark()
+        raise SystemExit
+
+    header, matches = load_matches(sys.argv[1])
+    print(f"Room {header.get('room')} (seed {header.get('seed')}): {len(matches)} matches")
+    if len(sys.argv) > 3:
+        match = matches[int(sys.argv[2])]
+        state = match.seek(int(sys.argv[3]))
+        for key, value in state.summary().items():
+            print(f"  {key}: {value}")
+        raise SystemExit
+
+    for number, match in enumerate(matches):
+        final = match.run()
+        verdict = ("unfinished" if not final.finished
+                   else "OK" if final.claimed_winner == final.winner
+                   else "can't tell (nobody reached 0 HP)" if final.winner is None
+                   else "MISMATCH")
+        print(f"  match {number}: {final.summary()['map']}, "
+              f"ticks {match.start_tick}-{match.end_tick}, "
+              f"winner claimed {final.claimed_winner} / replayed {final.winner}  {verdict}"
+              + (f"  (screens desynced at hash tick {final.desync['tick']})" if final.desync else ""))
@@ -0,0 +1,317 @@
+# Room Backends for Mina's PVP Fighting Game
+#
+# All room state lives in the server process's memory (room_store.py),
+# which is why render.yaml only runs one gunicorn worker. A backend
+# decides where rooms live and how Socket.IO messages get to everyone:
+#
+#   memory - one worker, everything in this process (the default)
+#   broker - several workers on one machine. A tiny broker process passes
+#            Socket.IO messages between them, and every room code belongs
+#            to exactly one worker (worker_for), so a room's handlers
+#            always run where its state is.
+#
+# Running several workers:
+#
+#   python room_backend.py serve 4     (broker + workers on ports 5050-5053)
+#
+# and put a proxy in front that sends each request to the worker named
+# in its ?worker= parameter, and anything without one to any worker.
+# For example with nginx:
+#
+#   upstream pvp_any { server 127.0.0.1:5050; server 127.0.0.1:5051; ... }
+#   map $arg_worker $pvp_upstream {
+#       default pvp_any;
+#       0 127.0.0.1:5050;
+#       1 127.0.0.1:5051;
+#       ...
+#   }
+#   location / { proxy_pass http://$pvp_upstream; (plus the websocket headers) }
+#
+# The lobby asks /route which worker it landed on and sticks to it. When a
+# player joins a code that lives on another worker, the server replies
+# 'wrong_worker' and the browser reconnects with ?worker= set to the owner.
+# The battle page URL carries &worker= too, so rejoin_game lands there.
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import socketio
+
+from room_store import RoomStore, shard_for
+
+
+BACKEND_MEMORY = "memory"
+BACKEND_BROKER = "broker"
+BACKENDS = (BACKEND_MEMORY, BACKEND_BROKER)
+
+DEFAULT_BROKER_ADDRESS = ("127.0.0.1", 5099)
+DEFAULT_PORT = 5050
+
+# First line a worker sends the broker on a new connection
+ROLE_PUBLISH = b"publish\n"
+ROLE_LISTEN = b"listen\n"
+
+
+def worker_for(code, num_workers):
+    """Which worker owns a room code (the same answer in every process)"""
+    return shard_for(code, num_workers)
+
+
+# =============================================================================
+# BACKENDS
+# =============================================================================
+
+class InMemoryBackend:
+    """One worker: rooms and Socket.IO messages stay in this process"""
+
+    name = BACKEND_MEMORY
+
+    def __init__(self):
+        self.worker_id = 0
+        self.num_workers = 1
+        self.rooms = RoomStore()
+        self.client_manager = None   # Socket.IO's normal in-process manager
+
+    def owns(self, code):
+        """Does this worker hold the room's state?"""
+        return True
+
+    def owner(self, code):
+        return self.worker_id
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "worker": self.worker_id,
+            "workers": self.num_workers,
+        }
+
+
+class LocalBrokerBackend(InMemoryBackend):
+    """One of several workers on this machine, joined up by a broker process.
+
+    Each worker keeps the rooms it owns in its own RoomStore. Socket.IO
+    emits go through the broker, so an emit from any worker reaches
+    sockets connected to every worker.
+    """
+
+    name = BACKEND_BROKER
+
+    def __init__(self, worker_id, num_workers, address=DEFAULT_BROKER_ADDRESS):
+        super().__init__()
+        if not 0 <= worker_id < num_workers:
+            raise ValueError(f"worker id {worker_id} is not in 0-{num_workers - 1}")
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.address = address
+        self.client_manager = BrokerManager(address)
+
+    def owns(self, code):
+        return worker_for(code, self.num_workers) == self.worker_id
+
+    def owner(self, code):
+        return worker_for(code, self.num_workers)
+
+    def stats(self):
+        stats = super().stats()
+        stats["broker"] = f"{self.address[0]}:{self.address[1]}"
+        stats["published"] = self.client_manager.published
+        return stats
+
+
+def parse_address(text):
+    """'host:port' -> (host, port)"""
+    host, _, port = text.rpartition(":")
+    return host or DEFAULT_BROKER_ADDRESS[0], int(port)
+
+
+def get_backend():
+    """The backend picked by environment variables.
+
+    ROOM_BACKEND    memory (default) or broker
+    WORKER_ID       this worker's number, from 0        (broker only)
+    NUM_WORKERS     how many workers there are          (broker only)
+    BROKER_ADDRESS  host:port of the broker process     (broker only)
+    """
+    name = os.environ.get("ROOM_BACKEND", BACKEND_MEMORY)
+    if name == BACKEND_MEMORY:
+        return InMemoryBackend()
+    if name == BACKEND_BROKER:
+        address = os.environ.get("BROKER_ADDRESS")
+        return LocalBrokerBackend(
+            int(os.environ.get("WORKER_ID", "0")),
+            int(os.environ.get("NUM_WORKERS", "1")),
+            parse_address(address) if address else DEFAULT_BROKER_ADDRESS,
+        )
+    raise ValueError(f"ROOM_BACKEND must be one of {', '.join(BACKENDS)}, not {name!r}")
+
+
+# =============================================================================
+# BROKER - passes Socket.IO messages between workers
+# =============================================================================
+# Messages are one JSON object per line. A worker opens two connections:
+# one it publishes on, and one the broker sends everyone's messages to.
+# (Socket.IO ignores messages that came from its own worker.)
+
+class BrokerManager(socketio.PubSubManager):
+    """Socket.IO client manager that talks to the local broker"""
+
+    name = "localbroker"
+
+    def __init__(self, address=DEFAULT_BROKER_ADDRESS, channel="socketio",
+                 write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = address
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self.published = 0
+
+    def _connect(self, role):
+        conn = socket.create_connection(self.address)
+        conn.sendall(role)
+        return conn
+
+    def _publish(self, data):
+        line = json.dumps(data).encode() + b"\n"
+        with self._publish_lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = self._connect(ROLE_PUBLISH)
+                self._publisher.sendall(line)
+            except OSError:
+                # Broker restarted? Reconnect once and try again
+                self._publisher = self._connect(ROLE_PUBLISH)
+                self._publisher.sendall(line)
+            self.published += 1
+
+    def _listen(self):
+        conn = self._connect(ROLE_LISTEN)
+        with conn.makefile("rb") as lines:
+            for line in lines:
+                yield json.loads(line)
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker = self.server
+        role = self.rfile.readline()
+        if role == ROLE_LISTEN:
+            with broker.lock:
+                broker.listeners.append(self.wfile)
+            # Keep the connection open until the worker goes away
+            self.rfile.read()
+            with broker.lock:
+                if self.wfile in broker.listeners:
+                    broker.listeners.remove(self.wfile)
+        elif role == ROLE_PUBLISH:
+            for line in self.rfile:
+                with broker.lock:
+                    broker.messages += 1
+                    for listener in list(broker.listeners):
+                        try:
+                            listener.write(line)
+                            listener.flush()
+                        except OSError:
+                            broker.listeners.remove(listener)
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    """Sends every published message to every listening worker"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=DEFAULT_BROKER_ADDRESS):
+        super().__init__(address, _BrokerHandler)
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.messages = 0
+
+
+def run_broker(address=DEFAULT_BROKER_ADDRESS):
+    print(f"Room broker listening on {address[0]}:{address[1]}")
+    with Broker(address) as broker:
+        broker.serve_forever()
+
+
+# =============================================================================
+# LAUNCHER
+# =============================================================================
+
+def serve(num_workers, port=DEFAULT_PORT, address=DEFAULT_BROKER_ADDRESS):
+    """Start the broker and num_workers copies of app.py on port, port + 1..."""
+    import subprocess
+    import sys
+    import time
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    broker = subprocess.Popen([sys.executable, __file__, "broker",
+                               f"{address[0]}:{address[1]}"], cwd=here)
+    time.sleep(0.5)   # Let the broker start listening first
+
+    workers = []
+    for worker_id in range(num_workers):
+        env = dict(os.environ,
+                   ROOM_BACKEND=BACKEND_BROKER,
+                   WORKER_ID=str(worker_id),
+                   NUM_WORKERS=str(num_workers),
+                   BROKER_ADDRESS=f"{address[0]}:{address[1]}",
+                   PORT=str(port + worker_id))
+        workers.append(subprocess.Popen([sys.executable, "app.py"], cwd=here, env=env))
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers + [broker]:
+            process.terminate()
+
+
+# =============================================================================
+# SCALING BENCHMARK
+# =============================================================================
+# Every worker simulates the rooms it owns (see simulation.py). More
+# workers should step more rooms in the same time, up to one per core.
+
+def _simulate_owned_rooms(args):
+    from simulation import _benchmark_rooms
+
+    worker_id, num_workers, total_rooms, ticks = args
+    owned = sum(1 for i in range(total_rooms)
+                if worker_for(f"R{i:05d}", num_workers) == worker_id)
+    return owned, _benchmark_rooms(owned, ticks, batch_physics=True) * ticks
+
+
+def _benchmark_workers(num_workers, total_rooms=4000, ticks=300):
+    from multiprocessing import Pool
+
+    with Pool(num_workers) as pool:
+        results = pool.map(_simulate_owned_rooms,
+                           [(w, num_workers, total_rooms, ticks) for w in range(num_workers)])
+    slowest = max(elapsed for _, elapsed in results)
+    return [rooms for rooms, _ in results], total_rooms * ticks / slowest
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "broker":
+        run_broker(parse_address(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BROKER_ADDRESS)
+    elif command == "serve":
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1)
+    else:
+        cores = os.cpu_count() or 1
+        print("=" * 50)
+        print(f"  WORKER SCALING BENCHMARK ({cores} CPU cores)")
+        print("=" * 50)
+        base = None
+        for num_workers in sorted({1, 2, 4, cores}):
+            per_worker, room_ticks = _benchmark_workers(num_workers)
+            base = base or room_ticks
+            print(f"  {num_workers:>2} workers: {room_ticks:>10,.0f} room-ticks/sec "
+                  f"({room_ticks / base:4.2f}x)   rooms per worker {per_worker}")
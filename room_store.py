@@ -0,0 +1,445 @@
+# Room Store for Mina's PVP Fighting Game
+#
+# All the game rooms live here. A room (a RoomRecord, see entities.py)
+# reads just like the dict it used to be:
+#
+#   {"code": "ABC123", "players": {sid: player, ...}, "state": "waiting", ...}
+#
+# but the registry also keeps a second dictionary the other way around:
+#
+#   sid -> (room code, player number)
+#
+# so when someone disconnects we can find their room straight away
+# instead of looking through every room on the server.
+#
+# Handlers run in different threads (or eventlet green threads), so the
+# RoomStore splits rooms into "shards" by room code, each with its own
+# lock, and every room also gets its own lock for things like changing
+# coins. Two rooms in different shards never wait for each other.
+#
+# A room's "players" dict is never changed in place: adding or removing
+# a player puts a new dict in the room. So a handler looping over
+# room["players"] while someone connects or disconnects keeps looping
+# over the players it started with, and never sees the dict change size.
+
+import random
+import string
+import threading
+import zlib
+
+from entities import PlayerRecord, RoomRecord
+from game_data import get_random_tier1_weapon
+
+
+DEFAULT_SHARDS = 16
+
+# Room codes aren't part of any match, so they don't come from a room's
+# seeded streams (room_rng.py) - they come from the operating system, so
+# nobody can guess the next room's code
+_code_random = random.SystemRandom()
+
+
+# =============================================================================
+# ROOM DATA - what one room and one player look like
+# =============================================================================
+
+def generate_room_code(rooms, owns=None):
+    """Generate a random 6-character room code like 'ABC123'
+
+    The code is never one that's already in `rooms`. With several workers,
+    owns(code) says whether a code belongs to this one.
+    """
+    characters = string.ascii_uppercase + string.digits
+    code = ''.join(_code_random.choices(characters, k=6))
+    # Make sure it's unique (and that it belongs to this worker)
+    while code in rooms or (owns is not None and not owns(code)):
+        code = ''.join(_code_random.choices(characters, k=6))
+    return code
+
+
+def create_new_room(code, seed=None):
+    """Create a new game room with default settings (see entities.py).
+
+    The room gets its own random streams from seed (a new seed if None).
+    """
+    return RoomRecord(code, seed=seed)
+
+
+def create_new_player(player_num, rng=random):
+    """Create a new player with starting equipment (rng: the room's rng.loot)"""
+    starter_weapon = get_random_tier1_weapon(rng)
+    # The starter weapon is in the inventory and selected for battle
+    return PlayerRecord(player_num, inventory_ids=(starter_weapon["id"],))
+
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+
+
+class RoomRegistry:
+    """Every room, plus a reverse index from socket id to room.
+
+    Reading works like a normal dict (room = rooms[code], code in rooms).
+    Adding or removing players and rooms must go through the methods
+    below so the reverse index stays correct. A lock keeps it consistent
+    when handlers run in different threads.
+    """
+
+    def __init__(self):
+        self._rooms = {}       # code -> room dict
+        self._sid_index = {}   # sid -> (code, player number)
+        self._room_locks = {}  # code -> lock for that room's data
+        self._lock = threading.RLock()
+
+    # -------------------------------------------------------------------------
+    # Reading (works like a dict)
+    # -------------------------------------------------------------------------
+
+    def __getitem__(self, code):
+        return self._rooms[code]
+
+    def __contains__(self, code):
+        return code in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def get(self, code, default=None):
+        return self._rooms.get(code, default)
+
+    def items(self):
+        with self._lock:
+            return list(self._rooms.items())
+
+    def values(self):
+        with self._lock:
+            return list(self._rooms.values())
+
+    # -------------------------------------------------------------------------
+    # Rooms
+    # -------------------------------------------------------------------------
+
+    def add_room(self, code, room):
+        """Add a room. Returns False if the code is already taken."""
+        with self._lock:
+            if code in self._rooms:
+                return False
+            self._rooms[code] = room
+            return True
+
+    def delete_room(self, code):
+        """Remove a room and forget every player that was in it"""
+        with self._lock:
+            room = self._rooms.pop(code, None)
+            self._room_locks.pop(code, None)
+            if room is not None:
+                for sid in room["players"]:
+                    self._sid_index.pop(sid, None)
+            return room
+
+    def room_lock(self, code):
+        """The lock for one room - hold it while changing coins, ready flags..."""
+        with self._lock:
+            lock = self._room_locks.get(code)
+            if lock is None:
+                lock = self._room_locks[code] = threading.RLock()
+            return lock
+
+    # -------------------------------------------------------------------------
+    # Players
+    # -------------------------------------------------------------------------
+
+    def add_player(self, code, sid, player):
+        """Put a player in a room (taking them out of any other room first)"""
+        with self._lock:
+            self._remove_sid(sid)
+            room = self._rooms[code]
+            players = dict(room["players"])
+            players[sid] = player
+            room["players"] = players
+            self._sid_index[sid] = (code, player["number"])
+
+    def remove_player(self, sid):
+        """Take a player out of their room.
+
+        Returns (code, room, player), or None if they weren't in a room.
+        """
+        with self._lock:
+            return self._remove_sid(sid)
+
+    def _remove_sid(self, sid):
+        found = self._sid_index.pop(sid, None)
+        if found is None:
+            return None
+        code = found[0]
+        room = self._rooms.get(code)
+        if room is None:
+            return None
+        players = dict(room["players"])
+        player = players.pop(sid, None)
+        room["players"] = players
+        return code, room, player
+
+    def find_sid(self, sid):
+        """(room code, player number) for a socket, or None"""
+        return self._sid_index.get(sid)
+
+    def player_in_room(self, code, sid):
+        """The player dict if this socket is in this room, otherwise None"""
+        found = self._sid_index.get(sid)
+        if found is None or found[0] != code:
+            return None
+        room = self._rooms.get(code)
+        return room["players"].get(sid) if room is not None else None
+
+
+def shard_for(code, num_shards):
+    """Which shard a room code belongs to (the same in every process)"""
+    return zlib.crc32(str(code).encode()) % num_shards
+
+
+class RoomStore:
+    """Rooms split over several RoomRegistry shards by room code.
+
+    Works just like a RoomRegistry. Each shard has its own lock, so
+    creating, joining and leaving rooms in different shards happen in
+    parallel, and room_lock(code) guards one room's players and coins.
+    """
+
+    def __init__(self, num_shards=DEFAULT_SHARDS):
+        self.num_shards = num_shards
+        self._shards = [RoomRegistry() for _ in range(num_shards)]
+        self._sid_shards = {}   # sid -> shard number
+        self._sid_lock = threading.Lock()
+
+    def _shard(self, code):
+        return self._shards[shard_for(code, self.num_shards)]
+
+    # -------------------------------------------------------------------------
+    # Reading (works like a dict)
+    # -------------------------------------------------------------------------
+
+    def __getitem__(self, code):
+        return self._shard(code)[code]
+
+    def __contains__(self, code):
+        return code in self._shard(code)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def get(self, code, default=None):
+        return self._shard(code).get(code, default)
+
+    def items(self):
+        return [item for shard in self._shards for item in shard.items()]
+
+    def values(self):
+        return [room for shard in self._shards for room in shard.values()]
+
+    # -------------------------------------------------------------------------
+    # Rooms
+    # -------------------------------------------------------------------------
+
+    def add_room(self, code, room):
+        """Add a room. Returns False if the code is already taken."""
+        return self._shard(code).add_room(code, room)
+
+    def delete_room(self, code):
+        """Remove a room and forget every player that was in it"""
+        room = self._shard(code).delete_room(code)
+        if room is not None:
+            number = shard_for(code, self.num_shards)
+            with self._sid_lock:
+                for sid in room["players"]:
+                    if self._sid_shards.get(sid) == number:
+                        del self._sid_shards[sid]
+        return room
+
+    def room_lock(self, code):
+        return self._shard(code).room_lock(code)
+
+    # -------------------------------------------------------------------------
+    # Players
+    # -------------------------------------------------------------------------
+
+    def add_player(self, code, sid, player):
+        """Put a player in a room (taking them out of any other room first)"""
+        number = shard_for(code, self.num_shards)
+        with self._sid_lock:
+            old = self._sid_shards.get(sid)
+            self._sid_shards[sid] = number
+        if old is not None and old != number:
+            self._shards[old].remove_player(sid)
+        self._shards[number].add_player(code, sid, player)
+
+    def remove_player(self, sid):
+        """Take a player out of their room.
+
+        Returns (code, room, player), or None if they weren't in a room.
+        """
+        with self._sid_lock:
+            number = self._sid_shards.pop(sid, None)
+        if number is None:
+            return None
+        return self._shards[number].remove_player(sid)
+
+    def find_sid(self, sid):
+        """(room code, player number) for a socket, or None"""
+        number = self._sid_shards.get(sid)
+        return self._shards[number].find_sid(sid) if number is not None else None
+
+    def player_in_room(self, code, sid):
+        """The player dict if this socket is in this room, otherwise None"""
+        return self._shard(code).player_in_room(code, sid)
+
+    def shard_sizes(self):
+        """How many rooms are in each shard (to check they're spread out)"""
+        return [len(shard) for shard in self._shards]
+
+
+# =============================================================================
+# LOAD TEST
+# =============================================================================
+# Run this file directly (python room_store.py) to churn connects and
+# disconnects and compare the old "look through every room" disconnect
+# with the reverse index as the number of rooms grows.
+
+def _linear_disconnect(rooms, sid):
+    """What handle_disconnect used to do"""
+    for code, room in list(rooms.items()):
+        if sid in room["players"]:
+            del room["players"][sid]
+            return code
+    return None
+
+
+def _stress_test(num_threads=16, num_rooms=8, rounds=1500):
+    """Many threads buying, winning and reloading in the same rooms at once.
+
+    The threads call the real handlers (see game_server.py). Every coin
+    change is counted from what the handlers send back, so at the end
+    each player's coins must be exactly start + rewards - purchases. A
+    lost update shows up as a difference, and a handler that crashed
+    (say, a room's players changing while it loops over them) as an error.
+    """
+    import contextlib
+    import io
+    import random
+    import sys
+
+    from game_data import STORE_PRICES, WIN_REWARD
+    from game_server import GameServer
+    from match_recorder import MatchRecorder
+    from room_backend import InMemoryBackend
+
+    backend = InMemoryBackend()
+    backend.rooms = RoomStore(num_shards=4)
+    server = GameServer(backend)
+    server.match_recorder = MatchRecorder(enabled=False)
+    price = STORE_PRICES["mystery_box"]
+
+    codes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(num_rooms):
+            code = server.create_room(f"R{i}-1").messages[0][1]["code"]
+            server.join_room(f"R{i}-2", {"code": code})
+            for player in server.game_rooms[code]["players"].values():
+                player["coins"] = 500
+            codes.append(code)
+
+    counts = [{} for _ in range(num_threads)]   # per thread: (code, number) -> coin change
+    errors = []
+
+    def worker(t):
+        rng = random.Random(t)
+        mine = counts[t]
+        try:
+            for n in range(rounds):
+                i = rng.randrange(num_rooms)
+                code = codes[i]
+                number = rng.choice((1, 2))
+                roll = rng.random()
+                if roll < 0.45:
+                    out = server.buy_item(f"R{i}-{number}", {"code": code, "item_type": "mystery_box"})
+                    if out.messages[0][0] == "item_purchased":
+                        mine[code, number] = mine.get((code, number), 0) - price
+                elif roll < 0.9:
+                    server.game_over(f"R{i}-{number}", {"code": code, "winner": number})
+                    mine[code, number] = mine.get((code, number), 0) + WIN_REWARD
+                else:
+                    # A third page keeps reloading into the room (it never wins)
+                    sid = f"T{t}-{n}"
+                    server.rejoin_game(sid, {"code": code, "player": 3})
+                    server.disconnect(sid)
+        except Exception as e:
+            errors.append(e)
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)   # Switch threads as often as possible
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=worker, args=(t,)) for t in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+
+    lost = 0
+    for code in codes:
+        for sid, player in server.game_rooms[code]["players"].items():
+            key = (code, player["number"])
+            expected = 500 + sum(c.get(key, 0) for c in counts)
+            lost += abs(player["coins"] - expected)
+            assert player["coins"] >= 0, f"{sid} went below 0 coins"
+    return num_threads * rounds, lost, errors
+
+
+if __name__ == "__main__":
+    import time
+
+    updates, lost, errors = _stress_test()
+    print("=" * 50)
+    print("  COIN STRESS TEST")
+    print("=" * 50)
+    print(f"  {updates:,} purchases/rewards/reloads from 16 threads: "
+          f"{lost} coins lost, {len(errors)} handler errors")
+    for error in errors[:3]:
+        print(f"    {error!r}")
+    assert lost == 0 and not errors
+    print()
+
+    churn = 50000
+    print("=" * 50)
+    print(f"  DISCONNECT LOAD TEST ({churn:,} connect/disconnect pairs)")
+    print("=" * 50)
+    for num_rooms in (100, 1000, 10000):
+        old_rooms = {}
+        registry = RoomRegistry()
+        for i in range(num_rooms):
+            code = f"R{i:05d}"
+            old_rooms[code] = {"code": code, "players": {f"s{i}": {"number": 1}}}
+            registry.add_room(code, {"code": code, "players": {}})
+            registry.add_player(code, f"s{i}", {"number": 1})
+
+        # The old way is slow, so only time a slice of it
+        old_churn = min(churn, 2000000 // num_rooms)
+        start = time.perf_counter()
+        for n in range(old_churn):
+            code = f"R{n % num_rooms:05d}"
+            old_rooms[code]["players"][f"c{n}"] = {"number": 2}
+            _linear_disconnect(old_rooms, f"c{n}")
+        old_time = (time.perf_counter() - start) / old_churn
+
+        start = time.perf_counter()
+        for n in range(churn):
+            registry.add_player(f"R{n % num_rooms:05d}", f"c{n}", {"number": 2})
+            registry.remove_player(f"c{n}")
+        new_time = (time.perf_counter() - start) / churn
+
+        print(f"  {num_rooms:>6} rooms: linear scan {old_time * 1e6:9.2f} us"
+              f"   reverse index {new_time * 1e6:6.2f} us per connect+disconnect")
@@ -0,0 +1,387 @@
+# Send Rates for Mina's PVP Fighting Game
+#
+# Browsers used to send a 'move' every 50 ms, always - even when the
+# player was standing still, the link was struggling, or the battle was
+# already over. Now the server tells each browser how often to send
+# (a 'send_rate' message) and the browser only sends when something
+# changed:
+#
+#   {"interval_ms": 50, "keepalive_ms": 1000}
+#
+# - interval_ms: the quickest it may send a 'move'. 50 ms on a good link.
+#   When a connection looks congested (see SendRateController.update),
+#   it doubles, up to SLOWEST_INTERVAL, and comes back down a step at a
+#   time once things look fine again.
+# - keepalive_ms: a player who isn't moving doesn't send the same state
+#   again and again - just one 'move' this often, so everyone knows
+#   they're still there.
+# - interval_ms 0 means stop: the battle is over. The server also drops
+#   anything still arriving for a room that's 'finished'.
+#
+# Older browsers that ignore 'send_rate' still get their repeated
+# standing-still 'move's dropped by the server (relay_move below).
+#
+# Run this file to see how much all this saves over recorded matches
+# (see match_recorder.py):
+#
+#   python send_rate.py [RECORDINGS_DIR]
+#
+# Without a directory it records a made-up but production-like mix of
+# sessions first.
+
+import json
+import os
+import time
+
+
+FASTEST_INTERVAL = 0.05   # 20 a second - what browsers always used to do
+SLOWEST_INTERVAL = 0.2    # 5 a second: the opponent still moves smoothly enough
+RECOVER_STEP = 0.025      # How much quicker it gets each check once the link is fine
+KEEPALIVE_INTERVAL = 1.0  # Standing still: one 'move' a second
+CHECK_SECONDS = 0.5       # How often each connection's rate is looked at again
+
+# A connection looks congested when any of these is over the limit
+MAX_BACKLOG = 20          # Packets waiting to go out to it
+MAX_QUEUE_DEPTH = 4       # Its actions waiting for the next relay tick
+SLOW_RTT = 0.3            # Round trip time (seconds)
+MAX_JITTER = 0.08         # How much the round trip time jumps around
+
+
+class _Link:
+    __slots__ = ("interval", "told", "next_check", "last_state", "last_relayed")
+
+    def __init__(self):
+        self.interval = FASTEST_INTERVAL
+        self.told = None          # The interval the browser was last told
+        self.next_check = 0.0
+        self.last_state = None    # The last 'move' passed on to the other player
+        self.last_relayed = 0.0
+
+
+class SendRateController:
+    """Works out how often each connection should send its 'move's"""
+
+    def __init__(self, keepalive=KEEPALIVE_INTERVAL):
+        self.keepalive = keepalive
+        self._links = {}   # sid -> _Link
+
+        # Metrics
+        self.moves_relayed = 0
+        self.moves_suppressed = 0    # Standing still, sent again too soon
+        self.finished_dropped = 0    # Actions for rooms whose battle is over
+        self.rate_messages = 0
+
+    def _link(self, sid):
+        link = self._links.get(sid)
+        if link is None:
+            link = self._links[sid] = _Link()
+        return link
+
+    def due(self, sid, now=None):
+        """Is it time to look at this connection's rate again? (Cheap -
+        ask on every 'move', then only call update() when it says yes.)"""
+        now = time.perf_counter() if now is None else now
+        link = self._link(sid)
+        if now < link.next_check:
+            return False
+        link.next_check = now + CHECK_SECONDS
+        return True
+
+    def update(self, sid, rtt, jitter, backlog=0, queue_depth=0):
+        """Pick the connection's interval from how its link looks.
+        Returns the 'send_rate' message to send it, or None if nothing
+        changed."""
+        link = self._link(sid)
+        congested = (backlog > MAX_BACKLOG or queue_depth > MAX_QUEUE_DEPTH or
+                     rtt > SLOW_RTT or jitter > MAX_JITTER)
+        if congested:
+            # Back off quickly...
+            link.interval = min(SLOWEST_INTERVAL, link.interval * 2)
+        else:
+            # ... and come back slowly
+            link.interval = max(FASTEST_INTERVAL, link.interval - RECOVER_STEP)
+        interval_ms = int(round(link.interval * 1000))
+        if interval_ms == link.told:
+            return None
+        link.told = interval_ms
+        self.rate_messages += 1
+        return {"interval_ms": interval_ms, "keepalive_ms": int(self.keepalive * 1000)}
+
+    def interval(self, sid):
+        link = self._links.get(sid)
+        return link.interval if link is not None else FASTEST_INTERVAL
+
+    def relay_move(self, sid, state, now=None):
+        """Should this JSON 'move' go to the other player? Not if it's
+        exactly the last one we passed on, unless a keepalive is due."""
+        now = time.perf_counter() if now is None else now
+        link = self._link(sid)
+        if state == link.last_state and now - link.last_relayed < self.keepalive:
+            self.moves_suppressed += 1
+            return False
+        link.last_state = state
+        link.last_relayed = now
+        self.moves_relayed += 1
+        return True
+
+    def allow_action(self, room_state):
+        """Nothing is passed on for a room whose battle is over"""
+        if room_state == "finished":
+            self.finished_dropped += 1
+            return False
+        return True
+
+    def stopped(self):
+        """The 'send_rate' message that tells a room's browsers to stop"""
+        self.rate_messages += 1
+        return {"interval_ms": 0, "keepalive_ms": 0}
+
+    def forget(self, sid):
+        self._links.pop(sid, None)
+
+    def stats(self):
+        intervals = {}
+        for link in self._links.values():
+            key = int(round(link.interval * 1000))
+            intervals[key] = intervals.get(key, 0) + 1
+        return {
+            "connections": len(self._links),
+            "interval_ms": intervals,
+            "moves_relayed": self.moves_relayed,
+            "moves_suppressed": self.moves_suppressed,
+            "finished_dropped": self.finished_dropped,
+            "rate_messages": self.rate_messages,
+        }
+
+
+# =============================================================================
+# BANDWIDTH REPORT
+# =============================================================================
+# Goes through recorded matches and counts the 'move' traffic two ways:
+#
+#   before - every 'move' in the log, each one sent on to the other player
+#   after  - what a browser following 'send_rate' would have sent, and
+#            what the server would have passed on
+#
+# The logs have each player's RTT ('rtt' events), which is all update()
+# gets here - backlog and queue depth aren't in the logs, so they count
+# as fine.
+
+def packet_size(event, payload):
+    """Bytes in a Socket.IO text packet: 42["event",{...}]"""
+    return len(json.dumps([event, payload], separators=(",", ":"))) + 2
+
+
+def _move_traffic(code, number, seq, data, tick):
+    inbound = packet_size("player_action", {"code": code, "action": "move",
+                                            "action_data": data, "seq": seq})
+    outbound = packet_size("opponent_action", {"action": "move", "data": data, "seq": seq,
+                                               "tick": tick, "acks": {"1": [seq, tick], "2": [seq, tick]}})
+    return inbound, outbound
+
+
+def measure_log(header, events):
+    """{"before"/"after": [messages, bytes]} for one room's log"""
+    from simulation import TICK_RATE
+
+    code = header.get("room", "ROOM")
+    tick_rate = header.get("tick_rate", TICK_RATE)
+    controller = SendRateController()
+    before = [0, 0]
+    after = [0, 0]
+    rtts = {}            # player -> (rtt, jitter) in seconds
+    last_sent = {}       # player -> (time, state) the browser last sent
+    finished_at = None
+    seq = 0
+
+    for line in events:
+        tick, player, event, data = line[:4]
+        now = tick / tick_rate
+        if event == "rtt":
+            rtts[player] = (data["rtt"] / 1000, data.get("jitter", 0) / 1000)
+        elif event == "game_start":
+            finished_at = None
+        elif event == "game_over":
+            finished_at = now
+            after[0] += 2
+            after[1] += 2 * packet_size("send_rate", controller.stopped())
+        elif event == "move" and isinstance(data, dict):
+            seq += 1
+            inbound, outbound = _move_traffic(code, player, seq, data, tick)
+            before[0] += 2
+            before[1] += inbound + outbound
+
+            rtt, jitter = rtts.get(player, (0.1, 0.0))
+            if finished_at is not None:
+                # 'send_rate' 0 takes half a round trip to get there
+                if now - finished_at < rtt / 2:
+                    after[0] += 1
+                    after[1] += inbound
+                continue
+            if controller.due(player, now):
+                message = controller.update(player, rtt, jitter)
+                if message is not None:
+                    after[0] += 1
+                    after[1] += packet_size("send_rate", message)
+            sent_at, sent_state = last_sent.get(player, (None, None))
+            if sent_at is not None:
+                if now - sent_at < controller.interval(player) - 1e-9:
+                    continue
+                if data == sent_state and now - sent_at < controller.keepalive:
+                    continue
+            last_sent[player] = (now, data)
+            after[0] += 1
+            after[1] += inbound
+            if controller.relay_move(player, data, now):
+                after[0] += 1
+                after[1] += outbound
+    return {"before": before, "after": after}
+
+
+def _fake_state(x, y, vel_x, vel_y, facing_right, attacking=False):
+    return {"x": round(x, 1), "y": round(y, 1), "velX": vel_x, "velY": round(vel_y, 2), "hp": 100,
+            "facingRight": facing_right, "isAttacking": attacking, "currentWeapon": 0,
+            "isSpinJumping": False, "spinAngle": 0, "isDucking": False}
+
+
+# Kinds of session, how often each one turns up, and how they behave:
+# (share, share of time each player stands still, RTT range in ms,
+#  seconds one browser keeps sending after the battle is over)
+SESSION_MIX = {
+    "duel":      (0.45, (0.25, 0.25), (30, 180), None),
+    "camper":    (0.15, (0.25, 0.8), (30, 180), None),
+    "afk":       (0.15, (0.25, 1.0), (30, 180), None),
+    "laggy":     (0.15, (0.25, 0.25), (300, 600), None),
+    "left_open": (0.10, (0.25, 0.25), (30, 180), (20, 120)),
+}
+
+
+def record_session_mix(directory, sessions=200, seed=23):
+    """Write `sessions` made-up match logs in the recorder's format.
+    Returns their paths."""
+    import random
+
+    from simulation import TICK_RATE
+
+    rng = random.Random(seed)
+    kinds = list(SESSION_MIX)
+    shares = [SESSION_MIX[kind][0] for kind in kinds]
+    paths = []
+    for index in range(sessions):
+        kind = rng.choices(kinds, shares)[0]
+        _, still, rtt_range, left_open = SESSION_MIX[kind]
+        code = f"MIX{index:03d}"
+        seconds = rng.uniform(30, 150)
+        tail = rng.uniform(*left_open) if left_open else 0.0
+        lines = [[0, 0, "game_start", {"map": "Grass", "hazard_seed": index}]]
+        end_tick = int(seconds * TICK_RATE)
+        for number in (1, 2):
+            rtt = rng.uniform(*rtt_range)
+            jitter = rtt * rng.uniform(0.05, 0.3)
+            x, y = (200.0, 400.0) if number == 1 else (900.0, 400.0)
+            vel_x, vel_y = 0, 0.0
+            standing = True
+            change_at = 0
+            # The browser that didn't hear the battle was over keeps going
+            last_tick = end_tick + int((tail if number == 2 else rtt / 2000) * TICK_RATE)
+            phase = rng.randrange(3)
+            for tick in range(phase, last_tick, 3):   # A 'move' every 50 ms
+                if tick >= change_at:
+                    standing = rng.random() < still[number - 1]
+                    vel_x = 0 if standing else rng.choice((-5, 5))
+                    change_at = tick + int(rng.uniform(0.5, 4) * TICK_RATE)
+                    if not standing and rng.random() < 0.3:
+                        vel_y = -15.0
+                if not standing:
+                    x = min(1160.0, max(0.0, x + vel_x * 3))
+                    if vel_y or y < 400:
+                        y = min(400.0, y + vel_y * 3)
+                        vel_y = 0.0 if y >= 400 else vel_y + 0.8 * 3
+                lines.append([tick, number, "move", _fake_state(x, y, vel_x, vel_y, vel_x >= 0)])
+                if tick % (2 * TICK_RATE) < 3:
+                    sample = max(1.0, rng.gauss(rtt, jitter))
+                    lines.append([tick, number, "rtt", {"rtt": round(sample, 1), "jitter": round(jitter, 1)}])
+        lines.append([end_tick, 0, "game_over", {"winner": 1, "claimed": 1}])
+        lines.sort(key=lambda line: line[0])
+        path = os.path.join(directory, f"{code}.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"room": code, "seed": index, "tick_rate": TICK_RATE, "mix": kind}) + "\n")
+            for line in lines:
+                f.write(json.dumps(line, separators=(",", ":")) + "\n")
+        paths.append(path)
+    return paths
+
+
+def report(paths):
+    from match_recorder import read_log
+    from simulation import TICK_RATE
+
+    totals = {}   # session kind -> {"before": [...], "after": [...], "sessions", "seconds"}
+    for path in paths:
+        header, events = read_log(path)
+        if not events:
+            continue
+        kind = header.get("mix", "recorded")
+        result = measure_log(header, events)
+        row = totals.setdefault(kind, {"before": [0, 0], "after": [0, 0], "sessions": 0, "seconds": 0.0})
+        for key in ("before", "after"):
+            row[key][0] += result[key][0]
+            row[key][1] += result[key][1]
+        row["sessions"] += 1
+        row["seconds"] += events[-1][0] / header.get("tick_rate", TICK_RATE)
+
+    everything = {"before": [0, 0], "after": [0, 0], "sessions": 0, "seconds": 0.0}
+    for row in totals.values():
+        for key in ("before", "after"):
+            everything[key][0] += row[key][0]
+            everything[key][1] += row[key][1]
+        everything["sessions"] += row["sessions"]
+        everything["seconds"] += row["seconds"]
+
+    print("=" * 78)
+    print(f"  'move' TRAFFIC, FIXED 50 ms vs SEND RATES ({everything['sessions']} sessions, "
+          f"{everything['seconds'] / 3600:.1f} hours)")
+    print("=" * 78)
+    print(f"  {'session':<10} {'rooms':>5} {'msgs/s before':>14} {'after':>8} {'saved':>6}"
+          f" {'KB/s before':>12} {'after':>8} {'saved':>6}")
+    for kind, row in sorted(totals.items(), key=lambda item: -item[1]["sessions"]) + [("TOTAL", everything)]:
+        seconds = row["seconds"] or 1
+        (msgs_before, bytes_before), (msgs_after, bytes_after) = row["before"], row["after"]
+        print(f"  {kind:<10} {row['sessions']:>5} {msgs_before / seconds:>14.1f} {msgs_after / seconds:>8.1f}"
+              f" {1 - msgs_after / max(1, msgs_before):>6.0%} {bytes_before / seconds / 1024:>12.2f}"
+              f" {bytes_after / seconds / 1024:>8.2f} {1 - bytes_after / max(1, bytes_before):>6.0%}")
+    print("  (per room, both directions: browser -> server and server -> other browser)")
+
+
+if __name__ == "__main__":
+    import shutil
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+        report(sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.endswith(".jsonl")))
+    else:
+        directory = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            paths = record_session_mix(directory)
+            print(f"  Recorded {len(paths)} sessions in {time.perf_counter() - start:.1f}s")
+            report(paths)
+        finally:
+            shutil.rmtree(directory)
+
+        # What the server pays per 'move'
+        controller = SendRateController()
+        state = _fake_state(300.0, 400.0, 0, 0.0, True)
+        calls = 200_000
+        start = time.perf_counter()
+        for i in range(calls):
+            now = i * 0.0005
+            sid = i % 1000
+            if controller.due(sid, now):
+                controller.update(sid, 0.1, 0.01)
+            controller.relay_move(sid, state, now)
+        elapsed = time.perf_counter() - start
+        print(f"  due() + relay_move(): {elapsed / calls * 1e6:.2f} us per 'move'")
@@ -0,0 +1,777 @@
+# Server-side Simulation for Mina's PVP Fighting Game
+#
+# This file runs the actual fight on the server, without any graphics.
+# It uses the same physics as pvp_fighting_game_1.py (Player.move,
+# check_platform_collision, Projectile.update) and the constants in
+# game_data.py, so the server can decide who got hit instead of
+# trusting what each browser says.
+#
+# Every room is stepped at a fixed 60 ticks per second.
+
+import time
+
+from hazards import RoomHazards
+from platform_index import get_platform_index
+from game_data import (
+    MAPS,
+    SCREEN_WIDTH,
+    SCREEN_HEIGHT,
+    GRAVITY,
+    JUMP_STRENGTH,
+    PLAYER_SPEED,
+    PLAYER_WIDTH,
+    PLAYER_HEIGHT,
+    STARTING_HP,
+    ATTACK_COOLDOWN,
+    FPS,
+)
+
+
+# =============================================================================
+# SIMULATION SETTINGS
+# =============================================================================
+
+TICK_RATE = FPS                  # Ticks per second (same as the game's FPS)
+TICK_SECONDS = 1.0 / TICK_RATE   # How long one tick lasts
+
+# How much of each tick we allow the simulation to use.
+# The rest is left for networking and the other SocketIO handlers.
+TICK_BUDGET_SECONDS = TICK_SECONDS * 0.5
+
+# If the server falls behind, only catch up this many ticks at once.
+# Otherwise one slow tick makes the next one slower ("spiral of death").
+MAX_CATCH_UP_TICKS = 5
+
+ATTACK_FRAMES = 15      # How long an attack swing lasts
+MELEE_RANGE = 50        # How far a melee weapon reaches
+PROJECTILE_SPEED = 10
+PROJECTILE_WIDTH = 10
+PROJECTILE_HEIGHT = 5
+
+# Where each player starts (same as pvp_fighting_game_1.main)
+SPAWN_POSITIONS = {
+    1: (100, 100),
+    2: (1000, 100),
+}
+
+# The buttons a player can press
+EMPTY_INPUT = {"left": False, "right": False, "jump": False}
+
+
+# =============================================================================
+# PLATFORMS
+# =============================================================================
+
+def platforms_for_map(map_data):
+    """The map's platforms, compiled once and shared by every room (see platform_index.py)"""
+    return get_platform_index(map_data)
+
+
+# =============================================================================
+# PLAYERS
+# =============================================================================
+
+class SimPlayer:
+    """A player without drawing code.
+
+    move() and check_platform_collision() follow pvp_fighting_game_1.Player
+    step for step so both give exactly the same positions.
+    """
+
+    # A fixed list of fields instead of a dict per player (see entities.py)
+    __slots__ = ("number", "x", "y", "width", "height", "vel_x", "vel_y", "speed",
+                 "on_ground", "facing_right", "health", "weapons",
+                 "current_weapon_index", "attack_cooldown", "is_attacking", "attack_timer")
+
+    def __init__(self, number, x, y, weapons=None):
+        self.number = number
+        self.x = x
+        self.y = y
+        self.width = PLAYER_WIDTH
+        self.height = PLAYER_HEIGHT
+        self.vel_x = 0
+        self.vel_y = 0
+        self.speed = PLAYER_SPEED
+        self.on_ground = False
+        self.facing_right = True
+        self.health = STARTING_HP
+
+        # Weapons are the weapon catalog's Weapons (shared, never copied):
+        # {"id": "t1-sword", "name": "Sword", "damage": 5, "type": "melee", "tier": 1}
+        self.weapons = list(weapons or [])
+        self.current_weapon_index = 0
+        self.attack_cooldown = 0
+        self.is_attacking = False
+        self.attack_timer = 0
+
+    def get_current_weapon(self):
+        if self.weapons:
+            return self.weapons[self.current_weapon_index]
+        return None
+
+    def switch_weapon(self, index):
+        if 0 <= index < len(self.weapons):
+            self.current_weapon_index = index
+
+    def move(self, inputs, platforms):
+        # Horizontal movement
+        self.vel_x = 0
+        if inputs["left"]:
+            self.vel_x = -self.speed
+            self.facing_right = False
+        if inputs["right"]:
+            self.vel_x = self.speed
+            self.facing_right = True
+
+        # Jump
+        if inputs["jump"] and self.on_ground:
+            self.vel_y = JUMP_STRENGTH
+            self.on_ground = False
+
+        # Apply gravity
+        self.vel_y += GRAVITY
+
+        # Update position
+        self.x += self.vel_x
+        self.y += self.vel_y
+
+        # Check ground collision (only platforms we could have landed on)
+        self.on_ground = False
+        for platform in platforms.landing_candidates(self.x, self.y + self.height, self.vel_y):
+            if self.check_platform_collision(platform):
+                self.on_ground = True
+
+        # Screen boundaries
+        if self.x < 0:
+            self.x = 0
+        if self.x > SCREEN_WIDTH - self.width:
+            self.x = SCREEN_WIDTH - self.width
+        if self.y > SCREEN_HEIGHT:
+            self.y = SCREEN_HEIGHT - self.height
+            self.vel_y = 0
+            self.on_ground = True
+
+    def check_platform_collision(self, platform):
+        # Check if player is falling onto platform
+        if self.vel_y >= 0:
+            if (self.x + self.width > platform.x and
+                    self.x < platform.x + platform.width and
+                    self.y + self.height <= platform.y and
+                    self.y + self.height + self.vel_y >= platform.y):
+                self.y = platform.y - self.height
+                self.vel_y = 0
+                return True
+        return False
+
+    def attack(self):
+        if self.attack_cooldown == 0 and self.weapons:
+            self.is_attacking = True
+            self.attack_timer = ATTACK_FRAMES
+            self.attack_cooldown = ATTACK_COOLDOWN
+            return self.get_current_weapon()
+        return None
+
+    def update_timers(self):
+        if self.attack_cooldown > 0:
+            self.attack_cooldown -= 1
+        if self.attack_timer > 0:
+            self.attack_timer -= 1
+        else:
+            self.is_attacking = False
+
+    def take_damage(self, damage):
+        self.health -= damage
+        if self.health < 0:
+            self.health = 0
+
+    def snapshot(self):
+        """The player's state as a dict the browser can read"""
+        return {
+            "number": self.number,
+            "x": self.x,
+            "y": self.y,
+            "vel_x": self.vel_x,
+            "vel_y": self.vel_y,
+            "on_ground": self.on_ground,
+            "hp": self.health,
+            "facing_right": self.facing_right,
+            "is_attacking": self.is_attacking,
+            "weapon": self.current_weapon_index,
+        }
+
+
+def melee_hit(weapon, attacker, defender):
+    """Same rules as pvp_fighting_game_1.MeleeWeapon.check_hit"""
+    if not attacker.is_attacking:
+        return False
+
+    # Check if in range and facing target
+    if attacker.facing_right:
+        in_range = (defender.x > attacker.x and
+                    defender.x < attacker.x + MELEE_RANGE + attacker.width)
+    else:
+        in_range = (defender.x < attacker.x and
+                    defender.x > attacker.x - MELEE_RANGE - defender.width)
+
+    # Check vertical alignment
+    vertical_align = abs((attacker.y + attacker.height / 2) -
+                         (defender.y + defender.height / 2)) < 40
+
+    return in_range and vertical_align and attacker.attack_timer == ATTACK_FRAMES - 1
+
+
+# =============================================================================
+# PROJECTILES
+# =============================================================================
+
+class SimProjectile:
+    """A flying arrow/bullet without drawing code"""
+
+    __slots__ = ("x", "y", "direction", "damage", "owner", "speed", "active", "width", "height")
+
+    def __init__(self, x, y, direction, damage, owner, speed=PROJECTILE_SPEED):
+        self.x = x
+        self.y = y
+        self.direction = direction  # 1 for right, -1 for left
+        self.damage = damage
+        self.owner = owner          # Player number who fired it
+        self.speed = speed
+        self.active = True
+        self.width = PROJECTILE_WIDTH
+        self.height = PROJECTILE_HEIGHT
+
+    def update(self):
+        self.x += self.direction * self.speed
+        # Remove if off screen
+        if self.x < 0 or self.x > SCREEN_WIDTH:
+            self.active = False
+
+    def check_hit(self, player):
+        return (self.x < player.x + player.width and
+                self.x + self.width > player.x and
+                self.y < player.y + player.height and
+                self.y + self.height > player.y)
+
+    def snapshot(self):
+        return {"x": self.x, "y": self.y, "direction": self.direction}
+
+
+def projectile_start(player):
+    """Where a shot starts: (x, y, direction)"""
+    if player.facing_right:
+        proj_x = player.x + player.width
+        direction = 1
+    else:
+        proj_x = player.x
+        direction = -1
+    proj_y = player.y + player.height // 2
+    return proj_x, proj_y, direction
+
+
+def create_projectile(weapon, player):
+    """Same rules as pvp_fighting_game_1.RangedWeapon.create_projectile"""
+    proj_x, proj_y, direction = projectile_start(player)
+    return SimProjectile(proj_x, proj_y, direction, weapon["damage"], player.number)
+
+
+# =============================================================================
+# ONE ROOM
+# =============================================================================
+
+class RoomSimulation:
+    """The fight in one room: two players, their projectiles, and the map
+    (and its comets, lava, icicles or spaceships, given a hazard seed)"""
+
+    def __init__(self, code, map_data=None, weapons=None, hazard_seed=None):
+        self.code = code
+        self.map_data = map_data or MAPS[0]
+        self.platforms = platforms_for_map(self.map_data)
+        self.tick = 0
+        self.winner = None
+
+        # Hazards come from the room's seed, so without one there are none
+        # (like replays of battles from before the server ran them)
+        self.hazard_seed = hazard_seed
+        self.hazards = None
+        if hazard_seed is not None:
+            hazards = RoomHazards(self.map_data, hazard_seed)
+            if hazards.active:
+                self.hazards = hazards
+
+        # weapons = {1: [...], 2: [...]}
+        weapons = weapons or {}
+        self.players = {}
+        for number, (x, y) in SPAWN_POSITIONS.items():
+            self.players[number] = SimPlayer(number, x, y, weapons.get(number))
+
+        self.projectiles = []
+
+        # Latest buttons held by each player, plus presses waiting for the next tick
+        self.inputs = {number: dict(EMPTY_INPUT) for number in self.players}
+        self.pending_attacks = set()
+        self.pending_switches = {}
+
+        # Input sequence numbers (see input_sync.py): player number ->
+        # [seq, tick]. An input is used on the tick after it arrives, so
+        # it waits in `arrived` until that tick has happened.
+        self.acks = {}
+        self.arrived = {}
+
+        # Set by SimulationEngine when this room's players live in a WorldStore
+        # (then its projectiles live in the engine's ProjectilePool, tagged
+        # with player 1's slot)
+        self.world = None
+        self.slots = {}
+        self.pool = None
+
+    def set_input(self, player_num, data, seq=None):
+        """Store what a player is pressing. Used on the next tick."""
+        if player_num not in self.players:
+            return
+        if seq is not None:
+            self.ack_inputs()
+            self.arrived[player_num] = [seq, self.tick + 1]
+        held = self.inputs[player_num]
+        for key in EMPTY_INPUT:
+            if key in data:
+                held[key] = bool(data[key])
+        if self.world is not None:
+            slot = self.slots[player_num]
+            self.world.input_left[slot] = held["left"]
+            self.world.input_right[slot] = held["right"]
+            self.world.input_jump[slot] = held["jump"]
+        # Attacking and switching weapons are key presses, not held keys
+        if data.get("attack"):
+            self.pending_attacks.add(player_num)
+        if "weapon" in data:
+            self.pending_switches[player_num] = data["weapon"]
+
+    def step(self):
+        """Advance the fight by one tick (same order as pvp_fighting_game_1.main)"""
+        if self.winner is not None:
+            return
+        self.press_keys()
+        self.players[1].move(self.inputs[1], self.platforms)
+        self.players[2].move(self.inputs[2], self.platforms)
+        self.players[1].update_timers()
+        self.players[2].update_timers()
+        if self.hazards is not None:
+            self.hazards.step((self.players[1], self.players[2]))
+        self.update_projectiles()
+        self.check_melee()
+        self.check_winner()
+
+    def press_keys(self):
+        """Weapon switches and attacks (pygame handles KEYDOWN before moving)"""
+        self.tick += 1
+        for number, index in self.pending_switches.items():
+            self.players[number].switch_weapon(index)
+        self.pending_switches.clear()
+
+        for number in sorted(self.pending_attacks):
+            player = self.players[number]
+            weapon = player.attack()
+            if weapon and weapon.get("type") == "ranged":
+                self.fire(weapon, player)
+        self.pending_attacks.clear()
+
+    def fire(self, weapon, player):
+        if self.pool is None:
+            self.projectiles.append(create_projectile(weapon, player))
+        else:
+            proj_x, proj_y, direction = projectile_start(player)
+            self.pool.spawn(proj_x, proj_y, direction, weapon["damage"], player.number,
+                            self.slots[1], self.slots[2], tag=self.slots[1])
+
+    def update_projectiles(self):
+        player1 = self.players[1]
+        player2 = self.players[2]
+        still_flying = []
+        for proj in self.projectiles:
+            proj.update()
+            if not proj.active:
+                continue
+            if proj.check_hit(player1):
+                player1.take_damage(proj.damage)
+            elif proj.check_hit(player2):
+                player2.take_damage(proj.damage)
+            else:
+                still_flying.append(proj)
+        self.projectiles = still_flying
+
+    def check_melee(self):
+        player1 = self.players[1]
+        player2 = self.players[2]
+        for attacker, defender in ((player1, player2), (player2, player1)):
+            weapon = attacker.get_current_weapon()
+            if weapon and weapon.get("type") == "melee":
+                if melee_hit(weapon, attacker, defender):
+                    defender.take_damage(weapon["damage"])
+
+    def check_winner(self):
+        if self.players[1].health <= 0:
+            self.winner = 2
+        elif self.players[2].health <= 0:
+            self.winner = 1
+
+    def ack_inputs(self):
+        """Inputs whose tick has happened have been used - ack them"""
+        if self.arrived:
+            for number, (seq, tick) in list(self.arrived.items()):
+                if tick <= self.tick:
+                    self.acks[number] = [seq, tick]
+                    del self.arrived[number]
+
+    def snapshot(self):
+        """Everything the browsers need to draw this tick"""
+        if self.world is not None:
+            self.pull_from_world()
+            projectiles = self.pool.snapshot(self.slots[1])
+        else:
+            projectiles = [p.snapshot() for p in self.projectiles]
+        snapshot = {
+            "tick": self.tick,
+            "players": [p.snapshot() for p in self.players.values()],
+            "projectiles": projectiles,
+            "winner": self.winner,
+        }
+        if self.hazards is not None:
+            snapshot["hazards"] = self.hazards.snapshot()
+        self.ack_inputs()
+        if self.acks:
+            # The last input from each player that this tick has used
+            snapshot["acks"] = {number: list(ack) for number, ack in self.acks.items()}
+        return snapshot
+
+    # -------------------------------------------------------------------------
+    # Copying to and from a WorldStore (only used with batch_physics)
+    # -------------------------------------------------------------------------
+
+    def pull_from_world(self):
+        """Copy this room's players out of the world arrays"""
+        world = self.world
+        for number, player in self.players.items():
+            slot = self.slots[number]
+            player.x = world.x[slot].item()
+            player.y = world.y[slot].item()
+            player.vel_x = world.vel_x[slot].item()
+            player.vel_y = world.vel_y[slot].item()
+            player.on_ground = world.on_ground[slot].item()
+            player.facing_right = world.facing_right[slot].item()
+            player.attack_cooldown = world.attack_cooldown[slot].item()
+            player.attack_timer = world.attack_timer[slot].item()
+            player.is_attacking = world.is_attacking[slot].item()
+            player.health = world.health[slot].item()
+
+    def push_to_world(self):
+        """Copy this room's players into the world arrays"""
+        world = self.world
+        for number, player in self.players.items():
+            slot = self.slots[number]
+            world.x[slot] = player.x
+            world.y[slot] = player.y
+            world.vel_x[slot] = player.vel_x
+            world.vel_y[slot] = player.vel_y
+            world.on_ground[slot] = player.on_ground
+            world.facing_right[slot] = player.facing_right
+            world.attack_cooldown[slot] = player.attack_cooldown
+            world.attack_timer[slot] = player.attack_timer
+            world.is_attacking[slot] = player.is_attacking
+            world.health[slot] = player.health
+            weapon = player.get_current_weapon()
+            if weapon and weapon.get("type") == "melee":
+                world.melee_damage[slot] = weapon["damage"]
+            else:
+                world.melee_damage[slot] = 0
+
+
+class _WorldPlayer:
+    """One player in the world arrays, looking like a SimPlayer to the
+    hazards (so batch mode doesn't have to copy rooms out every tick)"""
+
+    __slots__ = ("world", "slot")
+
+    width = PLAYER_WIDTH
+    height = PLAYER_HEIGHT
+
+    def __init__(self, world, slot):
+        self.world = world
+        self.slot = slot
+
+    @property
+    def x(self):
+        return self.world.x[self.slot].item()
+
+    @property
+    def y(self):
+        return self.world.y[self.slot].item()
+
+    @y.setter
+    def y(self, value):
+        self.world.y[self.slot] = value
+
+    @property
+    def vel_y(self):
+        return self.world.vel_y[self.slot].item()
+
+    @vel_y.setter
+    def vel_y(self, value):
+        self.world.vel_y[self.slot] = value
+
+    def take_damage(self, damage):
+        health = self.world.health
+        health[self.slot] = max(0, health[self.slot].item() - damage)
+
+
+# =============================================================================
+# ALL ROOMS - the fixed tick loop
+# =============================================================================
+
+class SimulationEngine:
+    """Steps every room at a fixed rate and keeps track of how long it takes.
+
+    With batch_physics=True, every player in every room lives in one
+    WorldStore (see world_store.py). Walking, gravity, landing, timers
+    and melee hits are done for everyone in one NumPy step, and only
+    rooms with something going on (a key press or a knocked-out player)
+    are handled one at a time. Every room's projectiles share one
+    ProjectilePool (see projectiles.py) and are moved all at once too.
+    """
+
+    def __init__(self, tick_rate=TICK_RATE, budget_seconds=None, batch_physics=False):
+        self.tick_seconds = 1.0 / tick_rate
+        if budget_seconds is None:
+            budget_seconds = self.tick_seconds * 0.5
+        self.budget_seconds = budget_seconds
+        self.rooms = {}
+        self.tick = 0
+        self._accumulator = 0.0
+        self._last_time = None
+
+        self.world = None
+        self.projectiles = None
+        if batch_physics:
+            from projectiles import ProjectilePool
+            from world_store import WorldStore
+            self.world = WorldStore()
+            self.projectiles = ProjectilePool()
+        self._live_rooms = None   # Rooms still fighting (batch mode)
+        self._hazard_rooms = None  # (hazards, its two players) for live rooms with hazards
+        self._slot_rooms = {}     # world slot -> room
+
+        # Stats so we can see if the server is keeping up
+        self.last_tick_seconds = 0.0
+        self.max_tick_seconds = 0.0
+        self.over_budget_ticks = 0
+        self.dropped_ticks = 0
+
+    def add_room(self, code, map_data=None, weapons=None, hazard_seed=None):
+        self.remove_room(code)
+        room = RoomSimulation(code, map_data, weapons, hazard_seed)
+        self.rooms[code] = room
+        if self.world is not None:
+            map_index = self.world.add_map(room.map_data)
+            room.world = self.world
+            room.pool = self.projectiles
+            for number, player in room.players.items():
+                slot = self.world.add_player(map_index, player.x, player.y, player.speed)
+                room.slots[number] = slot
+                self._slot_rooms[slot] = room
+            for number in room.players:
+                other = 2 if number == 1 else 1
+                self.world.opponent[room.slots[number]] = room.slots[other]
+            room.push_to_world()
+            self._live_rooms = None
+            self._hazard_rooms = None
+        return room
+
+    def remove_room(self, code):
+        room = self.rooms.pop(code, None)
+        if room is not None and room.world is not None:
+            self._detach(room)
+        return room
+
+    def _detach(self, room):
+        """Take a room's players out of the world (it keeps its last state)"""
+        room.pull_from_world()
+        # Its projectiles go back to being objects in the room
+        room.projectiles = [SimProjectile(*row) for row in self.projectiles.clear_tag(room.slots[1])]
+        for slot in room.slots.values():
+            self.world.remove_player(slot)
+            del self._slot_rooms[slot]
+        room.world = None
+        room.pool = None
+        room.slots = {}
+        self._live_rooms = None
+        self._hazard_rooms = None
+
+    def get_room(self, code):
+        return self.rooms.get(code)
+
+    def step_all(self):
+        """Advance every room by exactly one tick"""
+        start = time.perf_counter()
+        if self.world is not None:
+            self._step_batched()
+        else:
+            for room in self.rooms.values():
+                room.step()
+        self.tick += 1
+
+        elapsed = time.perf_counter() - start
+        self.last_tick_seconds = elapsed
+        if elapsed > self.max_tick_seconds:
+            self.max_tick_seconds = elapsed
+        if elapsed > self.budget_seconds:
+            self.over_budget_ticks += 1
+        return elapsed
+
+    def _step_batched(self):
+        """One tick for every room, with the per-player work done in NumPy"""
+        world = self.world
+        if self._live_rooms is None:
+            self._live_rooms = [room for room in self.rooms.values() if room.world is not None]
+        if self._hazard_rooms is None:
+            self._hazard_rooms = [
+                (room.hazards, (_WorldPlayer(world, room.slots[1]), _WorldPlayer(world, room.slots[2])))
+                for room in self._live_rooms if room.hazards is not None
+            ]
+
+        # 1. Key presses need the Python objects, so only rooms with
+        #    presses get copied out of the world
+        for room in self._live_rooms:
+            if room.pending_attacks or room.pending_switches:
+                room.pull_from_world()
+                room.press_keys()
+                room.push_to_world()
+            else:
+                room.tick += 1
+
+        # 2. Movement, timers and melee for everyone at once (hazards
+        #    are per room, but only touch the two players' numbers)
+        world.step()
+        world.update_timers()
+        for hazards, players in self._hazard_rooms:
+            hazards.step(players)
+        world.resolve_melee()
+
+        # 3. Every projectile in every room at once
+        targets, damages = self.projectiles.update(world.x, world.y, PLAYER_WIDTH, PLAYER_HEIGHT)
+        if len(targets):
+            world.take_damage(targets, damages)
+
+        # 4. Anyone knocked out? Those rooms are finished.
+        for slot in world.knocked_out():
+            room = self._slot_rooms.get(slot)
+            if room is not None and room.world is not None:
+                room.pull_from_world()
+                room.check_winner()
+                self._detach(room)
+
+    def advance(self, now=None):
+        """Run however many fixed ticks fit in the time since the last call.
+
+        Returns the number of ticks that were run.
+        """
+        if now is None:
+            now = time.perf_counter()
+        if self._last_time is None:
+            self._last_time = now
+            return 0
+        self._accumulator += now - self._last_time
+        self._last_time = now
+
+        ticks = 0
+        while self._accumulator >= self.tick_seconds:
+            if ticks >= MAX_CATCH_UP_TICKS:
+                # Too far behind - skip the rest instead of falling further back
+                skipped = int(self._accumulator / self.tick_seconds)
+                self.dropped_ticks += skipped
+                self._accumulator -= skipped * self.tick_seconds
+                break
+            self.step_all()
+            self._accumulator -= self.tick_seconds
+            ticks += 1
+        return ticks
+
+    def time_until_next_tick(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        if self._last_time is None:
+            return 0.0
+        waited = self._accumulator + (now - self._last_time)
+        return max(0.0, self.tick_seconds - waited)
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "tick": self.tick,
+            "last_tick_ms": self.last_tick_seconds * 1000,
+            "max_tick_ms": self.max_tick_seconds * 1000,
+            "budget_ms": self.budget_seconds * 1000,
+            "over_budget_ticks": self.over_budget_ticks,
+            "dropped_ticks": self.dropped_ticks,
+        }
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python simulation.py) to see how many rooms
+# one CPU core can keep at 60 ticks per second.
+
+def _benchmark_rooms(num_rooms, ticks=300, batch_physics=False):
+    import random
+    from game_data import WEAPON_CATALOG
+
+    rng = random.Random(1234)
+    engine = SimulationEngine(batch_physics=batch_physics)
+    loadout = list(WEAPON_CATALOG.tier(1)[:3])
+    for i in range(num_rooms):
+        engine.add_room(f"R{i:05d}", rng.choice(MAPS), {1: loadout, 2: loadout})
+
+    # Pretend the players are playing: browsers only send an input when
+    # a button changes, so each player changes something every few ticks
+    inputs = []
+    for _ in range(ticks):
+        changes = []
+        for room in engine.rooms.values():
+            for number in (1, 2):
+                if rng.random() < 0.1:
+                    changes.append((room, number, {
+                        "left": rng.random() < 0.3,
+                        "right": rng.random() < 0.3,
+                        "jump": rng.random() < 0.3,
+                        "attack": rng.random() < 0.2,
+                    }))
+        inputs.append(changes)
+
+    start = time.perf_counter()
+    for changes in inputs:
+        for room, number, data in changes:
+            room.set_input(number, data)
+        engine.step_all()
+    total = time.perf_counter() - start
+    return total / ticks
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("  SIMULATION BENCHMARK (one CPU core)")
+    print("=" * 50)
+    print(f"  Tick rate: {TICK_RATE} Hz  ({TICK_SECONDS * 1000:.2f} ms per tick)")
+    print(f"  Budget: {TICK_BUDGET_SECONDS * 1000:.2f} ms per tick")
+    print()
+
+    for batch_physics in (False, True):
+        print("  NumPy batch physics:" if batch_physics else "  One room at a time:")
+        per_room = None
+        for num_rooms in (1, 10, 100, 500, 2000):
+            tick_time = _benchmark_rooms(num_rooms, batch_physics=batch_physics)
+            per_room = tick_time / num_rooms
+            status = "OK" if tick_time <= TICK_BUDGET_SECONDS else "OVER BUDGET"
+            print(f"  {num_rooms:>5} rooms: {tick_time * 1000:7.3f} ms per tick "
+                  f"({per_room * 1e6:6.2f} us per room)  {status}")
+        print(f"  Rooms per core at full tick: {int(TICK_SECONDS / per_room)}")
+        print(f"  Rooms per core within budget: {int(TICK_BUDGET_SECONDS / per_room)}")
+        print()
@@ -0,0 +1,218 @@
+# Weapon Catalog for Mina's PVP Fighting Game
+#
+# game_data.WEAPONS is easy to read and edit, but it's slow to search:
+# finding "all melee weapons" or "a random mystery box weapon" means
+# walking the whole thing again every time. The catalog is built from it
+# ONCE when the server starts and never changes after that:
+#
+#   - every weapon gets a stable ID like "t2-bow", so Tier 1's Bow and
+#     Tier 2's Bow can't be mixed up
+#   - weapons are looked up by ID, tier or type straight from a dictionary
+#   - every weapon is a frozen Weapon, so the same one can be handed to
+#     every player without copying it (nobody can change it by accident)
+#   - the mystery box uses an "alias table": each draw is one random slot
+#     plus one coin flip, no matter how many weapons or tiers there are
+#
+# How an alias table works: imagine every weapon gets a column, and the
+# columns are all cut to the same height. A common weapon's column is
+# too tall, so its extra bit is cut off and used to fill up a rare
+# weapon's short column. Now every column is "this weapon, or (if the
+# coin flip lands above the line) that other weapon" - pick a column,
+# flip the coin, done.
+
+import random
+import re
+
+
+class Weapon(dict):
+    """One weapon: {"id", "name", "damage", "type", "tier"} that can't be changed.
+
+    It's still a dict, so weapon["damage"], weapon.get("type") and sending
+    it to the browser as JSON all work just like before.
+    """
+
+    __slots__ = ()
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError(f"weapon {self['id']!r} can't be changed")
+
+    __setitem__ = __delitem__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+
+    def __hash__(self):
+        return hash(self["id"])
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Weapon, (dict(self),))
+
+
+def weapon_id(tier, name):
+    """(2, "Water Gun") -> "t2-water-gun" """
+    return f"t{tier}-" + re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+class AliasTable:
+    """Picks from a list of items with fixed weights in O(1) per draw"""
+
+    __slots__ = ("items", "chance", "alias")
+
+    def __init__(self, items, weights):
+        count = len(items)
+        if count == 0:
+            raise ValueError("an alias table needs at least one item")
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("the weights must add up to more than 0")
+
+        # Scale so the average column is exactly 1 tall
+        scaled = [weight * count / total for weight in weights]
+        chance = [1.0] * count
+        alias = list(range(count))
+        small = [i for i, height in enumerate(scaled) if height < 1.0]
+        large = [i for i, height in enumerate(scaled) if height >= 1.0]
+
+        while small and large:
+            short, tall = small.pop(), large.pop()
+            chance[short] = scaled[short]
+            alias[short] = tall
+            # The tall column gives away what the short one was missing
+            scaled[tall] -= 1.0 - scaled[short]
+            (small if scaled[tall] < 1.0 else large).append(tall)
+        # Whatever's left is (apart from rounding) exactly 1 tall
+
+        self.items = tuple(items)
+        self.chance = tuple(chance)
+        self.alias = tuple(alias)
+
+    def draw(self, rng=random):
+        """One weighted random item. rng can be any random.Random"""
+        column = int(rng.random() * len(self.items))
+        if rng.random() < self.chance[column]:
+            return self.items[column]
+        return self.items[self.alias[column]]
+
+    def probabilities(self):
+        """{item index: chance of being drawn}, worked out from the table"""
+        count = len(self.items)
+        result = [0.0] * count
+        for column in range(count):
+            result[column] += self.chance[column] / count
+            result[self.alias[column]] += (1.0 - self.chance[column]) / count
+        return dict(enumerate(result))
+
+
+class WeaponCatalog:
+    """Every weapon, indexed by ID, tier and type"""
+
+    def __init__(self, weapons_by_tier, tier_weights):
+        weapons = []
+        for tier, tier_weapons in sorted(weapons_by_tier.items()):
+            for weapon in tier_weapons:
+                weapons.append(Weapon(id=weapon_id(tier, weapon["name"]), tier=tier, **weapon))
+
+        self.weapons = tuple(weapons)
+        self.by_id = {}
+        self.by_tier = {}
+        self.by_type = {}
+        for weapon in self.weapons:
+            if weapon["id"] in self.by_id:
+                raise ValueError(f"two weapons have the id {weapon['id']!r}")
+            self.by_id[weapon["id"]] = weapon
+            self.by_tier.setdefault(weapon["tier"], []).append(weapon)
+            self.by_type.setdefault(weapon["type"], []).append(weapon)
+        self.by_tier = {tier: tuple(group) for tier, group in self.by_tier.items()}
+        self.by_type = {kind: tuple(group) for kind, group in self.by_type.items()}
+
+        # Mystery box: pick a tier by its weight, then any weapon in that
+        # tier - so each weapon's weight is its tier's weight shared
+        # between everything in the tier
+        self.tier_weights = dict(tier_weights)
+        box = [w for w in self.weapons if self.tier_weights.get(w["tier"], 0) > 0]
+        self.mystery_box = AliasTable(
+            box, [self.tier_weights[w["tier"]] / len(self.by_tier[w["tier"]]) for w in box])
+
+    def __len__(self):
+        return len(self.weapons)
+
+    def __iter__(self):
+        return iter(self.weapons)
+
+    def __contains__(self, key):
+        return key in self.by_id
+
+    def get(self, key, default=None):
+        return self.by_id.get(key, default)
+
+    def tier(self, tier):
+        return self.by_tier.get(tier, ())
+
+    def of_type(self, weapon_type):
+        return self.by_type.get(weapon_type, ())
+
+    def random_from_tier(self, tier, rng=random):
+        return rng.choice(self.by_tier[tier])
+
+    def random_mystery_box(self, rng=random):
+        return self.mystery_box.draw(rng)
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python weapon_catalog.py) to compare the old
+# mystery box (build the weight lists + random.choices + .copy() on every
+# draw) with the catalog, and check the catalog still gives each tier the
+# right chance.
+
+if __name__ == "__main__":
+    import time
+    import game_data
+
+    def old_mystery_box():
+        tier_weights = {1: 40, 2: 30, 3: 15, 4: 10, 5: 5}
+        tiers = list(tier_weights.keys())
+        weights = list(tier_weights.values())
+        chosen_tier = random.choices(tiers, weights=weights)[0]
+        weapon = random.choice(game_data.WEAPONS[chosen_tier]).copy()
+        weapon["tier"] = chosen_tier
+        return weapon
+
+    catalog = game_data.WEAPON_CATALOG
+    draws = 2_000_000
+
+    print("=" * 50)
+    print(f"  MYSTERY BOX BENCHMARK ({draws:,} draws)")
+    print("=" * 50)
+    start = time.perf_counter()
+    for _ in range(draws):
+        old_mystery_box()
+    old = time.perf_counter() - start
+
+    draw = catalog.random_mystery_box
+    start = time.perf_counter()
+    for _ in range(draws):
+        draw()
+    new = time.perf_counter() - start
+
+    print(f"  Before (rebuild + choices + copy): {draws / old:>12,.0f} draws/sec")
+    print(f"  Alias table:                       {draws / new:>12,.0f} draws/sec  ({old / new:.1f}x)")
+
+    rng = random.Random(1)
+    tier_counts = {}
+    for _ in range(draws):
+        tier = draw(rng)["tier"]
+        tier_counts[tier] = tier_counts.get(tier, 0) + 1
+    total_weight = sum(catalog.tier_weights.values())
+    print()
+    print(f"  {'tier':<6} {'wanted':>8} {'got':>8}")
+    for tier, weight in sorted(catalog.tier_weights.items()):
+        print(f"  {tier:<6} {weight / total_weight:>8.2%} {tier_counts.get(tier, 0) / draws:>8.2%}")
+
+    print()
+    print(f"  {len(catalog)} weapons, ids: {', '.join(w['id'] for w in catalog)}")
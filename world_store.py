@@ -0,0 +1,371 @@
+# World Store for Mina's PVP Fighting Game
+#
+# Instead of one Player object per player, this keeps every player in
+# every room in a few big NumPy arrays ("structure of arrays"):
+#
+#   x[5], y[5], vel_y[5] ... are all about player number 5
+#
+# Then gravity, walking, jumping, landing on platforms and the screen
+# edges are worked out for ALL players at once with one NumPy step.
+# The math is done in exactly the same order as Player.move in
+# pvp_fighting_game_1.py (and simulation.SimPlayer), so the positions
+# come out bit-for-bit the same.
+
+import numpy as np
+
+from simulation import ATTACK_FRAMES, MELEE_RANGE
+from platform_index import CELL_SIZE, NUM_CELLS, get_platform_index
+from game_data import (
+    SCREEN_WIDTH,
+    SCREEN_HEIGHT,
+    GRAVITY,
+    JUMP_STRENGTH,
+    PLAYER_SPEED,
+    PLAYER_WIDTH,
+    PLAYER_HEIGHT,
+    STARTING_HP,
+)
+
+
+class WorldStore:
+    """Every player in every room, kept in NumPy arrays"""
+
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.count = 0          # Highest slot ever used + 1
+        self._free_slots = []
+
+        # Player state (one entry per slot)
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+        self.vel_x = np.zeros(0, dtype=np.float64)
+        self.vel_y = np.zeros(0, dtype=np.float64)
+        self.speed = np.zeros(0, dtype=np.float64)
+        self.on_ground = np.zeros(0, dtype=bool)
+        self.facing_right = np.zeros(0, dtype=bool)
+        self.attack_cooldown = np.zeros(0, dtype=np.int32)
+        self.attack_timer = np.zeros(0, dtype=np.int32)
+        self.is_attacking = np.zeros(0, dtype=bool)
+        self.health = np.zeros(0, dtype=np.int64)
+        self.map_index = np.zeros(0, dtype=np.int32)
+        self.active = np.zeros(0, dtype=bool)
+
+        # Combat: who each player is fighting, and how hard their
+        # current melee weapon hits (0 = not holding a melee weapon)
+        self.opponent = np.zeros(0, dtype=np.int64)
+        self.melee_damage = np.zeros(0, dtype=np.int64)
+
+        # Buttons held this tick
+        self.input_left = np.zeros(0, dtype=bool)
+        self.input_right = np.zeros(0, dtype=bool)
+        self.input_jump = np.zeros(0, dtype=bool)
+
+        # Platforms for every map, split into the same columns as
+        # platform_index.py and padded to the same length:
+        # plat_x[map, cell, i] is the x of the i-th platform near that column
+        self._map_indexes = {}
+        self._map_cells = []
+        self.plat_x = np.zeros((0, 0, 0))
+        self.plat_y = np.zeros((0, 0, 0))
+        self.plat_w = np.zeros((0, 0, 0))
+
+        self._grow(capacity)
+
+    _PLAYER_ARRAYS = (
+        "x", "y", "vel_x", "vel_y", "speed", "on_ground", "facing_right",
+        "attack_cooldown", "attack_timer", "is_attacking", "health",
+        "map_index", "active", "opponent", "melee_damage",
+        "input_left", "input_right", "input_jump",
+    )
+
+    def _grow(self, new_capacity):
+        """Make every player array bigger (keeps the old values)"""
+        for name in self._PLAYER_ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros(new_capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.capacity = new_capacity
+
+    # -------------------------------------------------------------------------
+    # Maps
+    # -------------------------------------------------------------------------
+
+    def add_map(self, map_data):
+        """Register a map's platforms. Returns its map index."""
+        name = map_data["name"]
+        if name in self._map_indexes:
+            return self._map_indexes[name]
+
+        index = len(self._map_cells)
+        self._map_indexes[name] = index
+        self._map_cells.append(get_platform_index(map_data).cells)
+
+        # Rebuild the padded platform table (maps are only added a few times).
+        # Padding platforms have width -infinity so nobody can ever land on them.
+        most = max(1, max(len(c) for cells in self._map_cells for c in cells))
+        shape = (len(self._map_cells), NUM_CELLS, most)
+        self.plat_x = np.zeros(shape)
+        self.plat_y = np.zeros(shape)
+        self.plat_w = np.full(shape, -np.inf)
+        for m, cells in enumerate(self._map_cells):
+            for c, platforms in enumerate(cells):
+                for i, p in enumerate(platforms):
+                    self.plat_x[m, c, i] = p.x
+                    self.plat_y[m, c, i] = p.y
+                    self.plat_w[m, c, i] = p.width
+        return index
+
+    # -------------------------------------------------------------------------
+    # Players
+    # -------------------------------------------------------------------------
+
+    def add_player(self, map_index, x, y, speed=PLAYER_SPEED, health=STARTING_HP):
+        """Put a new player in the store. Returns their slot number."""
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            if self.count == self.capacity:
+                self._grow(self.capacity * 2)
+            slot = self.count
+            self.count += 1
+
+        self.x[slot] = x
+        self.y[slot] = y
+        self.vel_x[slot] = 0
+        self.vel_y[slot] = 0
+        self.speed[slot] = speed
+        self.on_ground[slot] = False
+        self.facing_right[slot] = True
+        self.attack_cooldown[slot] = 0
+        self.attack_timer[slot] = 0
+        self.is_attacking[slot] = False
+        self.health[slot] = health
+        self.map_index[slot] = map_index
+        self.active[slot] = True
+        self.opponent[slot] = slot
+        self.melee_damage[slot] = 0
+        self.input_left[slot] = False
+        self.input_right[slot] = False
+        self.input_jump[slot] = False
+        return slot
+
+    def remove_player(self, slot):
+        """Free a slot so a new player can reuse it"""
+        self.active[slot] = False
+        self._free_slots.append(slot)
+
+    # -------------------------------------------------------------------------
+    # The vectorized step
+    # -------------------------------------------------------------------------
+
+    def step(self):
+        """Move every player one tick (same math as Player.move)"""
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        vel_x = self.vel_x[:n]
+        vel_y = self.vel_y[:n]
+        on_ground = self.on_ground[:n]
+        facing_right = self.facing_right[:n]
+        left = self.input_left[:n]
+        right = self.input_right[:n]
+
+        # Horizontal movement (right wins if both are held)
+        vel_x[:] = 0
+        vel_x[left] = -self.speed[:n][left]
+        vel_x[right] = self.speed[:n][right]
+        facing_right[left] = False
+        facing_right[right] = True
+
+        # Jump
+        jumping = self.input_jump[:n] & on_ground
+        vel_y[jumping] = JUMP_STRENGTH
+
+        # Apply gravity and update position
+        vel_y += GRAVITY
+        x += vel_x
+        y += vel_y
+
+        # Check ground collision against the platforms near each player.
+        # Player.move checks the platforms in order and the first one that
+        # catches the player decides where they land.
+        cells = np.floor_divide(x, CELL_SIZE).astype(np.int64)
+        np.clip(cells, 0, NUM_CELLS - 1, out=cells)
+        rows = self.map_index[:n] * NUM_CELLS + cells
+        most = self.plat_x.shape[2]
+        px = self.plat_x.reshape(-1, most).take(rows, axis=0)
+        py = self.plat_y.reshape(-1, most).take(rows, axis=0)
+        pw = self.plat_w.reshape(-1, most).take(rows, axis=0)
+        feet = (y + PLAYER_HEIGHT)[:, None]
+        landing = (x + PLAYER_WIDTH)[:, None] > px
+        landing &= x[:, None] < px + pw
+        landing &= feet <= py
+        landing &= feet + vel_y[:, None] >= py
+        landing &= (vel_y >= 0)[:, None]
+        landed = landing.any(axis=1)
+        first = landing.argmax(axis=1)
+        landed_on_y = py[np.arange(n), first]
+        y[landed] = landed_on_y[landed] - PLAYER_HEIGHT
+        vel_y[landed] = 0
+        on_ground[:] = landed
+
+        # Screen boundaries
+        np.clip(x, 0, SCREEN_WIDTH - PLAYER_WIDTH, out=x)
+        fell_off = y > SCREEN_HEIGHT
+        y[fell_off] = SCREEN_HEIGHT - PLAYER_HEIGHT
+        vel_y[fell_off] = 0
+        on_ground[fell_off] = True
+
+    def update_timers(self):
+        """Count down attack cooldowns and swing timers (Player.update_timers)"""
+        n = self.count
+        cooldown = self.attack_cooldown[:n]
+        cooldown -= cooldown > 0
+        timer = self.attack_timer[:n]
+        swinging = timer > 0
+        timer -= swinging
+        self.is_attacking[:n] &= swinging
+
+    def take_damage(self, slots, damage):
+        """Hurt some players at once (Player.take_damage).
+
+        A slot can be in slots more than once (two arrows in one tick).
+        """
+        np.subtract.at(self.health, slots, damage)
+        self.health[slots] = np.maximum(self.health[slots], 0)
+
+    def resolve_melee(self):
+        """Melee hits for everyone at once (same rules as simulation.melee_hit)"""
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        opponent = self.opponent[:n]
+        other_x = x.take(opponent)
+        other_y = y.take(opponent)
+
+        # Check if in range and facing target
+        in_range = np.where(
+            self.facing_right[:n],
+            (other_x > x) & (other_x < x + MELEE_RANGE + PLAYER_WIDTH),
+            (other_x < x) & (other_x > x - MELEE_RANGE - PLAYER_WIDTH),
+        )
+        # Check vertical alignment
+        vertical_align = np.abs((y + PLAYER_HEIGHT / 2) - (other_y + PLAYER_HEIGHT / 2)) < 40
+
+        hits = (self.is_attacking[:n]
+                & (self.attack_timer[:n] == ATTACK_FRAMES - 1)
+                & (self.melee_damage[:n] > 0)
+                & self.active[:n]
+                & in_range
+                & vertical_align)
+        attackers = np.flatnonzero(hits)
+        if len(attackers):
+            self.take_damage(opponent[attackers], self.melee_damage[attackers])
+
+    def knocked_out(self):
+        """Slots of active players with no HP left"""
+        n = self.count
+        return np.flatnonzero(self.active[:n] & (self.health[:n] <= 0)).tolist()
+
+
+# =============================================================================
+# PARITY CHECK - does the NumPy step match the one-at-a-time Player.move?
+# =============================================================================
+
+def check_parity(num_players=200, ticks=2000, seed=7):
+    """Run random inputs through both versions and compare every value.
+
+    Returns the number of mismatches (0 means bit-for-bit identical).
+    """
+    import random
+    from game_data import MAPS
+    from simulation import SimPlayer, platforms_for_map
+
+    rng = random.Random(seed)
+    store = WorldStore(capacity=4)
+    scalar_players = []
+    for i in range(num_players):
+        map_data = MAPS[i % len(MAPS)]
+        x, y = rng.randint(0, 1100), rng.randint(0, 600)
+        slot = store.add_player(store.add_map(map_data), x, y)
+        scalar_players.append((slot, SimPlayer(1, x, y), platforms_for_map(map_data)))
+
+    mismatches = 0
+    for _ in range(ticks):
+        for slot, player, platforms in scalar_players:
+            inputs = {
+                "left": rng.random() < 0.3,
+                "right": rng.random() < 0.3,
+                "jump": rng.random() < 0.1,
+            }
+            store.input_left[slot] = inputs["left"]
+            store.input_right[slot] = inputs["right"]
+            store.input_jump[slot] = inputs["jump"]
+            player.move(inputs, platforms)
+        store.step()
+
+        for slot, player, _ in scalar_players:
+            if (float(store.x[slot]) != player.x or
+                    float(store.y[slot]) != player.y or
+                    float(store.vel_x[slot]) != player.vel_x or
+                    float(store.vel_y[slot]) != player.vel_y or
+                    bool(store.on_ground[slot]) != player.on_ground or
+                    bool(store.facing_right[slot]) != player.facing_right):
+                mismatches += 1
+    return mismatches
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+# Run this file directly (python world_store.py) to compare stepping
+# players one at a time against the NumPy step.
+
+def _benchmark(num_players, ticks):
+    import random
+    import time
+    from game_data import MAPS
+    from simulation import SimPlayer, platforms_for_map
+
+    rng = random.Random(1)
+    store = WorldStore()
+    scalar_players = []
+    for i in range(num_players):
+        map_data = MAPS[i % len(MAPS)]
+        slot = store.add_player(store.add_map(map_data), 100 + i % 1000, 100)
+        scalar_players.append((SimPlayer(1, 100 + i % 1000, 100), platforms_for_map(map_data)))
+    store.input_right[:store.count] = [rng.random() < 0.5 for _ in range(store.count)]
+    store.input_jump[:store.count] = [rng.random() < 0.1 for _ in range(store.count)]
+    inputs = {"left": False, "right": True, "jump": True}
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for player, platforms in scalar_players:
+            player.move(inputs, platforms)
+    scalar = (time.perf_counter() - start) / ticks
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        store.step()
+    vectorized = (time.perf_counter() - start) / ticks
+    return scalar, vectorized
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("  PARITY CHECK")
+    print("=" * 50)
+    mismatches = check_parity()
+    print(f"  Mismatches vs scalar Player.move: {mismatches}")
+    print("  IDENTICAL!" if mismatches == 0 else "  DIFFERENT!")
+    print()
+
+    print("=" * 50)
+    print("  THROUGHPUT (player-steps per second)")
+    print("=" * 50)
+    for num_players, ticks in ((1, 2000), (100, 500), (10000, 20)):
+        scalar, vectorized = _benchmark(num_players, ticks)
+        print(f"  {num_players:>6} players: scalar {num_players / scalar:>12,.0f}/s"
+              f"   numpy {num_players / vectorized:>12,.0f}/s"
+              f"   ({scalar / vectorized:5.1f}x)")